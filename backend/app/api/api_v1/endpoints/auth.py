@@ -1,12 +1,14 @@
 from datetime import timedelta
 from typing import Any
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlmodel import select
 from sqlmodel.ext.asyncio.session import AsyncSession
 
 from app.api import deps
+from app.api.http_cache import check_not_modified, make_etag
 from app.core import security
+from app.db.query_counter import query_budget
 from app.db.session import get_session
 from app.models.user import User
 from app.schemas.auth_schemas import Token, UserCreate
@@ -14,6 +16,7 @@ from app.schemas.auth_schemas import Token, UserCreate
 router = APIRouter()
 
 @router.post("/login", response_model=Token)
+@query_budget(1)
 async def login_access_token(
     session: AsyncSession = Depends(get_session), 
     form_data: OAuth2PasswordRequestForm = Depends()
@@ -34,6 +37,7 @@ async def login_access_token(
     }
 
 @router.post("/register", response_model=Token)
+@query_budget(3)
 async def register(
     user_in: UserCreate,
     session: AsyncSession = Depends(get_session)
@@ -64,7 +68,10 @@ async def register(
     }
 
 @router.get("/me")
+@query_budget(2)
 async def read_users_me(
+    request: Request,
+    response: Response,
     session: AsyncSession = Depends(get_session),
     current_user: User = Depends(deps.get_current_user)
 ) -> Any:
@@ -72,6 +79,14 @@ async def read_users_me(
     from app.models.organization import Organization
     org_res = await session.exec(select(Organization).where(Organization.owner_id == current_user.id))
     org = org_res.first()
+
+    etag = make_etag(
+        "me", current_user.id, current_user.email, current_user.full_name,
+        org.id if org else None, org.data_version if org else None, org.credits_used if org else None
+    )
+    not_modified = check_not_modified(request, response, etag)
+    if not_modified:
+        return not_modified
     
     return {
         "id": current_user.id,
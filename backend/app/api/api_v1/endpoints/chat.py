@@ -1,29 +1,59 @@
+import asyncio
+import json
+import time
 import uuid
-from fastapi import APIRouter, Depends, HTTPException
+from datetime import datetime, timezone
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from sqlmodel.ext.asyncio.session import AsyncSession
-from sqlmodel import select
+from sqlalchemy import update
+from sqlmodel import func, select
 from pydantic import BaseModel
 
-from app.db.session import get_session
-from app.models import Conversation, Message, Section, User
-from app.services.vector_service import vector_service
-from app.services.llm_service import llm_service
+from app.core.config import settings
+from app.db.query_counter import query_budget
+from app.db.session import get_session, async_session_factory
+from app.models import Conversation, ConversationArchive, Message, Section, User
+from app.services.vector_service import build_filter, vector_service
+from app.services.llm_service import LLMError, llm_service
+from app.services.message_journal import message_journal
+from app.services.conversation_archive import load_segment
+from app.services.ingestion_service import touch_org
+from app.services.cache_bus import LocalCache, cache_bus
 from app.api import deps
+from app.api.http_cache import check_not_modified, make_etag
 
 router = APIRouter()
 
-from typing import List
+from typing import List, Optional
 from app.models import Conversation, Message, Section
 
 # ... previous imports ...
 
+class RetrievalScope(BaseModel):
+    # Only documents tagged with one of these sections (plus untagged ones unless include_untagged is false)
+    tags: Optional[List[str]] = None
+    include_untagged: bool = True
+    # File extensions, e.g. ["pdf", "xlsx"]
+    doc_types: Optional[List[str]] = None
+    filenames: Optional[List[str]] = None
+    # Only documents uploaded in the last N days
+    since_days: Optional[int] = None
+
 class SectionResponse(BaseModel):
     id: uuid.UUID
     name: str
     role_persona: str
+    retrieval_scope: Optional[RetrievalScope] = None
+
+# Sections per org, dropped on "sections:<org_id>" invalidations
+sections_cache = LocalCache("sections:", ttl_seconds=settings.SECTIONS_CACHE_TTL_SECONDS)
 
 @router.get("/sections", response_model=List[SectionResponse])
+@query_budget(3)
 async def list_sections(
+    request: Request,
+    response: Response,
     session: AsyncSession = Depends(get_session),
     current_user: User = Depends(deps.get_current_user)
 ):
@@ -38,8 +68,47 @@ async def list_sections(
     if not org:
         return []
 
-    result = await session.exec(select(Section).where(Section.org_id == org.id))
-    return result.all()
+    not_modified = check_not_modified(request, response, make_etag("sections", org.id, org.data_version))
+    if not_modified:
+        return not_modified
+
+    sections = sections_cache.get(str(org.id))
+    if sections is None:
+        result = await session.exec(select(Section).where(Section.org_id == org.id))
+        sections = [SectionResponse.model_validate(s, from_attributes=True) for s in result.all()]
+        sections_cache.set(str(org.id), sections)
+    return sections
+
+@router.put("/sections/{section_id}/scope", response_model=SectionResponse)
+@query_budget(4)
+async def set_section_scope(
+    section_id: uuid.UUID,
+    scope: RetrievalScope,
+    session: AsyncSession = Depends(get_session),
+    current_user: User = Depends(deps.get_current_user)
+):
+    """
+    Restrict which documents an agent retrieves from. Pushed down to the
+    vector store as a metadata filter, so scoped searches only scan matching chunks.
+    """
+    from app.models import Organization
+    result = await session.exec(
+        select(Section, Organization)
+        .join(Organization, Organization.id == Section.org_id)
+        .where(Section.id == section_id, Organization.owner_id == current_user.id)
+    )
+    row = result.first()
+    if not row:
+        raise HTTPException(status_code=404, detail="Section not found")
+    section, org = row
+
+    scope_data = scope.model_dump(exclude_none=True)
+    section.retrieval_scope = scope_data if build_filter(scope_data) else None
+    session.add(section)
+    await touch_org(session, org.id)
+    await session.commit()
+    await cache_bus.publish(f"sections:{org.id}")
+    return SectionResponse.model_validate(section, from_attributes=True)
 
 class ChatRequest(BaseModel):
     conversation_id: uuid.UUID
@@ -48,68 +117,365 @@ class ChatRequest(BaseModel):
 class ChatResponse(BaseModel):
     response: str
 
+async def _persist_turn(session: AsyncSession, messages: List[Message], org_id: Optional[uuid.UUID], credits: int = 1):
+    """
+    Save a chat turn and charge its credits to org_id (None when the credit
+    was already reserved).
+    With MESSAGE_WRITE_BEHIND the turn goes to the message journal and is
+    flushed in batches; otherwise it is committed before responding.
+    """
+    if message_journal.enabled:
+        await message_journal.append_turn(messages, org_id, credits=credits if org_id else 0)
+        return
+
+    session.add_all(messages)
+    if org_id:
+        from app.models import Organization
+        await session.execute(
+            update(Organization)
+            .where(Organization.id == org_id)
+            .values(credits_used=Organization.credits_used + credits)
+        )
+    await session.commit()
+
+async def _load_chat_context(session: AsyncSession, conversation_id: uuid.UUID, user_id: uuid.UUID):
+    """
+    Conversation, Section and Organization in one query, only if the user owns the org.
+    """
+    from app.models import Organization
+    result = await session.exec(
+        select(Conversation, Section, Organization)
+        .join(Section, Section.id == Conversation.section_id)
+        .join(Organization, Organization.id == Section.org_id)
+        .where(Conversation.id == conversation_id, Organization.owner_id == user_id)
+    )
+    row = result.first()
+    if not row:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    return row
+
+async def _reserve_credit(org_id: uuid.UUID, credits: int = 1):
+    """
+    Charge credits up front, atomically, unless that would take the org past
+    its limit. Uses its own session so it can run alongside the other stages.
+    """
+    from app.models import Organization
+    limit = 100 - message_journal.pending_credits(org_id)
+    async with async_session_factory() as db:
+        result = await db.execute(
+            update(Organization)
+            .where(Organization.id == org_id, Organization.credits_used + credits <= limit)
+            .values(credits_used=Organization.credits_used + credits)
+        )
+        await db.commit()
+    if result.rowcount != 1:
+        raise HTTPException(status_code=403, detail="Credit limit reached. Please upgrade your plan.")
+
+async def _refund_credit(org_id: uuid.UUID, credits: int = 1):
+    from app.models import Organization
+    async with async_session_factory() as db:
+        await db.execute(
+            update(Organization)
+            .where(Organization.id == org_id)
+            .values(credits_used=Organization.credits_used - credits)
+        )
+        await db.commit()
+
+async def _load_recent_history(conversation_id: uuid.UUID, limit: int) -> List[tuple]:
+    """
+    Last `limit` messages of the conversation as (role, content), oldest first,
+    including turns still in the write-behind journal.
+    """
+    if limit <= 0:
+        return []
+    async with async_session_factory() as db:
+        result = await db.exec(
+            select(Message)
+            .where(Message.conversation_id == conversation_id)
+            .order_by(Message.timestamp.desc())
+            .limit(limit)
+        )
+        messages = list(result.all())
+    stored_ids = {m.id for m in messages}
+    messages += [m for m in message_journal.pending_messages(conversation_id) if m.id not in stored_ids]
+    messages.sort(key=lambda m: m.timestamp)
+    return [(m.role, m.content) for m in messages[-limit:]]
+
+async def _run_stage(*aws):
+    """
+    Run independent steps concurrently. The first failure cancels the others
+    and is re-raised, so e.g. a rejected credit reservation stops retrieval.
+    """
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+async def _with_credit_reservation(org_id: uuid.UUID, *aws):
+    """
+    Run steps concurrently with a credit reservation (the next stage needs both).
+    If anything fails or is cancelled, a credit already taken is refunded.
+    Returns the steps' results.
+    """
+    reservation = asyncio.create_task(_reserve_credit(org_id))
+    try:
+        # Shielded so a cancel can't land between the UPDATE and knowing its outcome
+        *results, _ = await _run_stage(*aws, asyncio.shield(reservation))
+    except BaseException:
+        await asyncio.wait([reservation])
+        if not reservation.cancelled() and reservation.exception() is None:
+            await _refund_credit(org_id)
+        raise
+    return results
+
 @router.post("/", response_model=ChatResponse)
+@query_budget(5)
 async def chat(
     request: ChatRequest, 
+    response: Response,
     session: AsyncSession = Depends(get_session),
     current_user: User = Depends(deps.get_current_user)
 ):
-    # 1. Fetch Conversation and Section
-    conversation = await session.get(Conversation, request.conversation_id)
-    if not conversation:
-        raise HTTPException(status_code=404, detail="Conversation not found")
-    
-    # Eager loading isn't automatic in async SQLModel usually, so might need to fetch section
-    # But if we access relationships often need simple select or explict join
-    # Let's fetch section manually to be safe
-    section = await session.get(Section, conversation.section_id)
-    if not section:
-        raise HTTPException(status_code=404, detail="Section not found")
+    """
+    Staged pipeline:
+    1. Conversation, section and org in one query (with ownership check)
+    2. Retrieval, credit reservation and recent history, concurrently
+    3. Generation (the credit is refunded if it fails)
+    4. Save the turn
+    Stage durations are reported in the Server-Timing header.
+    """
+    # Stamp the user message on arrival so it sorts before the reply
+    received_at = datetime.utcnow()
+    started = time.perf_counter()
 
-    # 2. Vector Search
-    # Pass org_id to ensure we only search this organization's namespace
-    context_docs = vector_service.search(
-        query=request.message, 
-        org_id=str(section.org_id)
-    )
-    context_text = "\n\n".join(context_docs)
+    # 1. Context
+    conversation, section, org = await _load_chat_context(session, request.conversation_id, current_user.id)
+    loaded = time.perf_counter()
 
-    # 3. LLM Call
-    response_text = await llm_service.get_response(
-        system_prompt=section.system_prompt_template,
-        user_message=request.message,
-        context=context_text
+    # 2. Everything generation depends on. Pass org_id to ensure we only search
+    # this organization's namespace; the section scope is pushed down as a filter.
+    context_docs, history = await _with_credit_reservation(
+        org.id,
+        asyncio.to_thread(
+            vector_service.search, request.message, str(org.id),
+            filter=build_filter(section.retrieval_scope)
+        ),
+        _load_recent_history(conversation.id, settings.CHAT_HISTORY_MESSAGES),
     )
+    prepared = time.perf_counter()
 
-    # 4. Save Messages & Increment Credits
-    from app.models.organization import Organization
-    org_res = await session.exec(select(Organization).where(Organization.id == section.org_id))
-    org = org_res.first()
-    
-    if org:
-        if org.credits_used >= 100:
-            raise HTTPException(status_code=403, detail="Credit limit reached. Please upgrade your plan.")
-        org.credits_used += 1
+    # 3. LLM Call
+    try:
+        response_text = await llm_service.generate(
+            system_prompt=section.system_prompt_template,
+            user_message=request.message,
+            context=context_docs,
+            history=history
+        )
+    except LLMError as e:
+        await _refund_credit(org.id)
+        raise HTTPException(status_code=502, detail=f"Error contacting Gemini: {e}")
+    except BaseException:
+        await asyncio.shield(_refund_credit(org.id))
+        raise
+    generated = time.perf_counter()
 
+    # 4. Save Messages (the credit was charged in stage 2)
     user_msg = Message(
         conversation_id=conversation.id,
         role="user",
-        content=request.message
+        content=request.message,
+        timestamp=received_at
     )
-    session.add(user_msg)
-    
     ai_msg = Message(
         conversation_id=conversation.id,
         role="assistant",
         content=response_text
     )
-    session.add(ai_msg)
-    
-    await session.commit()
+    await _persist_turn(session, [user_msg, ai_msg], None)
 
+    response.headers["Server-Timing"] = ", ".join(
+        f"{name};dur={(end - start) * 1000:.1f}" for name, start, end in (
+            ("context", started, loaded),
+            ("prepare", loaded, prepared),
+            ("generate", prepared, generated),
+            ("save", generated, time.perf_counter()),
+        )
+    )
     return ChatResponse(response=response_text)
 
+BOARD_CHAIR_PROMPT = (
+    "You are chairing a board meeting of the company's executives. "
+    "You are given each executive's answer to the founder's question. "
+    "Summarize where they agree, call out the key disagreements, and end with one recommended next step. "
+    "Be concise and do not invent numbers that none of the executives cited."
+)
+
+class BoardMeetingRequest(BaseModel):
+    message: str
+    # Defaults to every Section of the org
+    section_ids: Optional[List[uuid.UUID]] = None
+    synthesize: bool = False
+
+async def _get_or_create_conversations(session: AsyncSession, sections: List[Section]) -> dict:
+    """
+    Latest conversation per section (same thread start_conversation reuses), creating missing ones.
+    """
+    result = await session.exec(
+        select(Conversation)
+        .where(Conversation.section_id.in_([s.id for s in sections]))
+        .order_by(Conversation.created_at.desc())
+    )
+    conversations = {}
+    for conv in result.all():
+        conversations.setdefault(conv.section_id, conv.id)
+
+    missing = [Conversation(section_id=s.id, title="New Chat") for s in sections if s.id not in conversations]
+    if missing:
+        session.add_all(missing)
+        await session.commit()
+        for conv in missing:
+            conversations[conv.section_id] = conv.id
+    return conversations
+
+@router.post("/board")
+@query_budget(6)
+async def board_meeting(
+    request: BoardMeetingRequest,
+    session: AsyncSession = Depends(get_session),
+    current_user: User = Depends(deps.get_current_user)
+):
+    """
+    Ask several agents the same question at once.
+    The question is embedded once and searched once per distinct section
+    scope, then the agents generate concurrently.
+    Streams newline-delimited JSON: one "agent" event per answer as it
+    completes (or an "error" event with its section_id, not charged), an
+    optional "synthesis" event, then "done".
+    """
+    from app.models import Organization
+    org_res = await session.exec(select(Organization).where(Organization.owner_id == current_user.id))
+    org = org_res.first()
+    if not org:
+        raise HTTPException(status_code=400, detail="No organization found. Please complete onboarding first.")
+
+    query = select(Section).where(Section.org_id == org.id)
+    if request.section_ids:
+        query = query.where(Section.id.in_(request.section_ids))
+    sections = (await session.exec(query)).all()
+    if not sections:
+        raise HTTPException(status_code=404, detail="Section not found")
+
+    # Reserved up front and refunded for every answer that isn't delivered
+    credits_needed = len(sections) + (1 if request.synthesize else 0)
+    org_id = org.id
+    await _reserve_credit(org_id, credits_needed)
+    unspent = credits_needed
+
+    try:
+        conversations = await _get_or_create_conversations(session, sections)
+        received_at = datetime.utcnow()
+
+        # One embedding, and one vector query per distinct retrieval scope
+        embedding = await asyncio.to_thread(vector_service.embed_query, request.message)
+        scope_keys = {}
+        filters = {}
+        for section in sections:
+            scope_filter = build_filter(section.retrieval_scope)
+            scope_keys[section.id] = json.dumps(scope_filter, sort_keys=True)
+            filters.setdefault(scope_keys[section.id], scope_filter)
+        results = await asyncio.gather(*[
+            asyncio.to_thread(vector_service.search, request.message, str(org_id), filter=f, embedding=embedding)
+            for f in filters.values()
+        ])
+    except BaseException:
+        await asyncio.shield(_refund_credit(org_id, credits_needed))
+        raise
+    context_by_scope = dict(zip(filters.keys(), results))
+    section_context = {section_id: context_by_scope[key] for section_id, key in scope_keys.items()}
+
+    semaphore = asyncio.Semaphore(settings.BOARD_MEETING_CONCURRENCY)
+
+    async def ask(section: Section):
+        async with semaphore:
+            try:
+                response_text = await llm_service.generate(
+                    system_prompt=section.system_prompt_template,
+                    user_message=request.message,
+                    context=section_context[section.id]
+                )
+            except LLMError as e:
+                return section, None, e
+        return section, response_text, None
+
+    async def save(section: Section, response_text: str):
+        nonlocal unspent
+        # The request session may already be closed while streaming
+        async with async_session_factory() as db:
+            conversation_id = conversations[section.id]
+            await _persist_turn(db, [
+                Message(conversation_id=conversation_id, role="user", content=request.message, timestamp=received_at),
+                Message(conversation_id=conversation_id, role="assistant", content=response_text),
+            ], None)
+        # Inside the shielded save, so a disconnect right after can't refund it
+        unspent -= 1
+
+    async def events():
+        nonlocal unspent
+        tasks = [asyncio.create_task(ask(section)) for section in sections]
+        answers = []
+        try:
+            for next_answer in asyncio.as_completed(tasks):
+                section, response_text, error = await next_answer
+                if error:
+                    print(f"Board meeting agent {section.id} failed: {error}")
+                    yield json.dumps({
+                        "type": "error",
+                        "section_id": str(section.id),
+                        "name": section.name,
+                        "detail": f"Error contacting Gemini: {error}",
+                    }) + "\n"
+                    continue
+                await asyncio.shield(save(section, response_text))
+                answers.append((section, response_text))
+                yield json.dumps({
+                    "type": "agent",
+                    "section_id": str(section.id),
+                    "name": section.name,
+                    "role_persona": section.role_persona,
+                    "conversation_id": str(conversations[section.id]),
+                    "response": response_text,
+                }) + "\n"
+
+            if request.synthesize and answers:
+                try:
+                    synthesis = await llm_service.generate(
+                        system_prompt=BOARD_CHAIR_PROMPT,
+                        user_message=request.message,
+                        context=[f"{section.name} ({section.role_persona}):\n{text}" for section, text in answers]
+                    )
+                except LLMError as e:
+                    print(f"Board meeting synthesis failed: {e}")
+                    yield json.dumps({"type": "error", "section_id": None, "detail": f"Error contacting Gemini: {e}"}) + "\n"
+                else:
+                    unspent -= 1
+                    yield json.dumps({"type": "synthesis", "response": synthesis}) + "\n"
+
+            yield json.dumps({"type": "done"}) + "\n"
+        finally:
+            # Client went away: stop paying for generations nobody will read
+            for task in tasks:
+                task.cancel()
+            if unspent:
+                await asyncio.shield(_refund_credit(org_id, unspent))
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
 @router.post("/start", response_model=uuid.UUID)
+@query_budget(3)
 async def start_conversation(
     section_id: uuid.UUID, 
     session: AsyncSession = Depends(get_session),
@@ -136,7 +502,7 @@ async def start_conversation(
     conv = Conversation(section_id=section_id, title="New Chat")
     session.add(conv)
     await session.commit()
-    await session.refresh(conv)
+    # id is generated client-side, no refresh round trip needed
     return conv.id
 
 class MessageResponse(BaseModel):
@@ -146,20 +512,93 @@ class MessageResponse(BaseModel):
     timestamp: str
 
 @router.get("/{conversation_id}/history", response_model=List[MessageResponse])
+@query_budget(4)
 async def get_chat_history(
     conversation_id: uuid.UUID,
+    request: Request,
+    response: Response,
+    before: Optional[datetime] = None,
+    limit: int = Query(default=settings.CHAT_HISTORY_PAGE_SIZE, ge=1, le=1000),
     session: AsyncSession = Depends(get_session),
     current_user: User = Depends(deps.get_current_user)
 ):
-    # Verify ownership via section->org->owner? 
-    # For speed, we just trust the ID but strictly we should check.
-    
-    msgs = await session.exec(select(Message).where(Message.conversation_id == conversation_id).order_by(Message.timestamp))
+    """
+    The newest `limit` messages (older than `before`, for scrolling back), in
+    timestamp order. Archived ranges are rehydrated from S3 only when the
+    requested window reaches into them. X-Has-More says whether a request
+    with before=<oldest returned timestamp> would return anything.
+    """
+    from app.models import Organization
+    if before and before.tzinfo:
+        before = before.astimezone(timezone.utc).replace(tzinfo=None)
+
+    # Cheap version stamp (served by the conversation_id/timestamp index)
+    # so unchanged polls skip loading and serializing the messages.
+    # Ownership is checked in the same round trip.
+    pending = message_journal.pending_messages(conversation_id)
+    archived_segments = (
+        select(func.count(ConversationArchive.id))
+        .where(ConversationArchive.conversation_id == conversation_id)
+        .scalar_subquery()
+    )
+    owned = (
+        select(Conversation.id)
+        .join(Section, Section.id == Conversation.section_id)
+        .join(Organization, Organization.id == Section.org_id)
+        .where(Conversation.id == conversation_id, Organization.owner_id == current_user.id)
+        .exists()
+    )
+    stamp = await session.exec(
+        select(func.count(Message.id), func.max(Message.timestamp), archived_segments, owned)
+        .where(Message.conversation_id == conversation_id)
+    )
+    count, latest, segments, is_owner = stamp.one()
+    if not is_owner:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    etag = make_etag("history", conversation_id, count, latest, segments, before, limit, *[m.id for m in pending])
+    not_modified = check_not_modified(request, response, etag)
+    if not_modified:
+        return not_modified
+
+    query = select(Message).where(Message.conversation_id == conversation_id)
+    if before:
+        query = query.where(Message.timestamp < before)
+    # One extra row tells us whether there is anything further back
+    query = query.order_by(Message.timestamp.desc()).limit(limit + 1)
+    msgs = await session.exec(query)
+    messages = list(msgs.all())
+
+    # Include turns still waiting in the write-behind journal
+    if pending:
+        stored_ids = {m.id for m in messages}
+        messages += [m for m in pending if m.id not in stored_ids and (not before or m.timestamp < before)]
+
+    # Scrolled back past the hot rows: pull in archived segments, newest first
+    if segments and len(messages) <= limit:
+        archive_query = select(ConversationArchive).where(ConversationArchive.conversation_id == conversation_id)
+        if before:
+            archive_query = archive_query.where(ConversationArchive.first_timestamp < before)
+        archives = await session.exec(archive_query.order_by(ConversationArchive.last_timestamp.desc()))
+        for archive in archives.all():
+            try:
+                archived = await load_segment(archive)
+            except Exception as e:
+                print(f"Failed to load archived segment {archive.s3_key}: {e}")
+                raise HTTPException(status_code=503, detail="Archived history temporarily unavailable")
+            messages += [m for m in archived if not before or m.timestamp < before]
+            if len(messages) > limit:
+                break
+
+    messages.sort(key=lambda m: m.timestamp)
+    # Older messages exist: the client pages back with ?before=<oldest timestamp>
+    response.headers["X-Has-More"] = "true" if len(messages) > limit else "false"
+    messages = messages[-limit:]
+
     return [
         MessageResponse(
             id=m.id, 
             role=m.role, 
             content=m.content, 
             timestamp=m.timestamp.isoformat()
-        ) for m in msgs.all()
+        ) for m in messages
     ]
@@ -0,0 +1,224 @@
+"""
+Persistent chat sessions over WebSocket: /chat/ws/{conversation_id}?token=<jwt>
+
+The token, conversation, section and org (and recent history) are loaded once
+on connect and kept for the session, so a turn only costs retrieval and the
+credit reservation (concurrently), generation and the save.
+Runs alongside the REST endpoint and shares its persistence and credits.
+
+Client -> server (JSON text frames):
+    {"type": "message", "message": "..."}   start a turn
+    {"type": "cancel"}                       stop the turn in flight
+    {"type": "ping"} / {"type": "pong"}      heartbeat
+
+Server -> client:
+    {"type": "ready", "conversation_id", "section"}
+    {"type": "token", "text"}                streamed response text
+    {"type": "done", "message_id", "response"}
+    {"type": "cancelled"} / {"type": "error", "detail"}
+        ending a turn: nothing was saved or charged, discard its tokens
+    {"type": "ping"} / {"type": "pong"}
+
+The server pings every WS_HEARTBEAT_INTERVAL_SECONDS and closes sessions
+that stay silent for WS_IDLE_TIMEOUT_SECONDS. Outgoing events go through a
+bounded queue: if the client reads slowly, generation waits for it, while
+control replies (pong, ping, errors to bad frames) are dropped instead so
+cancel frames are still read.
+"""
+import asyncio
+import json
+import uuid
+from datetime import datetime
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect, status
+
+from app.core.config import settings
+from app.db.session import async_session_factory
+from app.models import Message
+from app.services.cache_bus import cache_bus
+from app.services.llm_service import LLMError, llm_service
+from app.services.vector_service import build_filter, vector_service
+from app.api import deps
+from app.api.api_v1.endpoints.chat import (
+    _load_chat_context, _load_recent_history, _persist_turn, _refund_credit, _with_credit_reservation
+)
+
+router = APIRouter()
+
+
+class ChatSession:
+    def __init__(self, websocket: WebSocket, conversation_id: uuid.UUID, user_id: uuid.UUID):
+        self.websocket = websocket
+        self.conversation_id = conversation_id
+        self.user_id = user_id
+        self.outbox: asyncio.Queue = asyncio.Queue(maxsize=settings.WS_SEND_QUEUE_SIZE)
+        self.generation: Optional[asyncio.Task] = None
+        self.stale = False
+
+    async def load_context(self):
+        async with async_session_factory() as session:
+            conversation, section, org = await _load_chat_context(session, self.conversation_id, self.user_id)
+        self.section = section
+        self.org_id = org.id
+        self.scope_filter = build_filter(section.retrieval_scope)
+        # Kept up to date in memory after this, so turns don't reload it
+        self.history = await _load_recent_history(self.conversation_id, settings.CHAT_HISTORY_MESSAGES)
+        self.stale = False
+
+    def _invalidate(self, key: str):
+        # Section prompt or scope changed: reload before the next turn
+        self.stale = True
+
+    async def run(self):
+        cache_bus.subscribe(f"sections:{self.org_id}", self._invalidate)
+        tasks = [asyncio.create_task(self._send_loop()), asyncio.create_task(self._heartbeat())]
+        try:
+            await self.send({
+                "type": "ready",
+                "conversation_id": str(self.conversation_id),
+                "section": {"id": str(self.section.id), "name": self.section.name, "role_persona": self.section.role_persona},
+            })
+            await self._receive_loop()
+        finally:
+            cache_bus.unsubscribe(f"sections:{self.org_id}", self._invalidate)
+            if self.generation:
+                self.generation.cancel()
+            for task in tasks:
+                task.cancel()
+
+    async def send(self, event: dict):
+        # Blocks while the queue is full, which is what slows generation down
+        await self.outbox.put(event)
+
+    def reply(self, event: dict):
+        # Control replies from the receive loop never wait on a full queue, so
+        # cancel frames and the idle timeout keep working under backpressure;
+        # a client that isn't reading doesn't miss much by losing them
+        try:
+            self.outbox.put_nowait(event)
+        except asyncio.QueueFull:
+            pass
+
+    async def _send_loop(self):
+        while True:
+            event = await self.outbox.get()
+            await self.websocket.send_text(json.dumps(event))
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(settings.WS_HEARTBEAT_INTERVAL_SECONDS)
+            # Dropped if the client hasn't read anything for a whole heartbeat; the idle timeout decides
+            self.reply({"type": "ping"})
+
+    async def _receive_loop(self):
+        while True:
+            try:
+                raw = await asyncio.wait_for(self.websocket.receive_text(), timeout=settings.WS_IDLE_TIMEOUT_SECONDS)
+            except asyncio.TimeoutError:
+                await self.websocket.close(code=status.WS_1001_GOING_AWAY)
+                return
+
+            try:
+                data = json.loads(raw)
+            except ValueError:
+                self.reply({"type": "error", "detail": "Invalid JSON"})
+                continue
+            kind = data.get("type") if isinstance(data, dict) else None
+
+            if kind == "ping":
+                self.reply({"type": "pong"})
+            elif kind == "pong":
+                pass
+            elif kind == "cancel":
+                if self.generation and not self.generation.done():
+                    self.generation.cancel()
+            elif kind == "message":
+                message = data.get("message")
+                if not isinstance(message, str) or not message.strip():
+                    self.reply({"type": "error", "detail": "Message must be a non-empty string"})
+                elif self.generation and not self.generation.done():
+                    self.reply({"type": "error", "detail": "A response is already in progress"})
+                else:
+                    self.generation = asyncio.create_task(self._turn(message, datetime.utcnow()))
+            else:
+                self.reply({"type": "error", "detail": f"Unknown message type: {kind}"})
+
+    async def _turn(self, message: str, received_at: datetime):
+        charged = False
+
+        async def save(messages):
+            nonlocal charged
+            await self._save(messages)
+            # Cleared here rather than after the shield: a cancel during the
+            # save must not refund a turn that did get saved
+            charged = False
+        try:
+            if self.stale:
+                await self.load_context()
+            # Credit is reserved alongside retrieval and refunded unless the turn is saved
+            context_docs, = await _with_credit_reservation(
+                self.org_id,
+                asyncio.to_thread(vector_service.search, message, str(self.org_id), filter=self.scope_filter),
+            )
+            charged = True
+
+            parts = []
+            async for text in llm_service.stream_response(
+                system_prompt=self.section.system_prompt_template,
+                user_message=message,
+                context=context_docs,
+                history=self.history
+            ):
+                parts.append(text)
+                await self.send({"type": "token", "text": text})
+            response_text = "".join(parts)
+
+            user_msg = Message(conversation_id=self.conversation_id, role="user", content=message, timestamp=received_at)
+            ai_msg = Message(conversation_id=self.conversation_id, role="assistant", content=response_text)
+            # A cancel arriving now must not leave the turn half saved
+            await asyncio.shield(save([user_msg, ai_msg]))
+            self.history = (self.history + [("user", message), ("assistant", response_text)])[-settings.CHAT_HISTORY_MESSAGES:] \
+                if settings.CHAT_HISTORY_MESSAGES > 0 else []
+            await self.send({"type": "done", "message_id": str(ai_msg.id), "response": response_text})
+        except asyncio.CancelledError:
+            self.reply({"type": "cancelled"})
+            raise
+        except HTTPException as e:
+            await self.send({"type": "error", "detail": e.detail})
+        except LLMError as e:
+            # Tokens already sent belong to a failed answer; the client drops them on "error"
+            print(f"WebSocket chat generation failed: {e}")
+            await self.send({"type": "error", "detail": f"Error contacting Gemini: {e}"})
+        except Exception as e:
+            print(f"WebSocket chat turn failed: {e}")
+            await self.send({"type": "error", "detail": "Failed to generate a response"})
+        finally:
+            if charged:
+                await asyncio.shield(_refund_credit(self.org_id))
+
+    async def _save(self, messages):
+        async with async_session_factory() as db:
+            await _persist_turn(db, messages, None)
+
+
+@router.websocket("/ws/{conversation_id}")
+async def chat_websocket(websocket: WebSocket, conversation_id: uuid.UUID, token: str = ""):
+    """
+    Persistent chat session for one conversation (see module docstring for the protocol).
+    Browsers can't set headers on WebSockets, so the JWT comes as ?token=.
+    """
+    await websocket.accept()
+    try:
+        async with async_session_factory() as db:
+            user = await deps.user_from_token(db, token)
+        session = ChatSession(websocket, conversation_id, user.id)
+        await session.load_context()
+    except HTTPException as e:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=e.detail)
+        return
+
+    try:
+        await session.run()
+    except WebSocketDisconnect:
+        pass
@@ -1,13 +1,26 @@
+import asyncio
+import hashlib
+import mimetypes
+import os
 import uuid
-from fastapi import APIRouter, UploadFile, File, Depends, HTTPException
+from typing import AsyncIterator, Dict, List, Optional, Tuple, Union
+from fastapi import APIRouter, UploadFile, File, Form, Depends, HTTPException, Request, Response
 from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy.exc import IntegrityError
 from sqlmodel import select
 
+from app.core.config import settings
+from app.db.query_counter import query_budget
 from app.db.session import get_session
 from app.models import Document, Organization, User
-from app.services.vector_service import vector_service
+from app.services.vector_service import VectorIndexError, vector_service
 from app.services.s3_service import s3_service
+from app.services.ingestion_service import (
+    claim_document, document_metadata, find_by_hash, index_document, touch_org
+)
+from app.services.document_parser import extract_text, is_archive, iter_archive_entries, read_upload
 from app.api import deps
+from app.api.http_cache import check_not_modified, make_etag
 
 router = APIRouter()
 
@@ -18,9 +31,63 @@ class DocumentResponse(BaseModel):
     id: uuid.UUID
     filename: str
     upload_date: datetime.datetime
+    status: str
+    section_tags: Optional[List[str]] = None
+
+def _parse_section_tags(sections: Optional[str]) -> Optional[List[str]]:
+    """
+    Comma separated section names from a form field. Empty or "all" means every section.
+    """
+    if not sections:
+        return None
+    tags = list(dict.fromkeys(t.strip() for t in sections.split(",") if t.strip()))
+    if not tags or "all" in tags:
+        return None
+    return tags
+
+def _deduplicated(duplicate: Document, section_tags: Optional[List[str]], **extra) -> dict:
+    """
+    Response for an upload whose content the org already has. Requested
+    sections are not merged into the existing document's, so say so.
+    """
+    response = {**extra, "document_id": duplicate.id, "deduplicated": True}
+    if section_tags and section_tags != duplicate.section_tags:
+        response["sections_ignored"] = section_tags
+        response["detail"] = "Content already uploaded; its sections were left unchanged (set them with PUT /documents/{id}/sections)"
+    return response
+
+async def _get_owned_document(session: AsyncSession, current_user: User, doc_id: uuid.UUID) -> Document:
+    result = await session.exec(
+        select(Document)
+        .join(Organization, Organization.id == Document.org_id)
+        .where(Document.id == doc_id, Organization.owner_id == current_user.id)
+    )
+    doc = result.first()
+    if not doc:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return doc
+
+async def _delete_document(session: AsyncSession, doc: Document):
+    """
+    Remove a document's vectors, S3 object and row.
+    Vectors go first so a failure never leaves searchable content without a row;
+    anything left behind is picked up by the vector reconciler.
+    """
+    await asyncio.to_thread(vector_service.delete_document, str(doc.id), str(doc.org_id))
+
+    key = s3_service.key_from_url(doc.s3_url)
+    if key:
+        if doc.status == "pending" and doc.upload_id:
+            await asyncio.to_thread(s3_service.abort_multipart_upload, key, doc.upload_id)
+        await asyncio.to_thread(s3_service.delete_file, key)
+
+    await session.delete(doc)
 
 @router.get("/", response_model=list[DocumentResponse])
+@query_budget(3)
 async def list_documents(
+    request: Request,
+    response: Response,
     session: AsyncSession = Depends(get_session),
     current_user: User = Depends(deps.get_current_user)
 ):
@@ -30,12 +97,18 @@ async def list_documents(
     if not org:
         return []
 
+    not_modified = check_not_modified(request, response, make_etag("documents", org.id, org.data_version))
+    if not_modified:
+        return not_modified
+
     docs = await session.exec(select(Document).where(Document.org_id == org.id).order_by(Document.upload_date.desc()))
     return docs.all()
 
 @router.post("/upload")
+@query_budget(5)
 async def upload_document(
     file: UploadFile = File(...), 
+    sections: Optional[str] = Form(None),
     session: AsyncSession = Depends(get_session),
     current_user: User = Depends(deps.get_current_user)
 ):
@@ -46,57 +119,440 @@ async def upload_document(
     
     if not org:
         raise HTTPException(status_code=400, detail="No organization found. Please complete onboarding first.")
+    # Kept aside: a rollback expires org and reading it afterwards would need IO
+    org_id = org.id
 
-    # Read file content
-    content = await file.read()
-    text_content = ""
-    
-    # Simple parse based on extension
-    if file.filename.endswith(".txt") or file.filename.endswith(".md"):
-        text_content = content.decode("utf-8")
-    elif file.filename.endswith(".pdf"):
-        import io
-        import pypdf
-        try:
-            pdf_file = io.BytesIO(content)
-            reader = pypdf.PdfReader(pdf_file)
-            text_content = ""
-            for page in reader.pages:
-                text_content += page.extract_text() + "\n"
-        except Exception as e:
-            text_content = f"Error parsing PDF: {str(e)}"
-    else:
-         text_content = str(content) # Fallback
+    # Read file content, hashing as we stream it
+    content, content_sha256 = await read_upload(file)
+    section_tags = _parse_section_tags(sections)
+
+    # Same content already in this org: hand back that document instead of
+    # re-uploading, re-parsing and re-embedding
+    duplicate = await find_by_hash(session, org_id, content_sha256)
+    if duplicate:
+        return _deduplicated(duplicate, section_tags, status="success")
+
+    text_content = await asyncio.to_thread(extract_text, file.filename, content)
 
     # Upload to S3
     doc_id = uuid.uuid4()
-    s3_key = f"{org.id}/{doc_id}/{file.filename}"
+    s3_key = f"{org_id}/{doc_id}/{file.filename}"
     s3_url = await s3_service.upload_file(file, s3_key)
 
     # Create DB Entry
     doc = Document(
         id=doc_id,
-        org_id=org.id,
+        org_id=org_id,
         filename=file.filename,
         s3_url=s3_url,
+        content_sha256=content_sha256,
+        section_tags=section_tags,
     )
     session.add(doc)
+    try:
+        # touch_org flushes the row first, so the conflict can surface there too
+        await touch_org(session, org_id)
+        await session.commit()
+    except IntegrityError:
+        # A concurrent upload of the same content won the race; hand back that one
+        await session.rollback()
+        await asyncio.to_thread(s3_service.delete_file, s3_key)
+        duplicate = await find_by_hash(session, org_id, content_sha256)
+        if not duplicate:
+            # ...and was deleted again before we could look it up
+            raise HTTPException(status_code=409, detail="Document changed during upload, please retry")
+        return _deduplicated(duplicate, section_tags, status="success")
+
+    # Chunking, embedding and upserts are all blocking calls
+    await asyncio.to_thread(index_document, doc, text_content)
+
+    return {"status": "success", "document_id": doc_id}
+
+class BulkUploadResult(BaseModel):
+    filename: str
+    status: str # "uploaded", "duplicate", "skipped" or "error"
+    document_id: Optional[uuid.UUID] = None
+    detail: Optional[str] = None
+
+async def _iter_bulk_entries(files: List[UploadFile]) -> AsyncIterator[Union[Tuple[str, bytes], BulkUploadResult]]:
+    """
+    Flatten plain files and zip/tar archives into (filename, bytes) entries,
+    reading one entry at a time. Entries that can't be processed (too large,
+    unreadable, broken archive) come back as their BulkUploadResult instead.
+    """
+    max_bytes = settings.BULK_UPLOAD_MAX_FILE_BYTES
+    for file in files:
+        if is_archive(file.filename):
+            try:
+                entries = iter_archive_entries(file.filename, file.file, max_bytes)
+                while True:
+                    entry = await asyncio.to_thread(next, entries, None)
+                    if entry is None:
+                        break
+                    filename, content, error = entry
+                    if error:
+                        yield BulkUploadResult(filename=filename, status="error", detail=error)
+                    elif content is None:
+                        yield BulkUploadResult(filename=filename, status="skipped", detail="File too large")
+                    else:
+                        yield filename, content
+            except Exception as e:
+                # Corrupt or truncated archive: entries already read still count
+                yield BulkUploadResult(filename=file.filename, status="error", detail=f"Could not read archive: {e}")
+        elif file.size is not None and file.size > max_bytes:
+            yield BulkUploadResult(filename=file.filename, status="skipped", detail="File too large")
+        else:
+            yield file.filename, await file.read()
+
+@router.post("/upload/bulk", response_model=list[BulkUploadResult])
+@query_budget(5)
+async def bulk_upload_documents(
+    files: List[UploadFile] = File(...),
+    sections: Optional[str] = Form(None),
+    session: AsyncSession = Depends(get_session),
+    current_user: User = Depends(deps.get_current_user)
+):
+    """
+    Upload many files (or zip/tar archives of files) in one request.
+    Optional `sections` tags every new document for those sections' retrieval.
+    Entries are deduplicated by content hash against the org's existing documents,
+    parsed and pushed to S3 with bounded parallelism, then committed and embedded
+    in batches. Returns one result per file, in upload order; a file that fails
+    is reported with status "error" without failing the rest.
+    """
+    result = await session.exec(select(Organization).where(Organization.owner_id == current_user.id))
+    org = result.first()
+    if not org:
+        raise HTTPException(status_code=400, detail="No organization found. Please complete onboarding first.")
+    org_id = org.id
+
+    existing = await session.exec(
+        select(Document.content_sha256, Document.id, Document.section_tags)
+        .where(Document.org_id == org_id, Document.content_sha256 != None)
+    )
+    known_hashes = {sha: (doc_id, tags) for sha, doc_id, tags in existing.all()}
+    section_tags = _parse_section_tags(sections)
+    # Content seen earlier in this batch: hash -> result slot of its first copy
+    batch_hashes: Dict[str, int] = {}
+    # (slot, slot of the first copy), resolved once we know whether that copy made it
+    repeats: List[Tuple[int, int]] = []
+
+    results: List[BulkUploadResult] = []
+    new_docs: List[Document] = []
+    index_items: List[dict] = []
+    # Objects written so far, removed again unless their rows get committed
+    written_keys: List[str] = []
+    semaphore = asyncio.Semaphore(settings.BULK_UPLOAD_CONCURRENCY)
+
+    async def process(slot: int, doc_id: uuid.UUID, filename: str, content: bytes, sha: str):
+        try:
+            text_content = await asyncio.to_thread(extract_text, filename, content)
+            s3_key = f"{org_id}/{doc_id}/{filename}"
+            content_type = mimetypes.guess_type(filename)[0]
+            written_keys.append(s3_key)
+            s3_url = await asyncio.to_thread(s3_service.upload_bytes, content, s3_key, content_type)
+        except Exception as e:
+            results[slot] = BulkUploadResult(filename=filename, status="error", detail=str(e))
+            return
+        finally:
+            semaphore.release()
+
+        doc = Document(
+            id=doc_id, org_id=org_id, filename=filename, s3_url=s3_url, content_sha256=sha,
+            section_tags=section_tags
+        )
+        new_docs.append(doc)
+        index_items.append({"doc_id": str(doc_id), "text": text_content, "metadata": document_metadata(doc)})
+        results[slot] = BulkUploadResult(filename=filename, status="uploaded", document_id=doc_id)
+
+    tasks = []
+    committed = False
+    try:
+        async for entry in _iter_bulk_entries(files):
+            if isinstance(entry, BulkUploadResult):
+                results.append(entry)
+                continue
+            filename, content = entry
+            if len(results) >= settings.BULK_UPLOAD_MAX_FILES:
+                results.append(BulkUploadResult(filename=filename, status="skipped", detail="Too many files in one request"))
+                continue
+
+            sha = hashlib.sha256(content).hexdigest()
+            if sha in known_hashes:
+                existing_id, existing_tags = known_hashes[sha]
+                results.append(BulkUploadResult(
+                    filename=filename, status="duplicate", document_id=existing_id,
+                    detail="Sections left unchanged on the existing document"
+                    if section_tags and section_tags != existing_tags else None,
+                ))
+                continue
+
+            if sha in batch_hashes:
+                repeats.append((len(results), batch_hashes[sha]))
+                results.append(BulkUploadResult(filename=filename, status="duplicate"))
+                continue
+
+            doc_id = uuid.uuid4()
+            batch_hashes[sha] = len(results)
+            results.append(BulkUploadResult(filename=filename, status="error", detail="Not processed"))
+
+            # Bounded parallelism: wait for a free slot before reading further entries
+            await semaphore.acquire()
+            tasks.append(asyncio.create_task(process(len(results) - 1, doc_id, filename, content, sha)))
+
+        await asyncio.gather(*tasks)
+
+        if new_docs:
+            session.add_all(new_docs)
+            try:
+                await touch_org(session, org_id)
+                await session.commit()
+            except IntegrityError:
+                # Some of this content was uploaded concurrently; nothing from this batch was saved
+                await session.rollback()
+                for r in results:
+                    if r.status == "uploaded":
+                        r.status, r.document_id, r.detail = "error", None, "Conflicted with a concurrent upload, please retry"
+                new_docs = []
+            else:
+                committed = True
+
+        # Repeats within the batch point at their first copy, if it was saved
+        for slot, first_slot in repeats:
+            first = results[first_slot]
+            if first.status == "uploaded":
+                results[slot].document_id = first.document_id
+            else:
+                results[slot] = BulkUploadResult(
+                    filename=results[slot].filename, status="error",
+                    detail=f"Same content as {first.filename}, which failed: {first.detail}",
+                )
+    finally:
+        if not committed:
+            # Failed or cancelled part way: stop the workers, then drop what they wrote
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for key in written_keys:
+                try:
+                    await asyncio.to_thread(s3_service.delete_file, key)
+                except Exception as e:
+                    print(f"Bulk upload cleanup failed for {key}: {e}")
+
+    if new_docs:
+        try:
+            await asyncio.to_thread(vector_service.add_documents, index_items, str(org_id))
+        except Exception as e:
+            print(f"Bulk indexing failed: {e}")
+            for r in results:
+                if r.status == "uploaded":
+                    r.detail = "Stored but not indexed"
+
+    return results
+
+@router.delete("/{doc_id}")
+@query_budget(4)
+async def delete_document(
+    doc_id: uuid.UUID,
+    session: AsyncSession = Depends(get_session),
+    current_user: User = Depends(deps.get_current_user)
+):
+    """
+    Delete a document, its S3 object and its vectors.
+    Deduplicated uploads share the original's id, so this removes that document.
+    """
+    doc = await _get_owned_document(session, current_user, doc_id)
+    await _delete_document(session, doc)
+    await touch_org(session, doc.org_id)
     await session.commit()
 
-    # Vector Store Ingestion (Pinecone)
-    # Truncate text for metadata storage (Pinecone limit)
-    # Ideally we chunk, but for MVP we take first 2000 chars as context snippet
-    snippet = text_content[:2000]
-    
-    vector_service.add_document(
-        doc_id=str(doc_id),
-        text=text_content, # Used for embedding generation
-        metadata={
-            "org_id": str(org.id), 
-            "filename": file.filename,
-            "text_snippet": snippet 
-        },
-        org_id=str(org.id) # CRITICAL: For Namespace Isolation
+    return {"status": "deleted", "document_id": doc_id}
+
+@router.put("/{doc_id}")
+@query_budget(5)
+async def replace_document(
+    doc_id: uuid.UUID,
+    file: UploadFile = File(...),
+    session: AsyncSession = Depends(get_session),
+    current_user: User = Depends(deps.get_current_user)
+):
+    """
+    Replace a document's content in place, keeping its id.
+    """
+    doc = await _get_owned_document(session, current_user, doc_id)
+    org_id = doc.org_id
+    old_key = s3_service.key_from_url(doc.s3_url)
+
+    content, content_sha256 = await read_upload(file)
+    if content_sha256 == doc.content_sha256:
+        return {"status": "success", "document_id": doc.id}
+
+    # Content is unique per org, so this would merge two documents; leave both alone
+    duplicate = await find_by_hash(session, org_id, content_sha256)
+    if duplicate:
+        raise HTTPException(status_code=409, detail=f"This content already exists as document {duplicate.id}")
+
+    text_content = await asyncio.to_thread(extract_text, file.filename, content)
+
+    # Keyed by content so the current object is never overwritten before the commit
+    s3_key = f"{doc.org_id}/{doc.id}/{content_sha256[:16]}/{file.filename}"
+    s3_url = await s3_service.upload_file(file, s3_key)
+
+    doc.filename = file.filename
+    doc.s3_url = s3_url
+    doc.content_sha256 = content_sha256
+    doc.upload_date = datetime.datetime.utcnow()
+    session.add(doc)
+    try:
+        # touch_org flushes the row first, so the conflict can surface there too
+        await touch_org(session, org_id)
+        await session.commit()
+    except IntegrityError:
+        # The same content was uploaded concurrently: same answer as the check above
+        await session.rollback()
+        await asyncio.to_thread(s3_service.delete_file, s3_key)
+        raise HTTPException(status_code=409, detail="This content was just uploaded as another document")
+
+    # Drop the old vectors (the old content may have produced more chunks) then re-index
+    await asyncio.to_thread(vector_service.delete_document, str(doc.id), str(doc.org_id))
+    await asyncio.to_thread(index_document, doc, text_content)
+
+    if old_key and old_key != s3_key:
+        await asyncio.to_thread(s3_service.delete_file, old_key)
+
+    return {"status": "success", "document_id": doc.id}
+
+class SectionTagsRequest(BaseModel):
+    # Section names; empty means every section
+    sections: List[str] = []
+
+@router.put("/{doc_id}/sections", response_model=DocumentResponse)
+@query_budget(4)
+async def set_document_sections(
+    doc_id: uuid.UUID,
+    request: SectionTagsRequest,
+    session: AsyncSession = Depends(get_session),
+    current_user: User = Depends(deps.get_current_user)
+):
+    """
+    Tag a document for specific sections. Its vectors are re-tagged in place,
+    without re-embedding, so scoped sections pick it up (or drop it) right away.
+    """
+    doc = await _get_owned_document(session, current_user, doc_id)
+    doc.section_tags = _parse_section_tags(",".join(request.sections))
+    session.add(doc)
+    await touch_org(session, doc.org_id)
+    await session.commit()
+
+    try:
+        await asyncio.to_thread(vector_service.update_metadata, str(doc.id), document_metadata(doc), str(doc.org_id))
+    except VectorIndexError:
+        raise HTTPException(
+            status_code=502,
+            detail="Sections were saved, but the search index could not be re-tagged; re-upload the document to apply them",
+        )
+    return doc
+
+class PresignRequest(BaseModel):
+    filename: str
+    size: int
+    content_type: Optional[str] = None
+    # Hex SHA-256 of the file, if the client has it: known content skips the upload entirely
+    sha256: Optional[str] = None
+    # Section names the document is for; omitted means every section
+    sections: Optional[List[str]] = None
+
+class UploadedPart(BaseModel):
+    part_number: int
+    etag: str
+
+class CompleteUploadRequest(BaseModel):
+    # Only for multipart uploads. upload_id is accepted for older clients, but
+    # the one stored at presign time is what gets completed.
+    upload_id: Optional[str] = None
+    parts: List[UploadedPart] = []
+
+@router.post("/presign")
+@query_budget(5)
+async def presign_upload(
+    request: PresignRequest,
+    session: AsyncSession = Depends(get_session),
+    current_user: User = Depends(deps.get_current_user)
+):
+    """
+    Start a direct-to-S3 upload. Returns presigned PUT URL(s); the file bytes
+    never pass through the API. Call /{document_id}/complete afterwards.
+    If the content turns out to duplicate an existing document, the pending
+    document is dropped during ingestion; pass `sha256` to find out up front.
+    """
+    result = await session.exec(select(Organization).where(Organization.owner_id == current_user.id))
+    org = result.first()
+    if not org:
+        raise HTTPException(status_code=400, detail="No organization found. Please complete onboarding first.")
+    if not s3_service.bucket:
+        raise HTTPException(status_code=400, detail="S3 Bucket not configured")
+    if request.size <= 0:
+        raise HTTPException(status_code=400, detail="File size must be positive")
+
+    if request.sha256:
+        duplicate = await find_by_hash(session, org.id, request.sha256.lower())
+        if duplicate:
+            return _deduplicated(duplicate, _parse_section_tags(",".join(request.sections or [])))
+
+    filename = os.path.basename(request.filename)
+    doc_id = uuid.uuid4()
+    s3_key = f"{org.id}/{doc_id}/{filename}"
+    upload = await asyncio.to_thread(
+        s3_service.create_presigned_upload, s3_key, request.content_type, request.size
     )
 
-    return {"status": "success", "document_id": doc_id}
+    doc = Document(
+        id=doc_id,
+        org_id=org.id,
+        filename=filename,
+        s3_url=s3_service.object_url(s3_key),
+        status="pending",
+        upload_id=upload.get("upload_id"),
+        section_tags=_parse_section_tags(",".join(request.sections or [])),
+    )
+    session.add(doc)
+    await touch_org(session, org.id)
+    await session.commit()
+
+    return {"document_id": doc_id, "key": s3_key, "upload": upload}
+
+@router.post("/{doc_id}/complete")
+@query_budget(3)
+async def complete_upload(
+    doc_id: uuid.UUID,
+    request: CompleteUploadRequest,
+    session: AsyncSession = Depends(get_session),
+    current_user: User = Depends(deps.get_current_user)
+):
+    """
+    Client finished uploading to S3: finalize multipart uploads and hand the
+    document to the ingestion worker, which streams the object from S3.
+    """
+    doc = await _get_owned_document(session, current_user, doc_id)
+    key = s3_service.key_from_url(doc.s3_url)
+    upload_id = doc.upload_id
+    if upload_id and not request.parts:
+        raise HTTPException(status_code=400, detail="Multipart upload needs its list of parts")
+    # Only one /complete call gets past this, however many race
+    if not await claim_document(session, doc_id, "pending", "uploaded"):
+        raise HTTPException(status_code=409, detail="Document is not awaiting upload")
+
+    if upload_id:
+        try:
+            await asyncio.to_thread(
+                s3_service.complete_multipart_upload,
+                key,
+                upload_id,
+                [part.model_dump() for part in request.parts]
+            )
+        except Exception as e:
+            # Let the client fix its part list and try again
+            await claim_document(session, doc_id, "uploaded", "pending")
+            raise HTTPException(status_code=400, detail=f"Could not complete upload: {e}")
+
+    return {"status": "processing", "document_id": doc_id}
@@ -1,17 +1,22 @@
+import asyncio
 import uuid
 from fastapi import APIRouter, Depends, UploadFile, File, Form, HTTPException
 from sqlmodel.ext.asyncio.session import AsyncSession
 from sqlmodel import select
 
 from app.api import deps
+from app.db.query_counter import query_budget
 from app.db.session import get_session
 from app.models import User, Organization, Section, Document
 from app.services.s3_service import s3_service
-from app.services.vector_service import vector_service
+from app.services.ingestion_service import index_document
+from app.services.document_parser import extract_text, read_upload
+from app.services.cache_bus import cache_bus
 
 router = APIRouter()
 
 @router.post("/setup")
+@query_budget(4)
 async def onboarding_setup(
     org_name: str = Form(...),
     industry: str = Form(...),
@@ -90,12 +95,13 @@ async def onboarding_setup(
         session.add(section)
 
     # 3. Handle Document Upload
-    # Read file for Pinecone
-    content = await file.read()
+    # Read file for Pinecone, hashing it so later re-uploads of the same
+    # file are deduplicated against this document
+    content, content_sha256 = await read_upload(file)
     try:
-        text_content = content.decode("utf-8")
-    except:
-        text_content = "Binary file content placeholder" # MVP hack for PDF
+        text_content = await asyncio.to_thread(extract_text, file.filename, content)
+    except UnicodeDecodeError:
+        text_content = "Binary file content placeholder"
 
     # S3 Upload
     doc_id = uuid.uuid4()
@@ -106,24 +112,16 @@ async def onboarding_setup(
     s3_url = await s3_service.upload_file(file, s3_key)
 
     doc = Document(
-        id=doc_id, org_id=org_id, filename=file.filename, s3_url=s3_url
+        id=doc_id, org_id=org_id, filename=file.filename, s3_url=s3_url,
+        content_sha256=content_sha256
     )
     session.add(doc)
     
     await session.commit()
+    await cache_bus.publish(f"sections:{org_id}")
 
     # Pinecone Indexing
-    snippet = text_content[:2000]
-    vector_service.add_document(
-        doc_id=str(doc_id),
-        text=text_content,
-        metadata={
-            "org_id": str(org_id),
-            "filename": file.filename,
-            "text_snippet": snippet
-        },
-        org_id=str(org_id)
-    )
+    await asyncio.to_thread(index_document, doc, text_content)
 
     return {
         "status": "onboarding_complete",
@@ -1,3 +1,4 @@
+import uuid
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, JWTError
@@ -7,6 +8,11 @@ from app.core import security
 from app.core.config import settings
 from app.db.session import get_session
 from app.models.user import User
+from app.services.cache_bus import LocalCache
+
+# Authenticated users by id, as plain dicts; saves the User lookup on most requests.
+# Entries are dropped on "user:<id>" invalidations from any worker.
+user_cache = LocalCache("user:", ttl_seconds=settings.USER_CACHE_TTL_SECONDS)
 
 reusable_oauth2 = OAuth2PasswordBearer(
     tokenUrl=f"{settings.API_V1_STR}/auth/login"
@@ -16,18 +22,30 @@ async def get_current_user(
     session: AsyncSession = Depends(get_session),
     token: str = Depends(reusable_oauth2)
 ) -> User:
+    return await user_from_token(session, token)
+
+async def user_from_token(session: AsyncSession, token: str) -> User:
+    """
+    Resolve a bearer token to its User (also used to authenticate WebSockets).
+    """
     try:
         payload = jwt.decode(
             token, security.SECRET_KEY, algorithms=[security.ALGORITHM]
         )
-        token_data = payload.get("sub")
-    except (JWTError, ValidationError):
+        token_data = uuid.UUID(payload.get("sub"))
+    except (JWTError, ValidationError, TypeError, ValueError):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Could not validate credentials",
         )
     
+    cached = user_cache.get(str(token_data))
+    if cached:
+        # A fresh instance per request, so nothing a handler does to it leaks into others
+        return User(**cached)
+
     user = await session.get(User, token_data)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
+    user_cache.set(str(token_data), user.model_dump())
     return user
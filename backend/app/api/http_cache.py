@@ -0,0 +1,51 @@
+import hashlib
+from typing import Any, Optional, Sequence
+
+from fastapi import Request, Response
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+# Responses are per-user, so shared caches must not store them, and clients
+# must revalidate with If-None-Match before reusing a copy.
+CACHE_CONTROL = "private, no-cache"
+
+
+def make_etag(*parts: Any) -> str:
+    """
+    Weak ETag from cheap version stamps (ids, change counters, timestamps).
+    """
+    raw = ":".join(str(p) for p in parts)
+    return f'W/"{hashlib.sha1(raw.encode("utf-8")).hexdigest()}"'
+
+
+def check_not_modified(request: Request, response: Response, etag: str) -> Optional[Response]:
+    """
+    Set caching headers on the response. If the client already has this
+    version, return a 304 to send instead of re-querying and re-serializing.
+    """
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL
+
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return None
+    candidates = {tag.strip() for tag in if_none_match.split(",")}
+    if etag in candidates or "*" in candidates:
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
+    return None
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """
+    GZip for large responses, skipping streaming endpoints: gzip buffers
+    output internally, which would hold back incremental events.
+    """
+    def __init__(self, app: ASGIApp, minimum_size: int = 1024, skip_paths: Sequence[str] = ()) -> None:
+        super().__init__(app, minimum_size=minimum_size)
+        self.skip_paths = tuple(skip_paths)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and scope["path"].rstrip("/").endswith(self.skip_paths):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
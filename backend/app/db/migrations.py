@@ -0,0 +1,40 @@
+"""
+Additive schema changes for existing databases.
+
+SQLModel.metadata.create_all only creates missing tables, so columns and
+indexes added to existing models are applied here at startup. Every
+statement must be idempotent.
+"""
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+POSTGRES_MIGRATIONS = [
+    # Content hash for upload deduplication
+    "ALTER TABLE document ADD COLUMN IF NOT EXISTS content_sha256 VARCHAR",
+    # Reference counting was dropped: a duplicate upload now just returns the existing document
+    "ALTER TABLE document DROP COLUMN IF EXISTS ref_count",
+    "CREATE UNIQUE INDEX IF NOT EXISTS uq_document_org_content_sha256 ON document (org_id, content_sha256)",
+    # Foreign keys used by the request hot paths, with their sort columns
+    "CREATE INDEX IF NOT EXISTS ix_message_conversation_id_timestamp ON message (conversation_id, timestamp)",
+    "CREATE INDEX IF NOT EXISTS ix_conversation_section_id_created_at ON conversation (section_id, created_at)",
+    "CREATE INDEX IF NOT EXISTS ix_section_org_id_name ON section (org_id, name)",
+    "CREATE INDEX IF NOT EXISTS ix_document_org_id_upload_date ON document (org_id, upload_date)",
+    "CREATE INDEX IF NOT EXISTS ix_organization_owner_id ON organization (owner_id)",
+    "ALTER TABLE document ADD COLUMN IF NOT EXISTS status VARCHAR NOT NULL DEFAULT 'ready'",
+    # Change counter backing HTTP ETags
+    "ALTER TABLE organization ADD COLUMN IF NOT EXISTS data_version INTEGER NOT NULL DEFAULT 0",
+    # Section-scoped retrieval
+    "ALTER TABLE document ADD COLUMN IF NOT EXISTS section_tags JSON",
+    "ALTER TABLE section ADD COLUMN IF NOT EXISTS retrieval_scope JSON",
+    # Presigned upload bookkeeping for the ingestion worker and sweep
+    "ALTER TABLE document ADD COLUMN IF NOT EXISTS upload_id VARCHAR",
+    "ALTER TABLE document ADD COLUMN IF NOT EXISTS claimed_at TIMESTAMP WITHOUT TIME ZONE",
+    "CREATE INDEX IF NOT EXISTS ix_document_status ON document (status) WHERE status <> 'ready'",
+]
+
+async def run_migrations(conn: AsyncConnection):
+    # Fresh databases get everything from create_all; other dialects are dev only
+    if conn.dialect.name != "postgresql":
+        return
+    for statement in POSTGRES_MIGRATIONS:
+        await conn.execute(text(statement))
@@ -0,0 +1,108 @@
+"""
+SQL statement counting, to keep N+1 patterns out of request handlers.
+
+- count_queries(): context manager for tests, counts statements run inside it.
+- @query_budget(n): declares the max statements an endpoint may run.
+- install_query_budget(app): middleware checking every request against its
+  endpoint's budget. SQL_QUERY_BUDGET_MODE "warn" logs overruns, "strict"
+  turns them into a 500 so test suites fail; "off" (default) adds no overhead.
+
+Statements run after the response starts (e.g. inside a StreamingResponse)
+are not counted against the budget.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from sqlalchemy import event
+
+from app.core.config import settings
+from app.db.session import engine
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryCounter:
+    def __init__(self):
+        self.statements: List[str] = []
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+
+_active_counters: ContextVar[tuple] = ContextVar("active_query_counters", default=())
+_listener_installed = False
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    for counter in _active_counters.get():
+        counter.statements.append(statement)
+
+
+def _install_listener():
+    global _listener_installed
+    if not _listener_installed:
+        event.listen(engine.sync_engine, "before_cursor_execute", _before_cursor_execute)
+        _listener_installed = True
+
+
+@contextmanager
+def count_queries(max_queries: Optional[int] = None):
+    """
+    Count statements executed in this context (and tasks started from it).
+
+        with count_queries(max_queries=3) as counter:
+            client.get("/api/v1/chat/sections", headers=auth)
+    """
+    _install_listener()
+    counter = QueryCounter()
+    token = _active_counters.set(_active_counters.get() + (counter,))
+    try:
+        yield counter
+    finally:
+        _active_counters.reset(token)
+    if max_queries is not None and counter.count > max_queries:
+        raise QueryBudgetExceeded(
+            f"{counter.count} SQL statements executed, budget is {max_queries}:\n"
+            + "\n".join(counter.statements)
+        )
+
+
+def query_budget(max_queries: int):
+    """
+    Declare the statement budget of an endpoint (place below the route decorator).
+    """
+    def decorator(func):
+        func.__query_budget__ = max_queries
+        return func
+    return decorator
+
+
+def install_query_budget(app: FastAPI):
+    if settings.SQL_QUERY_BUDGET_MODE == "off":
+        return
+    _install_listener()
+
+    @app.middleware("http")
+    async def enforce_query_budget(request: Request, call_next):
+        counter = QueryCounter()
+        token = _active_counters.set(_active_counters.get() + (counter,))
+        try:
+            response = await call_next(request)
+        finally:
+            _active_counters.reset(token)
+
+        route = request.scope.get("route")
+        budget = getattr(getattr(route, "endpoint", None), "__query_budget__", None)
+        if budget is not None and counter.count > budget:
+            message = f"{request.method} {request.url.path} ran {counter.count} SQL statements (budget {budget})"
+            # The SQL stays in the server log; responses only carry the count
+            print(message + ":\n" + "\n".join(counter.statements))
+            if settings.SQL_QUERY_BUDGET_MODE == "strict":
+                return JSONResponse(status_code=500, content={"detail": message})
+        return response
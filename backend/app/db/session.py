@@ -5,9 +5,11 @@ from app.core.config import settings
 
 engine = create_async_engine(settings.DATABASE_URL, echo=True, future=True)
 
+# Shared factory for code running outside a request (background jobs, startup)
+async_session_factory = sessionmaker(
+    engine, class_=AsyncSession, expire_on_commit=False
+)
+
 async def get_session() -> AsyncSession:
-    async_session = sessionmaker(
-        engine, class_=AsyncSession, expire_on_commit=False
-    )
-    async with async_session() as session:
+    async with async_session_factory() as session:
         yield session
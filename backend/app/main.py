@@ -1,8 +1,12 @@
+import asyncio
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from app.api.http_cache import CompressionMiddleware
 from app.core.config import settings
 from app.db.session import engine, get_session
+from app.db.migrations import run_migrations
+from app.db.query_counter import install_query_budget
 from app.api.api_v1.api import api_router
 
 @asynccontextmanager
@@ -10,11 +14,12 @@ async def lifespan(app: FastAPI):
     # Startup: Create tables (for local dev convenience)
     from sqlmodel import SQLModel
     # Explicitly import models to ensure they are registered in SQLModel.metadata
-    from app.models import User, Organization, Section, Conversation, Message, Document
+    from app.models import User, Organization, Section, Conversation, ConversationArchive, Message, Document
     
     async with engine.begin() as conn:
         # await conn.run_sync(SQLModel.metadata.drop_all) # Uncomment to reset
         await conn.run_sync(SQLModel.metadata.create_all)
+        await run_migrations(conn)
     
     # Init DB (Seed data)
     # The get_session dependency is a generator, so we use sessionmaker directly or handle it
@@ -25,9 +30,34 @@ async def lifespan(app: FastAPI):
     async with async_session() as db:
         from app.db.init_db import init_db as seed_db
         await seed_db(db)
+
+    from app.services.cache_bus import cache_bus
+    cache_bus.configure(settings.CACHE_BUS_BACKEND)
+    await cache_bus.start()
+
+    if settings.MESSAGE_WRITE_BEHIND:
+        from app.services.message_journal import message_journal
+        await message_journal.start()
+
+    background_tasks = []
+    if settings.VECTOR_RECONCILE_INTERVAL_SECONDS > 0:
+        from app.services.vector_maintenance import run_reconciler_periodically
+        background_tasks.append(asyncio.create_task(run_reconciler_periodically()))
+    if settings.CONVERSATION_ARCHIVE_INTERVAL_SECONDS > 0:
+        from app.services.conversation_archive import run_archiver_periodically
+        background_tasks.append(asyncio.create_task(run_archiver_periodically()))
+    if settings.INGESTION_WORKER_IN_APP:
+        from app.services.ingestion_service import run_ingestion_worker
+        background_tasks.append(asyncio.create_task(run_ingestion_worker()))
             
     yield
     # Shutdown
+    for task in background_tasks:
+        task.cancel()
+    if settings.MESSAGE_WRITE_BEHIND:
+        # Pending chat messages must reach the DB before the worker exits
+        await message_journal.stop()
+    await cache_bus.stop()
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
@@ -48,8 +78,19 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Readable by the frontend (history paging)
+    expose_headers=["X-Has-More"],
 )
 
+# Compress large JSON payloads (document lists, long chat histories)
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=1024,
+    skip_paths=(f"{settings.API_V1_STR}/chat/board",),
+)
+
+install_query_budget(app)
+
 @app.get("/")
 async def root():
     return {"message": "Welcome to Axel Backend"}
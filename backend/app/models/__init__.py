@@ -1,4 +1,4 @@
 from .organization import Organization, Section
-from .conversation import Conversation, Message
+from .conversation import Conversation, ConversationArchive, Message
 from .document import Document
 from .user import User
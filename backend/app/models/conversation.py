@@ -1,9 +1,15 @@
 import uuid
 from datetime import datetime
 from typing import Optional, List
+from sqlalchemy import Index
 from sqlmodel import Field, SQLModel, Relationship
 
 class Conversation(SQLModel, table=True):
+    __table_args__ = (
+        # start_conversation: latest conversation of a section
+        Index("ix_conversation_section_id_created_at", "section_id", "created_at"),
+    )
+
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
     section_id: uuid.UUID = Field(foreign_key="section.id")
     title: Optional[str] = None
@@ -14,6 +20,11 @@ class Conversation(SQLModel, table=True):
     messages: List["Message"] = Relationship(back_populates="conversation")
 
 class Message(SQLModel, table=True):
+    __table_args__ = (
+        # get_chat_history: messages of a conversation in timestamp order
+        Index("ix_message_conversation_id_timestamp", "conversation_id", "timestamp"),
+    )
+
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
     conversation_id: uuid.UUID = Field(foreign_key="conversation.id")
     role: str # "user" or "assistant"
@@ -22,3 +33,21 @@ class Message(SQLModel, table=True):
 
     # Relationships
     conversation: Optional[Conversation] = Relationship(back_populates="messages")
+
+class ConversationArchive(SQLModel, table=True):
+    """
+    Stub left behind when a range of a conversation's messages is moved out of
+    the message table into a gzipped JSONL segment in S3.
+    """
+    __table_args__ = (
+        # get_chat_history: segments of a conversation, newest first
+        Index("ix_conversationarchive_conversation_id_last_timestamp", "conversation_id", "last_timestamp"),
+    )
+
+    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    conversation_id: uuid.UUID = Field(foreign_key="conversation.id")
+    s3_key: str
+    message_count: int
+    first_timestamp: datetime
+    last_timestamp: datetime
+    archived_at: datetime = Field(default_factory=datetime.utcnow)
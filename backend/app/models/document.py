@@ -1,14 +1,33 @@
 import uuid
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
+from sqlalchemy import JSON, Column, Index, text
 from sqlmodel import Field, SQLModel, Relationship
 
 class Document(SQLModel, table=True):
+    __table_args__ = (
+        # One row per distinct content per org; re-uploads return the existing row
+        Index("uq_document_org_content_sha256", "org_id", "content_sha256", unique=True),
+        # list_documents: an org's documents, newest first
+        Index("ix_document_org_id_upload_date", "org_id", "upload_date"),
+        # Ingestion worker and upload sweep: the few documents not yet ready
+        Index("ix_document_status", "status", postgresql_where=text("status <> 'ready'")),
+    )
+
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
     org_id: uuid.UUID = Field(foreign_key="organization.id")
     filename: str
     s3_url: str # or local path
     upload_date: datetime = Field(default_factory=datetime.utcnow)
+    content_sha256: Optional[str] = None
+    # Presigned uploads go "pending" -> "uploaded" -> "ingesting" -> "ready" or "failed"
+    status: str = Field(default="ready")
+    # Multipart upload id while a large presigned upload is pending
+    upload_id: Optional[str] = None
+    # When an ingestion worker claimed the document
+    claimed_at: Optional[datetime] = None
+    # Section names this document is meant for; None means every section
+    section_tags: Optional[List[str]] = Field(default=None, sa_column=Column(JSON))
 
     # Relationships
     organization: Optional["Organization"] = Relationship(back_populates="documents")
@@ -1,6 +1,7 @@
 import uuid
 from datetime import datetime
-from typing import Optional, List
+from typing import Any, Dict, Optional, List
+from sqlalchemy import JSON, Column, Index
 from sqlmodel import Field, SQLModel, Relationship
 
 # Forward references if needed, but here simple ordering or strings work.
@@ -10,20 +11,31 @@ class Organization(SQLModel, table=True):
     name: str = Field(index=True)
     industry: str
     created_at: datetime = Field(default_factory=datetime.utcnow)
-    owner_id: uuid.UUID | None = Field(default=None, foreign_key="user.id")
+    owner_id: uuid.UUID | None = Field(default=None, foreign_key="user.id", index=True)
     credits_used: int = Field(default=0)
+    # Bumped on every document or section write; the ETag stamp of those lists.
+    # Credit charges don't touch it (/auth/me stamps on credits_used itself).
+    # Always bump it with an atomic UPDATE (ingestion_service.touch_org), never in Python
+    data_version: int = Field(default=0)
 
     # Relationships
     sections: List["Section"] = Relationship(back_populates="organization")
     documents: List["Document"] = Relationship(back_populates="organization")
 
 class Section(SQLModel, table=True):
+    __table_args__ = (
+        # list_sections by org, init_db by org + name
+        Index("ix_section_org_id_name", "org_id", "name"),
+    )
+
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
     org_id: uuid.UUID = Field(foreign_key="organization.id")
     name: str
     role_persona: str
     system_prompt_template: str
     icon_url: Optional[str] = None
+    # Metadata filter for this agent's retrieval (see vector_service.build_filter); None searches everything
+    retrieval_scope: Optional[Dict[str, Any]] = Field(default=None, sa_column=Column(JSON))
 
     # Relationships
     organization: Optional[Organization] = Relationship(back_populates="sections")
@@ -0,0 +1,266 @@
+"""
+Cross-worker cache invalidation.
+
+Write paths publish keys like "user:<id>" or "sections:<org_id>" after they
+commit. Every worker (and instance) receives them and drops matching entries
+from its local caches, so in-process caching stays correct when we scale out.
+
+Backends (CACHE_BUS_BACKEND):
+- "inprocess": single worker / local dev, no network
+- "postgres": LISTEN/NOTIFY on the app database, no extra infrastructure
+- "redis": pub/sub on CACHE_BUS_REDIS_URL (requires the `redis` package)
+
+The network backends reconnect with backoff when their subscription drops,
+then flush every local cache, since invalidations sent meanwhile were missed.
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from app.core.config import settings
+
+
+async def _reconnect(connect: Callable[[], Awaitable[None]]):
+    # Exponential backoff up to CACHE_BUS_RECONNECT_MAX_SECONDS, until it works
+    delay = 1
+    while True:
+        try:
+            await connect()
+            return
+        except Exception as e:
+            print(f"Cache bus reconnect failed, retrying in {delay}s: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, settings.CACHE_BUS_RECONNECT_MAX_SECONDS)
+
+
+class InProcessBackend:
+    def __init__(self, dispatch: Callable[[str], None], resync: Callable[[], None]):
+        self.dispatch = dispatch
+        self.resync = resync
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, key: str):
+        # Local subscribers were already notified by the bus
+        pass
+
+
+class PostgresBackend:
+    def __init__(self, dispatch: Callable[[str], None], resync: Callable[[], None], channel: str):
+        self.dispatch = dispatch
+        self.resync = resync
+        self.channel = channel
+        self._conn = None
+        self._raw = None
+        self._task: Optional[asyncio.Task] = None
+
+    def _on_notify(self, connection, pid, channel, payload):
+        self.dispatch(payload)
+
+    async def start(self):
+        await self._connect()
+        self._task = asyncio.create_task(self._watch())
+
+    async def _connect(self):
+        from app.db.session import engine
+        # Dedicated connection held for the worker's lifetime to LISTEN on
+        self._conn = await engine.connect()
+        raw = await self._conn.get_raw_connection()
+        self._raw = raw.driver_connection
+        await self._raw.add_listener(self.channel, self._on_notify)
+
+    async def _disconnect(self):
+        conn, self._conn, self._raw = self._conn, None, None
+        if conn:
+            try:
+                # Don't hand a broken connection back to the pool
+                await conn.invalidate()
+                await conn.close()
+            except Exception:
+                pass
+
+    async def _watch(self):
+        # A dropped LISTEN connection loses notifications silently, so check it
+        # and, once reconnected, flush every local cache for what we missed
+        interval = settings.CACHE_BUS_HEALTHCHECK_SECONDS
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.wait_for(self._raw.execute("SELECT 1"), timeout=interval)
+                continue
+            except Exception as e:
+                print(f"Cache bus connection lost: {e!r}")
+            await self._disconnect()
+            await _reconnect(self._connect)
+            self.resync()
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+        if self._raw:
+            await self._raw.remove_listener(self.channel, self._on_notify)
+        if self._conn:
+            await self._conn.close()
+
+    async def publish(self, key: str):
+        from app.db.session import engine
+        async with engine.begin() as conn:
+            await conn.execute(text("SELECT pg_notify(:channel, :key)"), {"channel": self.channel, "key": key})
+
+
+class RedisBackend:
+    def __init__(self, dispatch: Callable[[str], None], resync: Callable[[], None], channel: str, url: str):
+        self.dispatch = dispatch
+        self.resync = resync
+        self.channel = channel
+        self.url = url
+        self._client = None
+        self._pubsub = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("CACHE_BUS_BACKEND=redis requires the 'redis' package")
+        # The health check makes a silently dropped connection raise in listen()
+        self._client = redis.from_url(self.url, health_check_interval=settings.CACHE_BUS_HEALTHCHECK_SECONDS)
+        await self._subscribe()
+        self._task = asyncio.create_task(self._listen())
+
+    async def _subscribe(self):
+        self._pubsub = self._client.pubsub()
+        await self._pubsub.subscribe(self.channel)
+
+    async def _listen(self):
+        while True:
+            try:
+                async for message in self._pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    data = message["data"]
+                    self.dispatch(data.decode("utf-8") if isinstance(data, bytes) else data)
+            except Exception as e:
+                print(f"Cache bus connection lost: {e!r}")
+            try:
+                await self._pubsub.aclose()
+            except Exception:
+                pass
+            await _reconnect(self._subscribe)
+            # Anything published while we were away was missed
+            self.resync()
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+        if self._client:
+            await self._client.aclose()
+
+    async def publish(self, key: str):
+        await self._client.publish(self.channel, key)
+
+
+class InvalidationBus:
+    def __init__(self):
+        self._subscribers: List[Tuple[str, Callable[[str], None]]] = []
+        self.backend = InProcessBackend(self._dispatch, self._resync)
+
+    def configure(self, backend_name: str):
+        if backend_name == "postgres":
+            self.backend = PostgresBackend(self._dispatch, self._resync, settings.CACHE_BUS_CHANNEL)
+        elif backend_name == "redis":
+            self.backend = RedisBackend(
+                self._dispatch, self._resync, settings.CACHE_BUS_CHANNEL, settings.CACHE_BUS_REDIS_URL
+            )
+        else:
+            self.backend = InProcessBackend(self._dispatch, self._resync)
+
+    def subscribe(self, prefix: str, callback: Callable[[str], None]):
+        """
+        Call callback(key) for every published key starting with prefix.
+        """
+        self._subscribers.append((prefix, callback))
+
+    def unsubscribe(self, prefix: str, callback: Callable[[str], None]):
+        try:
+            self._subscribers.remove((prefix, callback))
+        except ValueError:
+            pass
+
+    async def publish(self, *keys: str):
+        """
+        Invalidate keys locally right away, then on every other worker.
+        Call after the write has committed.
+        """
+        for key in keys:
+            self._dispatch(key)
+            try:
+                await self.backend.publish(key)
+            except Exception as e:
+                # Other workers fall back to their cache TTLs
+                print(f"Cache invalidation publish failed for {key}: {e}")
+
+    def _dispatch(self, key: str):
+        for prefix, callback in self._subscribers:
+            if key.startswith(prefix):
+                callback(key)
+
+    def _resync(self):
+        # After a reconnect: each subscriber gets its bare prefix, which drops everything it holds
+        for prefix, callback in list(self._subscribers):
+            callback(prefix)
+
+    async def start(self):
+        await self.backend.start()
+
+    async def stop(self):
+        await self.backend.stop()
+
+cache_bus = InvalidationBus()
+
+
+class LocalCache:
+    """
+    Small per-worker TTL + LRU cache, invalidated through the bus.
+    Publishing "<prefix><key>" drops one entry; publishing the bare prefix clears it.
+    """
+    def __init__(self, prefix: str, ttl_seconds: float, max_size: int = 1024):
+        self.prefix = prefix
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        cache_bus.subscribe(prefix, self._invalidate)
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            self._entries.pop(key, None)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any):
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def _invalidate(self, published: str):
+        key = published[len(self.prefix):]
+        if key:
+            self._entries.pop(key, None)
+        else:
+            self.clear()
@@ -0,0 +1,163 @@
+"""
+Tiered storage for chat history.
+
+Conversations idle for CONVERSATION_ARCHIVE_AFTER_DAYS have their messages
+moved out of the message table into a gzipped JSONL segment in S3
+(archive/<org_id>/<conversation_id>/<first>-<last>.jsonl.gz), leaving a
+ConversationArchive stub row behind. If the conversation is picked up again,
+new messages go to the hot table as usual and get archived into a further
+segment once it goes cold again.
+
+get_chat_history rehydrates segments on scroll-back through a small
+per-worker cache (segments are immutable once written).
+
+Run once with `python -m app.services.conversation_archive`, or periodically
+from the app with CONVERSATION_ARCHIVE_INTERVAL_SECONDS > 0.
+"""
+import asyncio
+import gzip
+import json
+import uuid
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy import delete
+from sqlmodel import func, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core.config import settings
+from app.db.session import async_session_factory
+from app.models import Conversation, ConversationArchive, Message, Section
+from app.services.cache_bus import LocalCache
+from app.services.message_journal import _message_from_dict, _message_to_dict
+from app.services.s3_service import s3_service
+
+segment_cache = LocalCache(
+    "archive:",
+    ttl_seconds=settings.ARCHIVE_SEGMENT_CACHE_TTL_SECONDS,
+    max_size=settings.ARCHIVE_SEGMENT_CACHE_SIZE,
+)
+
+
+def encode_segment(messages: List[Message]) -> bytes:
+    lines = "".join(json.dumps(_message_to_dict(m)) + "\n" for m in messages)
+    return gzip.compress(lines.encode("utf-8"))
+
+
+def decode_segment(data: bytes) -> List[Message]:
+    lines = gzip.decompress(data).decode("utf-8").splitlines()
+    return [_message_from_dict(json.loads(line)) for line in lines if line]
+
+
+def segment_key(org_id: uuid.UUID, conversation_id: uuid.UUID, first: datetime, last: datetime) -> str:
+    stamp = "%Y%m%dT%H%M%S%f"
+    return f"archive/{org_id}/{conversation_id}/{first.strftime(stamp)}-{last.strftime(stamp)}.jsonl.gz"
+
+
+async def load_segment(archive: ConversationArchive) -> List[Message]:
+    messages = segment_cache.get(archive.s3_key)
+    if messages is None:
+        data = await asyncio.to_thread(s3_service.download_file, archive.s3_key)
+        messages = await asyncio.to_thread(decode_segment, data)
+        segment_cache.set(archive.s3_key, messages)
+    return messages
+
+
+async def archive_conversation(session: AsyncSession, conversation_id: uuid.UUID, org_id: uuid.UUID) -> int:
+    """
+    Move every hot message of a conversation into a new S3 segment.
+    The segment is written before the rows are deleted, and the stub insert and
+    delete commit together, so a failure at any point loses nothing.
+    Returns the number of messages archived.
+    """
+    result = await session.exec(
+        select(Message).where(Message.conversation_id == conversation_id).order_by(Message.timestamp)
+    )
+    messages = result.all()
+    if not messages:
+        return 0
+
+    first, last = messages[0].timestamp, messages[-1].timestamp
+    key = segment_key(org_id, conversation_id, first, last)
+    data = await asyncio.to_thread(encode_segment, messages)
+    await asyncio.to_thread(s3_service.upload_bytes, data, key, "application/gzip")
+
+    session.add(ConversationArchive(
+        conversation_id=conversation_id,
+        s3_key=key,
+        message_count=len(messages),
+        first_timestamp=first,
+        last_timestamp=last,
+    ))
+    # Only delete what went into the segment; a turn landing meanwhile stays hot
+    await session.execute(delete(Message).where(Message.id.in_([m.id for m in messages])))
+    await session.commit()
+    return len(messages)
+
+
+async def find_cold_conversations(session: AsyncSession, cutoff: datetime, limit: int) -> List[tuple]:
+    """
+    (conversation_id, org_id) of conversations with hot messages, the newest older than cutoff.
+    """
+    result = await session.exec(
+        select(Message.conversation_id, Section.org_id)
+        .join(Conversation, Conversation.id == Message.conversation_id)
+        .join(Section, Section.id == Conversation.section_id)
+        .group_by(Message.conversation_id, Section.org_id)
+        .having(func.max(Message.timestamp) < cutoff)
+        .limit(limit)
+    )
+    return result.all()
+
+
+async def archive_cold_conversations(max_conversations: Optional[int] = None) -> int:
+    """
+    Archive conversations idle past CONVERSATION_ARCHIVE_AFTER_DAYS, in batches.
+    Returns the number of messages moved to S3.
+    """
+    if settings.CONVERSATION_ARCHIVE_AFTER_DAYS <= 0:
+        return 0
+    if not s3_service.bucket:
+        print("Conversation archiving skipped: S3 Bucket not configured")
+        return 0
+
+    cutoff = datetime.utcnow() - timedelta(days=settings.CONVERSATION_ARCHIVE_AFTER_DAYS)
+    archived = 0
+    processed = 0
+    async with async_session_factory() as session:
+        while max_conversations is None or processed < max_conversations:
+            batch = await find_cold_conversations(session, cutoff, settings.CONVERSATION_ARCHIVE_BATCH_SIZE)
+            if not batch:
+                break
+            moved = 0
+            for conversation_id, org_id in batch:
+                try:
+                    moved += await archive_conversation(session, conversation_id, org_id)
+                except Exception as e:
+                    await session.rollback()
+                    print(f"Archiving conversation {conversation_id} failed: {e}")
+            processed += len(batch)
+            archived += moved
+            if not moved:
+                # Everything in this batch failed; retry on the next run
+                break
+    return archived
+
+
+async def run_archiver_periodically():
+    """
+    Background loop started from the app lifespan when
+    CONVERSATION_ARCHIVE_INTERVAL_SECONDS > 0.
+    """
+    while True:
+        await asyncio.sleep(settings.CONVERSATION_ARCHIVE_INTERVAL_SECONDS)
+        try:
+            archived = await archive_cold_conversations()
+            if archived:
+                print(f"Conversation archiver moved {archived} messages to S3")
+        except Exception as e:
+            print(f"Conversation archiver error: {e}")
+
+
+if __name__ == "__main__":
+    print(f"Archived {asyncio.run(archive_cold_conversations())} messages")
@@ -0,0 +1,112 @@
+import hashlib
+import io
+import os
+import tarfile
+import zipfile
+from typing import BinaryIO, Iterator, Optional, Tuple
+from fastapi import UploadFile
+
+UPLOAD_READ_CHUNK_SIZE = 1024 * 1024
+
+
+def extract_text(filename: str, content: bytes) -> str:
+    """
+    Extract plain text from an uploaded file for embedding.
+    Simple parse based on extension.
+    """
+    if filename.endswith(".txt") or filename.endswith(".md"):
+        return content.decode("utf-8")
+    elif filename.endswith(".pdf"):
+        return _extract_pdf(io.BytesIO(content))
+    return str(content) # Fallback
+
+
+def extract_text_from_file(filename: str, fileobj: BinaryIO) -> str:
+    """
+    Same as extract_text, but PDFs are parsed straight from a seekable file
+    (e.g. a spooled temp file) instead of a bytes copy.
+    """
+    fileobj.seek(0)
+    if filename.endswith(".pdf"):
+        return _extract_pdf(fileobj)
+    return extract_text(filename, fileobj.read())
+
+
+def _extract_pdf(stream: BinaryIO) -> str:
+    import pypdf
+    try:
+        reader = pypdf.PdfReader(stream)
+        text_content = ""
+        for page in reader.pages:
+            text_content += page.extract_text() + "\n"
+        return text_content
+    except Exception as e:
+        return f"Error parsing PDF: {str(e)}"
+
+
+async def read_upload(file: UploadFile) -> Tuple[bytes, str]:
+    """
+    Read an upload in chunks, computing its sha256 on the way.
+    Returns (content, hex digest).
+    """
+    digest = hashlib.sha256()
+    buffer = io.BytesIO()
+    while True:
+        chunk = await file.read(UPLOAD_READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        digest.update(chunk)
+        buffer.write(chunk)
+    return buffer.getvalue(), digest.hexdigest()
+
+
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2")
+
+
+def is_archive(filename: str) -> bool:
+    return filename.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def _skip_entry(path: str) -> bool:
+    # Directory markers and OS metadata files that ship inside archives
+    name = os.path.basename(path)
+    return not name or name.startswith(".") or "__MACOSX/" in path
+
+
+def iter_archive_entries(filename: str, fileobj: BinaryIO, max_bytes: int) -> Iterator[Tuple[str, Optional[bytes], Optional[str]]]:
+    """
+    Yield (entry filename, bytes, error) one entry at a time from a zip or tar archive.
+    Entries larger than max_bytes come back with None content so the caller
+    can report them without reading them into memory; unreadable entries with
+    None content and the error. Raises if the archive itself can't be opened.
+    Blocking; run in a thread.
+    """
+    if filename.lower().endswith(".zip"):
+        with zipfile.ZipFile(fileobj) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or _skip_entry(info.filename):
+                    continue
+                name = os.path.basename(info.filename)
+                if info.file_size > max_bytes:
+                    yield name, None, None
+                    continue
+                try:
+                    with archive.open(info) as entry:
+                        content = entry.read()
+                except Exception as e:
+                    # Zip entries are independent: report this one and carry on
+                    yield name, None, f"Unreadable archive entry: {e}"
+                    continue
+                yield name, content, None
+    else:
+        # Stream mode: entries are read sequentially without seeking, so a
+        # corrupt entry ends the archive (the caller reports it)
+        with tarfile.open(fileobj=fileobj, mode="r|*") as archive:
+            for member in archive:
+                if not member.isfile() or _skip_entry(member.name):
+                    continue
+                if member.size > max_bytes:
+                    yield os.path.basename(member.name), None, None
+                    continue
+                entry = archive.extractfile(member)
+                yield os.path.basename(member.name), entry.read() if entry else b"", None
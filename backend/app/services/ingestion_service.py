@@ -0,0 +1,296 @@
+"""
+Document ingestion: shared helpers for the upload endpoints, plus the worker
+that ingests presigned (direct-to-S3) uploads outside the API process.
+
+Presigned upload states: pending (client uploading) -> uploaded (client called
+/complete) -> ingesting (claimed by a worker) -> ready / failed. Run the worker
+with `python -m app.services.ingestion_service` (`once` for a single pass).
+"""
+import asyncio
+import hashlib
+import os
+import sys
+import tempfile
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Tuple
+
+from sqlalchemy import delete, update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core.config import settings
+from app.db.session import async_session_factory
+from app.models import Document, Organization
+from app.services.document_parser import extract_text_from_file
+from app.services.s3_service import s3_service
+from app.services.vector_service import vector_service
+
+# Objects are spooled to disk above this size while being ingested
+SPOOL_MAX_MEMORY_BYTES = 8 * 1024 * 1024
+
+
+async def touch_org(session: AsyncSession, org_id: uuid.UUID):
+    # Invalidate ETags of the org's document list without loading the org
+    await session.execute(
+        update(Organization)
+        .where(Organization.id == org_id)
+        .values(data_version=Organization.data_version + 1)
+    )
+
+
+async def find_by_hash(session: AsyncSession, org_id: uuid.UUID, content_sha256: str) -> Optional[Document]:
+    result = await session.exec(
+        select(Document).where(Document.org_id == org_id, Document.content_sha256 == content_sha256)
+    )
+    return result.first()
+
+
+def document_metadata(doc: Document) -> dict:
+    """
+    Metadata stored on every vector of a document, used by section retrieval
+    scopes (vector_service.build_filter) to filter searches in Pinecone.
+    """
+    return {
+        "org_id": str(doc.org_id),
+        "doc_id": str(doc.id),
+        "filename": doc.filename,
+        "doc_type": os.path.splitext(doc.filename)[1].lower().lstrip(".") or "unknown",
+        "upload_ts": int(doc.upload_date.replace(tzinfo=timezone.utc).timestamp()),
+        # Pinecone can't filter on null, so untagged documents are tagged "all"
+        "sections": list(doc.section_tags) if doc.section_tags else ["all"],
+    }
+
+
+def index_document(doc: Document, text_content: str):
+    # Vector Store Ingestion (Pinecone), chunked by the vector service
+    vector_service.add_document(
+        doc_id=str(doc.id),
+        text=text_content,
+        metadata=document_metadata(doc),
+        org_id=str(doc.org_id) # CRITICAL: For Namespace Isolation
+    )
+
+
+def _spool_object(key: str) -> Tuple[tempfile.SpooledTemporaryFile, str]:
+    """
+    Stream an S3 object into a spooled temp file, hashing it on the way.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY_BYTES)
+    digest = hashlib.sha256()
+    try:
+        for chunk in s3_service.iter_file_chunks(key):
+            digest.update(chunk)
+            spool.write(chunk)
+    except Exception:
+        spool.close()
+        raise
+    return spool, digest.hexdigest()
+
+
+async def _drop_duplicate(session: AsyncSession, doc: Document, key: str):
+    # Same content already indexed for this org: the existing document stands in for the new upload
+    await session.delete(doc)
+    await touch_org(session, doc.org_id)
+    await session.commit()
+    await asyncio.to_thread(s3_service.delete_file, key)
+
+
+async def _mark_failed(session: AsyncSession, doc: Document):
+    doc.status = "failed"
+    session.add(doc)
+    await touch_org(session, doc.org_id)
+    await session.commit()
+
+
+async def ingest_uploaded_document(doc_id: uuid.UUID):
+    """
+    Ingest a document uploaded directly to S3 (presigned flow) that this
+    worker has claimed (status "ingesting"): the object is streamed from S3,
+    hashed, deduplicated, parsed and indexed.
+    """
+    async with async_session_factory() as session:
+        doc = await session.get(Document, doc_id)
+        if not doc or doc.status != "ingesting":
+            return
+        org_id = doc.org_id
+        key = s3_service.key_from_url(doc.s3_url)
+
+        try:
+            spool, content_sha256 = await asyncio.to_thread(_spool_object, key)
+        except Exception as e:
+            print(f"Ingestion of {doc_id} failed reading from S3: {e}")
+            await _mark_failed(session, doc)
+            return
+
+        with spool:
+            duplicate = await find_by_hash(session, org_id, content_sha256)
+            if duplicate:
+                await _drop_duplicate(session, doc, key)
+                return
+            try:
+                text_content = await asyncio.to_thread(extract_text_from_file, doc.filename, spool)
+            except Exception as e:
+                print(f"Ingestion of {doc_id} failed parsing: {e}")
+                await _mark_failed(session, doc)
+                return
+
+        doc.content_sha256 = content_sha256
+        doc.status = "ready"
+        session.add(doc)
+        try:
+            # touch_org flushes the row first, so the conflict can surface there too
+            await touch_org(session, org_id)
+            await session.commit()
+        except IntegrityError:
+            # Same content finished ingesting concurrently
+            await session.rollback()
+            doc = await session.get(Document, doc_id)
+            duplicate = await find_by_hash(session, org_id, content_sha256)
+            if not doc:
+                # Deleted while we were ingesting; nothing left to keep
+                await asyncio.to_thread(s3_service.delete_file, key)
+                return
+            if duplicate:
+                await _drop_duplicate(session, doc, key)
+            else:
+                # The other copy was deleted again meanwhile: keep this one after all
+                doc.content_sha256 = content_sha256
+                doc.status = "ready"
+                session.add(doc)
+                await touch_org(session, org_id)
+                await session.commit()
+                await asyncio.to_thread(index_document, doc, text_content)
+            return
+
+        await asyncio.to_thread(index_document, doc, text_content)
+
+
+async def claim_document(session: AsyncSession, doc_id: uuid.UUID, from_status: str, to_status: str) -> bool:
+    """
+    Move a document between upload states if (and only if) it is still in
+    from_status. Exactly one caller wins a race for the same row.
+    """
+    values = {"status": to_status}
+    if to_status == "ingesting":
+        values["claimed_at"] = datetime.utcnow()
+    result = await session.execute(
+        update(Document)
+        .where(Document.id == doc_id, Document.status == from_status)
+        .values(**values)
+    )
+    await session.commit()
+    return result.rowcount == 1
+
+
+async def process_uploaded_documents(limit: Optional[int] = None) -> int:
+    """
+    Claim and ingest documents whose upload was completed ("uploaded").
+    Returns the number of documents ingested.
+    """
+    limit = limit or settings.INGESTION_BATCH_SIZE
+    async with async_session_factory() as session:
+        result = await session.exec(
+            select(Document.id).where(Document.status == "uploaded").order_by(Document.upload_date).limit(limit)
+        )
+        doc_ids = result.all()
+        claimed = [doc_id for doc_id in doc_ids if await claim_document(session, doc_id, "uploaded", "ingesting")]
+
+    for doc_id in claimed:
+        try:
+            await ingest_uploaded_document(doc_id)
+        except Exception as e:
+            # Left "ingesting"; the sweep hands it back once the claim times out
+            print(f"Ingestion of {doc_id} failed: {e}")
+    return len(claimed)
+
+
+async def sweep_stale_uploads() -> Tuple[int, int]:
+    """
+    - Pending uploads never completed within PENDING_UPLOAD_EXPIRY_SECONDS are
+      deleted, aborting their multipart upload (or deleting a single PUT object).
+    - Failed documents still holding a multipart upload get it aborted, so
+      its parts stop being billed.
+    - Claims older than INGESTION_CLAIM_TIMEOUT_SECONDS (a worker died mid
+      ingest) are handed back to the queue.
+    Returns (expired uploads, released claims).
+    """
+    now = datetime.utcnow()
+    expired = 0
+    async with async_session_factory() as session:
+        result = await session.exec(
+            select(Document).where(
+                Document.status == "pending",
+                Document.upload_date < now - timedelta(seconds=settings.PENDING_UPLOAD_EXPIRY_SECONDS),
+            )
+        )
+        for doc in result.all():
+            # Conditional, so a completion racing the sweep wins or loses cleanly
+            deleted = await session.execute(
+                delete(Document).where(Document.id == doc.id, Document.status == "pending")
+            )
+            if deleted.rowcount != 1:
+                continue
+            await touch_org(session, doc.org_id)
+            await session.commit()
+            expired += 1
+            key = s3_service.key_from_url(doc.s3_url)
+            try:
+                if doc.upload_id:
+                    await asyncio.to_thread(s3_service.abort_multipart_upload, key, doc.upload_id)
+                await asyncio.to_thread(s3_service.delete_file, key)
+            except Exception as e:
+                print(f"Cleaning up abandoned upload {doc.id} failed: {e}")
+
+        result = await session.exec(
+            select(Document).where(Document.status == "failed", Document.upload_id.is_not(None))
+        )
+        for doc in result.all():
+            try:
+                await asyncio.to_thread(s3_service.abort_multipart_upload, s3_service.key_from_url(doc.s3_url), doc.upload_id)
+            except Exception as e:
+                print(f"Aborting multipart upload of failed document {doc.id} failed: {e}")
+                continue
+            await session.execute(update(Document).where(Document.id == doc.id).values(upload_id=None))
+        await session.commit()
+
+        released = await session.execute(
+            update(Document)
+            .where(
+                Document.status == "ingesting",
+                Document.claimed_at < now - timedelta(seconds=settings.INGESTION_CLAIM_TIMEOUT_SECONDS),
+            )
+            .values(status="uploaded", claimed_at=None)
+        )
+        await session.commit()
+    return expired, released.rowcount
+
+
+async def run_ingestion_worker(once: bool = False):
+    """
+    Ingestion worker loop: `python -m app.services.ingestion_service`, or from
+    the app lifespan when INGESTION_WORKER_IN_APP is set.
+    """
+    while True:
+        try:
+            expired, released = await sweep_stale_uploads()
+            if expired or released:
+                print(f"Upload sweep: {expired} abandoned uploads removed, {released} stale claims released")
+            ingested = 0
+            while True:
+                batch = await process_uploaded_documents()
+                ingested += batch
+                if not batch:
+                    break
+            if once:
+                print(f"Ingested {ingested} documents")
+        except Exception as e:
+            print(f"Ingestion worker error: {e}")
+        if once:
+            return
+        await asyncio.sleep(settings.INGESTION_POLL_INTERVAL_SECONDS)
+
+
+if __name__ == "__main__":
+    asyncio.run(run_ingestion_worker(once=sys.argv[1:] == ["once"]))
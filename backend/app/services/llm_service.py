@@ -1,41 +1,183 @@
+import asyncio
+import datetime
+import hashlib
+from collections import OrderedDict
+from typing import AsyncIterator, Dict, List, Sequence, Set, Tuple, Union
+
 import google.generativeai as genai
+from google.generativeai import caching
 from app.core.config import settings
+from app.services.prompt_builder import prompt_builder, count_tokens
+
+# Number of per-system-prompt models we keep around (one per Section prompt in practice)
+MODEL_CACHE_SIZE = 256
+
+class LLMError(Exception):
+    pass
 
 class LLMService:
     def __init__(self):
+        self.model_name = settings.GEMINI_MODEL_NAME # Using Flash for speed/cost, can be 'gemini-2.5-pro'
+        # sha256(system prompt) -> (GenerativeModel, expires_at or None, CachedContent or None)
+        self._models: "OrderedDict[str, tuple]" = OrderedDict()
+        self._creating: Dict[str, asyncio.Future] = {}
+        self._deletions: Set[asyncio.Task] = set()
         if settings.GEMINI_API_KEY:
             genai.configure(api_key=settings.GEMINI_API_KEY)
-            self.model = genai.GenerativeModel('gemini-2.5-flash') # Using Flash for speed/cost, can be 'gemini-2.5-pro'
+            self.model = genai.GenerativeModel(self.model_name)
         else:
             self.model = None
 
-    async def get_response(self, system_prompt: str, user_message: str, context: str = "") -> str:
-        if not self.model:
-            return "Gemini API Key not configured."
+    async def _model_for(self, system_instruction: str):
+        """
+        Return a model bound to this system prompt.
+        The system prompt is static per Section, so we pass it as Gemini's system
+        instruction instead of re-sending it inside every user turn. Prompts large
+        enough for Gemini context caching are uploaded once as CachedContent so
+        they are not re-billed and re-processed on every call.
+        """
+        if not system_instruction:
+            return self.model
+
+        key = hashlib.sha256(system_instruction.encode("utf-8")).hexdigest()
+        now = datetime.datetime.utcnow()
 
-        # Gemini 1.5 doesn't strictly have a "system" role in the same way as GPT in the simplified chat history always
-        # But we can pass system instructions during model instantiation, or prepend it.
-        # For per-request system prompts, prepending is the most dynamic way without re-instantiating.
-        
-        full_prompt = f"""
-        SYSTEM INSTRUCTIONS:
-        {system_prompt}
+        cached = self._models.get(key)
+        if cached:
+            model, expires_at, cached_content = cached
+            if expires_at is None or expires_at > now:
+                self._models.move_to_end(key)
+                return model
+            del self._models[key]
+            self._delete_cache(cached_content)
 
-        RELEVANT CONTEXT FROM DOCUMENTS:
-        {context}
+        # Concurrent requests for the same new prompt share one cache upload
+        pending = self._creating.get(key)
+        if pending is None:
+            pending = asyncio.ensure_future(self._create_model(key, system_instruction))
+            self._creating[key] = pending
+            pending.add_done_callback(lambda _: self._creating.pop(key, None))
+        return await asyncio.shield(pending)
 
-        USER MESSAGE:
-        {user_message}
+    async def _create_model(self, key: str, system_instruction: str):
+        model = None
+        expires_at = None
+        cached_content = None
+        if count_tokens(system_instruction) >= settings.GEMINI_CACHE_MIN_TOKENS:
+            ttl = datetime.timedelta(seconds=settings.GEMINI_CACHE_TTL_SECONDS)
+            try:
+                # Blocking HTTP call; keep it off the event loop
+                cached_content = await asyncio.to_thread(
+                    caching.CachedContent.create,
+                    model=f"models/{self.model_name}",
+                    display_name=f"section-prompt-{key[:16]}",
+                    system_instruction=system_instruction,
+                    ttl=ttl,
+                )
+                model = genai.GenerativeModel.from_cached_content(cached_content=cached_content)
+                # Refresh a little before Gemini expires the cache
+                expires_at = datetime.datetime.utcnow() + ttl - datetime.timedelta(seconds=60)
+            except Exception as e:
+                print(f"Gemini cache creation failed, using plain system instruction: {e}")
+
+        if model is None:
+            model = genai.GenerativeModel(self.model_name, system_instruction=system_instruction)
+
+        self._models[key] = (model, expires_at, cached_content)
+        if len(self._models) > MODEL_CACHE_SIZE:
+            _, (_, _, evicted) = self._models.popitem(last=False)
+            self._delete_cache(evicted)
+        return model
+
+    def _delete_cache(self, cached_content):
+        # Cached content is billed per hour of storage until it expires, so drop
+        # the ones we no longer use instead of leaving them to the TTL
+        if cached_content is None:
+            return
+        task = asyncio.create_task(asyncio.to_thread(self._delete_cache_sync, cached_content))
+        self._deletions.add(task)
+        task.add_done_callback(self._deletions.discard)
+
+    @staticmethod
+    def _delete_cache_sync(cached_content):
+        try:
+            cached_content.delete()
+        except Exception as e:
+            print(f"Deleting Gemini cache {cached_content.name} failed: {e}")
+
+    async def generate(
+        self,
+        system_prompt: str,
+        user_message: str,
+        context: Union[str, List[str]] = "",
+        history: Sequence[Tuple[str, str]] = (),
+    ) -> str:
+        """
+        Single-turn generation. Raises LLMError if Gemini fails, so callers can
+        avoid charging (or saving) a turn that produced no answer.
         """
-        
+        if not self.model:
+            return "Gemini API Key not configured."
+
+        # Context can be the raw list of retrieved snippets (preferred, so we can
+        # dedupe and budget per chunk) or a pre-joined string.
+        context_chunks = [context] if isinstance(context, str) else list(context)
+        prompt = prompt_builder.build(system_prompt, user_message, context_chunks, history)
+
         try:
             # We use generate_content for single turn, or start_chat for multi-turn.
-            # Since the backend is stateless (passing history mostly via frontend or DB), 
+            # Since the backend is stateless (passing history mostly via frontend or DB),
             # single turn generation with context is often easier for RAG.
-            response = await self.model.generate_content_async(full_prompt)
-            
+            model = await self._model_for(prompt.system_instruction)
+            response = await model.generate_content_async(prompt.contents)
+
             return response.text
         except Exception as e:
+            raise LLMError(str(e)) from e
+
+    async def get_response(
+        self,
+        system_prompt: str,
+        user_message: str,
+        context: Union[str, List[str]] = "",
+        history: Sequence[Tuple[str, str]] = (),
+    ) -> str:
+        try:
+            return await self.generate(system_prompt, user_message, context, history)
+        except LLMError as e:
             return f"Error contacting Gemini: {str(e)}"
 
+    async def stream_response(
+        self,
+        system_prompt: str,
+        user_message: str,
+        context: Union[str, List[str]] = "",
+        history: Sequence[Tuple[str, str]] = (),
+    ) -> AsyncIterator[str]:
+        """
+        Same prompt as generate, yielding text as Gemini generates it.
+        Raises LLMError if Gemini fails, before or part way through the stream;
+        text already yielded should then be discarded.
+        """
+        if not self.model:
+            yield "Gemini API Key not configured."
+            return
+
+        context_chunks = [context] if isinstance(context, str) else list(context)
+        prompt = prompt_builder.build(system_prompt, user_message, context_chunks, history)
+
+        try:
+            model = await self._model_for(prompt.system_instruction)
+            response = await model.generate_content_async(prompt.contents, stream=True)
+            async for chunk in response:
+                try:
+                    text = chunk.text
+                except ValueError:
+                    # Chunk without text parts (e.g. only safety ratings)
+                    continue
+                if text:
+                    yield text
+        except Exception as e:
+            raise LLMError(str(e)) from e
+
 llm_service = LLMService()
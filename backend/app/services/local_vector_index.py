@@ -0,0 +1,130 @@
+"""
+In-memory stand-in for a Pinecone index (VECTOR_BACKEND=memory).
+
+Implements the subset of the Pinecone Index API that VectorService uses
+(upsert, query, update, delete, list_paginated) with the same metadata filter
+semantics, so scoped retrieval behaves identically in local dev, tests and
+offline evaluation. Not persistent and not meant for production.
+"""
+import math
+from types import SimpleNamespace
+from typing import Any, Dict, List, Mapping, Optional, Sequence
+
+
+def metadata_matches(metadata: Mapping[str, Any], filter: Optional[Mapping[str, Any]]) -> bool:
+    """
+    Evaluate a Pinecone metadata filter against one vector's metadata.
+    Supports $eq, $ne, $gt, $gte, $lt, $lte, $in, $nin, $exists, $and, $or.
+    List-valued metadata matches $eq/$in if any element matches (as in Pinecone).
+    """
+    if not filter:
+        return True
+    for field, condition in filter.items():
+        if field == "$and":
+            if not all(metadata_matches(metadata, sub) for sub in condition):
+                return False
+            continue
+        if field == "$or":
+            if not any(metadata_matches(metadata, sub) for sub in condition):
+                return False
+            continue
+        if not isinstance(condition, Mapping):
+            condition = {"$eq": condition}
+        for op, operand in condition.items():
+            if not _check(metadata, field, op, operand):
+                return False
+    return True
+
+
+def _check(metadata: Mapping[str, Any], field: str, op: str, operand: Any) -> bool:
+    if op == "$exists":
+        return (field in metadata) == bool(operand)
+    if field not in metadata:
+        # Pinecone: $ne / $nin match vectors without the field
+        return op in ("$ne", "$nin")
+
+    value = metadata[field]
+    values = value if isinstance(value, list) else [value]
+    if op == "$eq":
+        return operand in values
+    if op == "$ne":
+        return operand not in values
+    if op == "$in":
+        return any(v in operand for v in values)
+    if op == "$nin":
+        return not any(v in operand for v in values)
+    if op in ("$gt", "$gte", "$lt", "$lte"):
+        try:
+            if op == "$gt":
+                return value > operand
+            if op == "$gte":
+                return value >= operand
+            if op == "$lt":
+                return value < operand
+            return value <= operand
+        except TypeError:
+            return False
+    raise ValueError(f"Unsupported filter operator: {op}")
+
+
+def _cosine(a: Sequence[float], b: Sequence[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+class LocalVectorIndex:
+    def __init__(self):
+        # namespace -> id -> (values, metadata)
+        self._namespaces: Dict[str, Dict[str, tuple]] = {}
+
+    def upsert(self, vectors: List[Dict], namespace: str = "", **kwargs):
+        store = self._namespaces.setdefault(namespace, {})
+        for vector in vectors:
+            store[vector["id"]] = (list(vector["values"]), dict(vector.get("metadata") or {}))
+        return SimpleNamespace(upserted_count=len(vectors))
+
+    def query(self, vector: Sequence[float], top_k: int, namespace: str = "",
+              filter: Optional[Mapping[str, Any]] = None, include_metadata: bool = False, **kwargs):
+        store = self._namespaces.get(namespace, {})
+        scored = [
+            (_cosine(vector, values), vector_id, metadata)
+            for vector_id, (values, metadata) in store.items()
+            if metadata_matches(metadata, filter)
+        ]
+        scored.sort(key=lambda item: item[0], reverse=True)
+        matches = [
+            SimpleNamespace(id=vector_id, score=score, metadata=metadata if include_metadata else {})
+            for score, vector_id, metadata in scored[:top_k]
+        ]
+        return SimpleNamespace(matches=matches)
+
+    def update(self, id: str, values: Optional[Sequence[float]] = None,
+               set_metadata: Optional[Mapping[str, Any]] = None, namespace: str = "", **kwargs):
+        store = self._namespaces.get(namespace, {})
+        if id not in store:
+            return
+        old_values, metadata = store[id]
+        store[id] = (list(values) if values is not None else old_values, {**metadata, **(set_metadata or {})})
+
+    def delete(self, ids: Optional[Sequence[str]] = None, namespace: str = "",
+               delete_all: bool = False, filter: Optional[Mapping[str, Any]] = None, **kwargs):
+        store = self._namespaces.get(namespace, {})
+        if delete_all:
+            store.clear()
+            return
+        for vector_id in list(store):
+            if (ids is not None and vector_id in ids) or (filter and metadata_matches(store[vector_id][1], filter)):
+                del store[vector_id]
+
+    def list_paginated(self, prefix: Optional[str] = None, limit: Optional[int] = None,
+                       pagination_token: Optional[str] = None, namespace: str = "", **kwargs):
+        ids = sorted(i for i in self._namespaces.get(namespace, {}) if not prefix or i.startswith(prefix))
+        start = int(pagination_token or 0)
+        limit = limit or 100
+        page = ids[start:start + limit]
+        next_token = str(start + limit) if start + limit < len(ids) else None
+        return SimpleNamespace(
+            vectors=[SimpleNamespace(id=i) for i in page],
+            pagination=SimpleNamespace(next=next_token) if next_token else None,
+        )
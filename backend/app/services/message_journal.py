@@ -0,0 +1,315 @@
+"""
+Write-behind journal for chat messages.
+
+A chat turn (user + assistant Message and the credit it consumes) is appended
+to a local WAL file and fsync'd before the request returns; a background task
+flushes pending turns to the DB in batches. On startup, WAL files left behind
+by dead workers are replayed. Turns are idempotent on replay: a turn whose
+messages are already in the DB is skipped, credit included.
+
+Pending turns live in the worker's memory, and history and credit checks
+only see this worker's, so write-behind needs a single worker process per
+host (e.g. gunicorn -w 1). start() enforces that with a lock on
+MESSAGE_JOURNAL_PATH.lock and refuses to run next to another live journal.
+
+The WAL file is MESSAGE_JOURNAL_PATH.<pid>, locked while in use, so a
+restarted worker replays whatever its predecessor left behind.
+
+A batch that keeps failing while the DB is reachable is retried turn by turn;
+turns that still fail are moved to MESSAGE_JOURNAL_PATH.deadletter (same JSON
+lines format) so they stop blocking the journal.
+"""
+import asyncio
+import fcntl
+import glob
+import json
+import os
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import text, update
+from sqlmodel import select
+
+from app.core.config import settings
+from app.db.session import async_session_factory
+from app.models import Message, Organization
+
+
+def _message_to_dict(message: Message) -> Dict:
+    return {
+        "id": str(message.id),
+        "conversation_id": str(message.conversation_id),
+        "role": message.role,
+        "content": message.content,
+        "timestamp": message.timestamp.isoformat(),
+    }
+
+
+def _message_from_dict(data: Dict) -> Message:
+    return Message(
+        id=uuid.UUID(data["id"]),
+        conversation_id=uuid.UUID(data["conversation_id"]),
+        role=data["role"],
+        content=data["content"],
+        timestamp=datetime.fromisoformat(data["timestamp"]),
+    )
+
+
+class _Turn:
+    def __init__(self, messages: List[Message], org_id: Optional[uuid.UUID], credits: int, replayed: bool = False):
+        self.messages = messages
+        self.org_id = org_id
+        self.credits = credits
+        # Replayed turns may already be in the DB (crash between commit and WAL truncate)
+        self.replayed = replayed
+
+    def to_json(self) -> str:
+        return json.dumps({
+            "org_id": str(self.org_id) if self.org_id else None,
+            "credits": self.credits,
+            "messages": [_message_to_dict(m) for m in self.messages],
+        })
+
+    @classmethod
+    def from_json(cls, line: str) -> "_Turn":
+        data = json.loads(line)
+        return cls(
+            messages=[_message_from_dict(m) for m in data["messages"]],
+            org_id=uuid.UUID(data["org_id"]) if data["org_id"] else None,
+            credits=data["credits"],
+            replayed=True,
+        )
+
+
+class MessageJournal:
+    def __init__(self, path: str):
+        self.base_path = path
+        self.path = f"{path}.{os.getpid()}"
+        self._file = None
+        self._pending: List[_Turn] = []
+        self._lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._instance_lock = None
+        # Consecutive failed flushes of the batch at the head of the queue
+        self._failures = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._task is not None
+
+    async def start(self):
+        await self._acquire_instance_lock()
+        self.path = f"{self.base_path}.{os.getpid()}"
+        self._file = open(self.path, "a+", encoding="utf-8")
+        fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        # A previous process with the same pid may have left turns in our file
+        self._file.seek(0)
+        self._pending.extend(self._read_turns(self._file))
+        await asyncio.to_thread(self._recover_orphans)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Flush everything still pending and release the WAL. Called on shutdown.
+        """
+        if not self._task:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        while self._pending:
+            await self.flush()
+        self._file.close()
+        os.remove(self.path)
+        self._file = None
+        self._instance_lock.close()
+        self._instance_lock = None
+
+    async def _acquire_instance_lock(self):
+        # Waits a little so a rolling restart's outgoing worker can flush and exit
+        self._instance_lock = open(f"{self.base_path}.lock", "a")
+        deadline = time.monotonic() + settings.MESSAGE_JOURNAL_LOCK_TIMEOUT_SECONDS
+        while True:
+            try:
+                fcntl.flock(self._instance_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    self._instance_lock.close()
+                    self._instance_lock = None
+                    raise RuntimeError(
+                        "MESSAGE_WRITE_BEHIND needs a single worker process: another process is "
+                        f"using the message journal at {self.base_path}. Run one worker or disable write-behind."
+                    )
+                await asyncio.sleep(0.5)
+
+    async def append_turn(self, messages: List[Message], org_id: Optional[uuid.UUID], credits: int = 0):
+        """
+        Durably enqueue a chat turn. Returns once it is fsync'd to the WAL.
+        """
+        turn = _Turn(messages, org_id, credits)
+        line = turn.to_json() + "\n"
+        async with self._lock:
+            await asyncio.to_thread(self._write, line)
+            self._pending.append(turn)
+        if len(self._pending) >= settings.MESSAGE_JOURNAL_BATCH_SIZE:
+            self._wakeup.set()
+
+    def pending_messages(self, conversation_id: uuid.UUID) -> List[Message]:
+        return [
+            m for turn in self._pending for m in turn.messages
+            if m.conversation_id == conversation_id
+        ]
+
+    def pending_credits(self, org_id: uuid.UUID) -> int:
+        return sum(turn.credits for turn in self._pending if turn.org_id == org_id)
+
+    async def flush(self):
+        """
+        Write up to one batch of pending turns to the DB, in enqueue order.
+        """
+        async with self._lock:
+            batch = self._pending[:settings.MESSAGE_JOURNAL_BATCH_SIZE]
+        if not batch:
+            return
+
+        dead: List[_Turn] = []
+        try:
+            await self._commit(batch)
+            self._failures = 0
+        except Exception:
+            self._failures += 1
+            if self._failures < settings.MESSAGE_JOURNAL_MAX_ATTEMPTS:
+                raise
+            dead = await self._isolate_failures(batch)
+            self._failures = 0
+
+        async with self._lock:
+            del self._pending[:len(batch)]
+            if not self._pending:
+                await asyncio.to_thread(self._truncate)
+            elif dead:
+                # The WAL still holds the dead turns; rewrite it with what is left
+                await asyncio.to_thread(self._rewrite, list(self._pending))
+
+    async def _commit(self, batch: List[_Turn]):
+        async with async_session_factory() as session:
+            replayed_ids = [m.id for turn in batch if turn.replayed for m in turn.messages]
+            existing = set()
+            if replayed_ids:
+                result = await session.exec(select(Message.id).where(Message.id.in_(replayed_ids)))
+                existing = set(result.all())
+
+            credits: Dict[uuid.UUID, int] = {}
+            for turn in batch:
+                if any(m.id in existing for m in turn.messages):
+                    continue
+                session.add_all(turn.messages)
+                if turn.org_id and turn.credits:
+                    credits[turn.org_id] = credits.get(turn.org_id, 0) + turn.credits
+
+            for org_id, amount in credits.items():
+                await session.execute(
+                    update(Organization)
+                    .where(Organization.id == org_id)
+                    .values(credits_used=Organization.credits_used + amount)
+                )
+            await session.commit()
+
+    async def _isolate_failures(self, batch: List[_Turn]) -> List[_Turn]:
+        """
+        The batch keeps failing: commit it turn by turn and dead-letter the
+        turns that fail on their own. Re-raises if the DB itself is down, so a
+        DB outage never empties the journal into the dead-letter file.
+        """
+        async with async_session_factory() as session:
+            await session.execute(text("SELECT 1"))
+
+        dead = []
+        for turn in batch:
+            try:
+                await self._commit([turn])
+            except Exception as e:
+                print(f"Message journal: moving turn {turn.messages[0].id if turn.messages else '-'} to dead letter: {e}")
+                dead.append(turn)
+        if dead:
+            await asyncio.to_thread(self._dead_letter, dead)
+        return dead
+
+    async def _run(self):
+        interval = settings.MESSAGE_JOURNAL_FLUSH_INTERVAL_MS / 1000
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                # Turns stay pending (and in the WAL); retry on the next tick
+                print(f"Message journal flush failed: {e}")
+
+    def _write(self, line: str):
+        self._file.write(line)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _dead_letter(self, turns: List[_Turn]):
+        with open(f"{self.base_path}.deadletter", "a", encoding="utf-8") as f:
+            f.write("".join(turn.to_json() + "\n" for turn in turns))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _rewrite(self, turns: List[_Turn]):
+        self._file.truncate(0)
+        self._write("".join(turn.to_json() + "\n" for turn in turns))
+
+    def _truncate(self):
+        self._file.truncate(0)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _recover_orphans(self):
+        """
+        Load turns from WAL files whose worker is gone (their lock is free).
+        They are re-journaled into our own WAL before the orphan file is removed.
+        """
+        for path in sorted(glob.glob(f"{self.base_path}.*")):
+            # Only per-pid WAL files; not our own, the lock or the dead letters
+            if path == self.path or not path.rsplit(".", 1)[-1].isdigit():
+                continue
+            try:
+                orphan = open(path, "r+", encoding="utf-8")
+            except FileNotFoundError:
+                continue
+            try:
+                fcntl.flock(orphan, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                orphan.close() # Owned by a live worker
+                continue
+            with orphan:
+                for turn in self._read_turns(orphan):
+                    self._write(turn.to_json() + "\n")
+                    self._pending.append(turn)
+                os.remove(path)
+
+    @staticmethod
+    def _read_turns(wal) -> List[_Turn]:
+        turns = []
+        for line in wal:
+            if not line.strip():
+                continue
+            try:
+                turns.append(_Turn.from_json(line))
+            except (ValueError, KeyError):
+                continue # Torn write from a crash mid-append
+        return turns
+
+message_journal = MessageJournal(settings.MESSAGE_JOURNAL_PATH)
@@ -0,0 +1,187 @@
+import math
+import re
+from dataclasses import dataclass, field
+from typing import List, Optional, Sequence, Tuple
+
+from app.core.config import settings
+
+# Gemini tokenizes roughly 4 characters per token for English text.
+# Calling count_tokens on the API would add a network round trip per prompt,
+# so we use this estimate for budgeting and keep a safety margin in the limits.
+CHARS_PER_TOKEN = 4
+
+# Chunks sharing at least this fraction of their shingles with an already
+# selected chunk are treated as overlapping and dropped.
+OVERLAP_THRESHOLD = 0.8
+SHINGLE_SIZE = 5
+
+TRUNCATION_MARKER = " ..."
+
+
+def count_tokens(text: str) -> int:
+    """
+    Cheap token estimate used for budgeting prompt sections.
+    """
+    if not text:
+        return 0
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """
+    Truncate text to at most max_tokens (" ..." marker included), cutting on a
+    whitespace boundary when possible.
+    """
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text) <= max_tokens:
+        return text
+
+    limit = max_tokens * CHARS_PER_TOKEN - len(TRUNCATION_MARKER)
+    if limit <= 0:
+        # No room for the marker
+        return text[:max_tokens * CHARS_PER_TOKEN]
+    cut = text[:limit]
+    space = cut.rfind(" ")
+    if space > limit // 2:
+        cut = cut[:space]
+    return cut.rstrip() + TRUNCATION_MARKER
+
+
+def _shingles(text: str) -> set:
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < SHINGLE_SIZE:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def dedupe_chunks(chunks: List[str]) -> List[str]:
+    """
+    Drop empty, duplicate and heavily overlapping chunks, keeping retrieval order.
+    """
+    kept: List[str] = []
+    kept_shingles: List[set] = []
+    for chunk in chunks:
+        if not chunk or not chunk.strip():
+            continue
+        shingles = _shingles(chunk)
+        if not shingles:
+            continue
+        handled = False
+        for i, other in enumerate(kept_shingles):
+            shared = len(shingles & other)
+            if shared / len(shingles) >= OVERLAP_THRESHOLD:
+                # New chunk is (mostly) already covered
+                handled = True
+                break
+            if shared / len(other) >= OVERLAP_THRESHOLD:
+                # New chunk covers a kept one: keep the superset in its slot
+                kept[i] = chunk.strip()
+                kept_shingles[i] = shingles
+                handled = True
+                break
+        if handled:
+            continue
+        kept.append(chunk.strip())
+        kept_shingles.append(shingles)
+    return kept
+
+
+@dataclass
+class AssembledPrompt:
+    # Static per-section prefix, sent as Gemini system instruction (cacheable)
+    system_instruction: str
+    # Dynamic part of the request: recent history + retrieved context + user message
+    contents: str
+    context_chunks: List[str] = field(default_factory=list)
+    system_tokens: int = 0
+    context_tokens: int = 0
+    user_tokens: int = 0
+    history_tokens: int = 0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.system_tokens + self.history_tokens + self.context_tokens + self.user_tokens
+
+
+class PromptBuilder:
+    def __init__(
+        self,
+        max_tokens: Optional[int] = None,
+        system_max_tokens: Optional[int] = None,
+        user_max_tokens: Optional[int] = None,
+        history_max_tokens: Optional[int] = None,
+    ):
+        self.max_tokens = max_tokens or settings.PROMPT_MAX_TOKENS
+        self.system_max_tokens = system_max_tokens or settings.PROMPT_SYSTEM_MAX_TOKENS
+        self.user_max_tokens = user_max_tokens or settings.PROMPT_USER_MAX_TOKENS
+        self.history_max_tokens = settings.PROMPT_HISTORY_MAX_TOKENS if history_max_tokens is None else history_max_tokens
+
+    def _select_history(self, history: Sequence[Tuple[str, str]]) -> List[str]:
+        # Newest messages first until the budget runs out, returned oldest first
+        lines: List[str] = []
+        used = 0
+        for role, content in reversed(history):
+            prefix = f"{'User' if role == 'user' else 'Assistant'}: "
+            # The prefix counts against the budget too
+            remaining = self.history_max_tokens - used - count_tokens(prefix)
+            if remaining <= 0:
+                break
+            line = prefix + truncate_to_tokens(content.strip(), remaining)
+            lines.append(line)
+            used += count_tokens(line)
+        return list(reversed(lines))
+
+    def build(
+        self,
+        system_prompt: str,
+        user_message: str,
+        context_chunks: List[str],
+        history: Sequence[Tuple[str, str]] = (),
+    ) -> AssembledPrompt:
+        """
+        Allocate the token budget across system, user, history and context sections.
+        System and user are capped first, then recent history (role, content)
+        pairs, newest kept first; retrieved context gets what is left,
+        filled in retrieval order with the last chunk truncated to fit.
+        """
+        system_text = truncate_to_tokens(system_prompt.strip(), self.system_max_tokens)
+        user_text = truncate_to_tokens(user_message.strip(), self.user_max_tokens)
+        history_lines = self._select_history(history)
+
+        system_tokens = count_tokens(system_text)
+        user_tokens = count_tokens(user_text)
+        history_tokens = sum(count_tokens(line) for line in history_lines)
+        context_budget = max(self.max_tokens - system_tokens - user_tokens - history_tokens, 0)
+
+        selected: List[str] = []
+        context_tokens = 0
+        for chunk in dedupe_chunks(context_chunks):
+            remaining = context_budget - context_tokens
+            if remaining <= 0:
+                break
+            chunk_tokens = count_tokens(chunk)
+            if chunk_tokens > remaining:
+                chunk = truncate_to_tokens(chunk, remaining)
+                chunk_tokens = count_tokens(chunk)
+            selected.append(chunk)
+            context_tokens += chunk_tokens
+
+        parts = []
+        if history_lines:
+            parts.append("CONVERSATION SO FAR:\n" + "\n".join(history_lines))
+        if selected:
+            parts.append("RELEVANT CONTEXT FROM DOCUMENTS:\n" + "\n\n---\n\n".join(selected))
+        parts.append("USER MESSAGE:\n" + user_text)
+
+        return AssembledPrompt(
+            system_instruction=system_text,
+            contents="\n\n".join(parts),
+            context_chunks=selected,
+            system_tokens=system_tokens,
+            context_tokens=context_tokens,
+            user_tokens=user_tokens,
+            history_tokens=history_tokens,
+        )
+
+prompt_builder = PromptBuilder()
@@ -0,0 +1,268 @@
+"""
+Offline retrieval evaluation.
+
+Replays a labelled question set against the real retrieval code path
+(chunking, document metadata, scope filters, search_matches, re-ranking and
+prompt context budgeting) with a local stand-in for the embedding model and
+vector store, so settings can be compared without Gemini or Pinecone calls.
+
+    python -m app.services.retrieval_eval acme.json \
+        --top-k 1,3,5,10 --chunk-size 500,1000,2000 --rerank 0,20 \
+        --lexical-weight 0,0.3,0.6
+
+Reports recall@k, MRR, prompt context tokens and search latency for every
+combination, and marks the Pareto-optimal ones on recall, MRR and context
+tokens (no other setting is at least as good on all three and better on
+one). The lexical weight only matters when re-ranking is on. Latency is
+reported only by default, since on the in-memory index it is mostly noise;
+pass --pareto-latency to make it a fourth dimension when it means something
+(--gemini, or a real index).
+
+Dataset (one file per org):
+    {
+      "documents": [
+        {"id": "pricing", "filename": "pricing.md", "text": "...", "sections": ["Sales"]},
+        {"id": "q3", "path": "docs/q3.pdf"}
+      ],
+      "questions": [
+        {"question": "What does the Pro plan cost?", "relevant": ["pricing"]},
+        {"question": "...", "relevant": ["q3"], "scope": {"tags": ["Finance"]}}
+      ]
+    }
+"path" is relative to the dataset file and parsed like an upload; "scope"
+is a Section.retrieval_scope.
+
+Stand-in embeddings are hashed bag-of-words vectors: absolute scores differ
+from Gemini's, but relative comparisons between settings still hold. Pass
+--gemini to embed with the configured model instead.
+"""
+import argparse
+import json
+import math
+import os
+import re
+import sys
+import time
+import uuid
+import zlib
+from dataclasses import dataclass
+from itertools import product
+from typing import Dict, List, Optional
+
+from app.core.config import settings
+from app.models import Document
+from app.services.document_parser import extract_text
+from app.services.ingestion_service import document_metadata
+from app.services.local_vector_index import LocalVectorIndex
+from app.services.prompt_builder import PromptBuilder
+from app.services.vector_service import VectorService, build_filter
+
+EMBEDDING_DIM = 768
+EVAL_ORG_ID = "eval"
+
+
+def hashed_embedding(text: str, dim: int = EMBEDDING_DIM) -> List[float]:
+    """
+    Signed feature hashing of unigrams and bigrams, L2 normalised.
+    """
+    words = re.findall(r"\w+", text.lower())
+    vector = [0.0] * dim
+    for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+        h = zlib.crc32(feature.encode("utf-8"))
+        vector[h % dim] += 1.0 if h & 0x80000000 else -1.0
+    norm = math.sqrt(sum(v * v for v in vector))
+    return [v / norm for v in vector] if norm else vector
+
+
+def hashed_embeddings(texts: List[str]) -> List[List[float]]:
+    return [hashed_embedding(t) for t in texts]
+
+
+@dataclass
+class EvalResult:
+    top_k: int
+    chunk_size: int
+    rerank: int
+    lexical_weight: float
+    recall: float
+    mrr: float
+    context_tokens: float
+    latency_ms: float
+    p95_latency_ms: float
+    pareto: bool = False
+
+
+def load_dataset(path: str) -> Dict:
+    with open(path, encoding="utf-8") as f:
+        dataset = json.load(f)
+    base_dir = os.path.dirname(os.path.abspath(path))
+    for doc in dataset["documents"]:
+        if "text" not in doc:
+            doc_path = os.path.join(base_dir, doc["path"])
+            with open(doc_path, "rb") as f:
+                doc["text"] = extract_text(doc_path, f.read())
+        doc.setdefault("filename", os.path.basename(doc.get("path", doc["id"])))
+    return dataset
+
+
+def build_index(dataset: Dict, chunk_size: int, use_gemini: bool = False):
+    """
+    Ingest every document the way uploads are indexed, into an in-memory
+    index. Returns the service and a map from vector doc_id back to the
+    dataset's document labels.
+    """
+    service = VectorService(
+        index=LocalVectorIndex(),
+        embedder=None if use_gemini else hashed_embeddings,
+        chunk_size=chunk_size,
+    )
+    labels: Dict[str, str] = {}
+    items = []
+    for doc in dataset["documents"]:
+        record = Document(
+            id=uuid.uuid4(),
+            org_id=uuid.UUID(int=0),
+            filename=doc["filename"],
+            s3_url="",
+            section_tags=doc.get("sections"),
+        )
+        labels[str(record.id)] = doc["id"]
+        items.append({"doc_id": str(record.id), "text": doc["text"], "metadata": document_metadata(record)})
+    service.add_documents(items, EVAL_ORG_ID)
+    return service, labels
+
+
+def evaluate(service: VectorService, labels: Dict[str, str], questions: List[Dict],
+             top_k: int, chunk_size: int, rerank: int) -> EvalResult:
+    """
+    Run every question through service.search_matches and score the matches
+    against their labels. service.lexical_weight is recorded with the result.
+    """
+    builder = PromptBuilder()
+    recalls, reciprocal_ranks, tokens, latencies = [], [], [], []
+    for q in questions:
+        relevant = set(q["relevant"])
+        started = time.perf_counter()
+        matches = service.search_matches(
+            q["question"], EVAL_ORG_ID, n_results=top_k, filter=build_filter(q.get("scope")),
+            rerank_candidates=rerank,
+        )
+        latencies.append((time.perf_counter() - started) * 1000)
+
+        ranked = [labels.get(m.get("doc_id")) for m in matches]
+        found = relevant & set(ranked)
+        recalls.append(len(found) / len(relevant) if relevant else 1.0)
+        first = next((rank for rank, label in enumerate(ranked, 1) if label in relevant), None)
+        reciprocal_ranks.append(1 / first if first else 0.0)
+        # What the chat prompt would actually carry after dedupe and budgeting
+        prompt = builder.build("", q["question"], [m.get("text_snippet", "") for m in matches])
+        tokens.append(prompt.context_tokens)
+
+    n = len(questions) or 1
+    latencies.sort()
+    return EvalResult(
+        top_k=top_k,
+        chunk_size=chunk_size,
+        rerank=rerank,
+        lexical_weight=service.lexical_weight,
+        recall=sum(recalls) / n,
+        mrr=sum(reciprocal_ranks) / n,
+        context_tokens=sum(tokens) / n,
+        latency_ms=sum(latencies) / n,
+        p95_latency_ms=latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)] if latencies else 0.0,
+    )
+
+
+def mark_pareto(results: List[EvalResult], latency: bool = False) -> List[EvalResult]:
+    """
+    Flag the results no other result dominates on recall, MRR and context
+    tokens (plus mean latency with latency=True).
+    """
+    def costs(r: EvalResult) -> List[float]:
+        # Lower is better on every dimension
+        dims = [-r.recall, -r.mrr, r.context_tokens]
+        if latency:
+            dims.append(r.latency_ms)
+        return dims
+
+    def dominates(a: EvalResult, b: EvalResult) -> bool:
+        pairs = list(zip(costs(a), costs(b)))
+        return all(x <= y for x, y in pairs) and any(x < y for x, y in pairs)
+
+    for r in results:
+        r.pareto = not any(dominates(other, r) for other in results if other is not r)
+    return results
+
+
+def sweep(dataset: Dict, top_ks: List[int], chunk_sizes: List[int], reranks: List[int],
+          use_gemini: bool = False, lexical_weights: Optional[List[float]] = None,
+          pareto_latency: bool = False) -> List[EvalResult]:
+    results = []
+    for chunk_size in chunk_sizes:
+        # Only chunking changes the index; the rest is per search
+        indexed, labels = build_index(dataset, chunk_size, use_gemini)
+        for weight in lexical_weights or [settings.RETRIEVAL_LEXICAL_WEIGHT]:
+            service = VectorService(
+                index=indexed.index,
+                embedder=indexed.embedder,
+                chunk_size=chunk_size,
+                lexical_weight=weight,
+            )
+            for rerank, top_k in product(reranks, top_ks):
+                results.append(evaluate(service, labels, dataset["questions"], top_k, chunk_size, rerank))
+    return mark_pareto(results, latency=pareto_latency)
+
+
+def format_table(results: List[EvalResult]) -> str:
+    lines = [
+        "| pareto | top_k | chunk | rerank | lexical | recall@k | MRR | ctx tokens | latency ms | p95 ms |",
+        "|---|---|---|---|---|---|---|---|---|---|",
+    ]
+    ordered = sorted(results, key=lambda r: (not r.pareto, r.context_tokens, -r.recall))
+    for r in ordered:
+        lines.append(
+            f"| {'*' if r.pareto else ''} | {r.top_k} | {r.chunk_size} | {r.rerank or '-'} | "
+            f"{r.lexical_weight:g} | {r.recall:.3f} | {r.mrr:.3f} | {r.context_tokens:.0f} | {r.latency_ms:.2f} | {r.p95_latency_ms:.2f} |"
+        )
+    return "\n".join(lines)
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def _float_list(value: str) -> List[float]:
+    return [float(v) for v in value.split(",") if v.strip()]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.services.retrieval_eval", description=__doc__.split("\n\n")[0])
+    parser.add_argument("dataset", help="Labelled question/document set (JSON)")
+    parser.add_argument("--top-k", type=_int_list, default=[1, 3, 5, 10])
+    parser.add_argument("--chunk-size", type=_int_list, default=[settings.CHUNK_SIZE_CHARS])
+    parser.add_argument("--rerank", type=_int_list, default=[0],
+                        help="Re-rank candidate counts to try (0 = off)")
+    parser.add_argument("--lexical-weight", type=_float_list, default=[settings.RETRIEVAL_LEXICAL_WEIGHT],
+                        help="Hybrid re-rank lexical weights to try (needs --rerank > top-k)")
+    parser.add_argument("--pareto-latency", action="store_true",
+                        help="Count mean latency in the Pareto check (with --gemini or a real index)")
+    parser.add_argument("--gemini", action="store_true", help="Embed with the configured Gemini model")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args(argv)
+
+    dataset = load_dataset(args.dataset)
+    if not dataset.get("questions"):
+        print("Dataset has no questions")
+        return 1
+    results = sweep(dataset, args.top_k, args.chunk_size, args.rerank, args.gemini,
+                    args.lexical_weight, args.pareto_latency)
+    if args.json:
+        print(json.dumps([r.__dict__ for r in results], indent=2))
+    else:
+        print(f"{len(dataset['documents'])} documents, {len(dataset['questions'])} questions\n")
+        print(format_table(results))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,9 @@
+import asyncio
+import io
+import math
+from typing import Dict, Iterator, List
 import boto3
-from botocore.exceptions import NoCredentialsError
+from botocore.exceptions import ClientError, NoCredentialsError
 from fastapi import UploadFile
 from app.core.config import settings
 
@@ -9,10 +13,18 @@ class S3Service:
             's3',
             aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
             aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-            region_name=settings.AWS_REGION
+            region_name=settings.AWS_REGION,
+            # S3-compatible stand-in (MinIO, moto server) for local dev and tests
+            endpoint_url=settings.S3_ENDPOINT_URL or None
         )
         self.bucket = settings.AWS_BUCKET_NAME
 
+    def object_url(self, key: str) -> str:
+        # Construct URL (assuming public or standard S3 structure)
+        if settings.S3_ENDPOINT_URL:
+            return f"{settings.S3_ENDPOINT_URL.rstrip('/')}/{self.bucket}/{key}"
+        return f"https://{self.bucket}.s3.{settings.AWS_REGION}.amazonaws.com/{key}"
+
     async def upload_file(self, file_obj: UploadFile, key: str) -> str:
         """
         Uploads a file to S3 and returns the public URL (or S3 URI).
@@ -24,8 +36,9 @@ class S3Service:
             # Reset cursor since it might have been read
             await file_obj.seek(0)
             
-            # We use upload_fileobj for efficient streaming
-            self.s3_client.upload_fileobj(
+            # We use upload_fileobj for efficient streaming, in a thread as boto3 blocks
+            await asyncio.to_thread(
+                self.s3_client.upload_fileobj,
                 file_obj.file,
                 self.bucket,
                 key,
@@ -36,11 +49,107 @@ class S3Service:
             # But usually we consume it. If we need it again, we might need to seek(0).
             # await file_obj.seek(0)
 
-            # Construct URL (assuming public or standard S3 structure)
-            url = f"https://{self.bucket}.s3.{settings.AWS_REGION}.amazonaws.com/{key}"
-            return url
+            return self.object_url(key)
         except Exception as e:
             print(f"S3 Upload Error: {e}")
             raise e
 
+    def upload_bytes(self, data: bytes, key: str, content_type: str | None = None) -> str:
+        """
+        Upload an in-memory payload (e.g. an archive entry). Blocking; run in a thread.
+        """
+        if not self.bucket:
+            return "S3 Bucket not configured"
+
+        extra_args = {'ContentType': content_type} if content_type else None
+        self.s3_client.upload_fileobj(io.BytesIO(data), self.bucket, key, ExtraArgs=extra_args)
+        return self.object_url(key)
+
+    def key_from_url(self, url: str) -> str | None:
+        """
+        Recover the object key from a URL returned by upload_file.
+        """
+        prefix = self.object_url("")
+        if not self.bucket or not url.startswith(prefix):
+            return None
+        return url[len(prefix):]
+
+    def download_file(self, key: str) -> bytes:
+        """
+        Fetch an object's bytes (used when re-indexing existing documents).
+        """
+        response = self.s3_client.get_object(Bucket=self.bucket, Key=key)
+        return response["Body"].read()
+
+    def iter_file_chunks(self, key: str, chunk_size: int = 1024 * 1024) -> Iterator[bytes]:
+        """
+        Stream an object's bytes without holding it in memory. Blocking; run in a thread.
+        """
+        response = self.s3_client.get_object(Bucket=self.bucket, Key=key)
+        yield from response["Body"].iter_chunks(chunk_size=chunk_size)
+
+    def create_presigned_upload(self, key: str, content_type: str | None, size: int) -> Dict:
+        """
+        Presigned URL(s) for the client to upload straight to S3.
+        Small files get a single PUT; larger ones a multipart upload with one
+        presigned URL per part (completed via complete_multipart_upload).
+        """
+        expires = settings.PRESIGNED_URL_EXPIRY_SECONDS
+        if size <= settings.MULTIPART_THRESHOLD_BYTES:
+            params = {"Bucket": self.bucket, "Key": key}
+            headers = {}
+            if content_type:
+                params["ContentType"] = content_type
+                headers["Content-Type"] = content_type
+            url = self.s3_client.generate_presigned_url("put_object", Params=params, ExpiresIn=expires)
+            return {"method": "PUT", "url": url, "headers": headers}
+
+        extra = {"ContentType": content_type} if content_type else {}
+        upload = self.s3_client.create_multipart_upload(Bucket=self.bucket, Key=key, **extra)
+        part_size = settings.MULTIPART_PART_SIZE_BYTES
+        part_count = max(1, math.ceil(size / part_size))
+        parts = [
+            {
+                "part_number": number,
+                "url": self.s3_client.generate_presigned_url(
+                    "upload_part",
+                    Params={"Bucket": self.bucket, "Key": key, "UploadId": upload["UploadId"], "PartNumber": number},
+                    ExpiresIn=expires
+                )
+            }
+            for number in range(1, part_count + 1)
+        ]
+        return {"method": "PUT", "upload_id": upload["UploadId"], "part_size": part_size, "parts": parts}
+
+    def complete_multipart_upload(self, key: str, upload_id: str, parts: List[Dict]) -> None:
+        """
+        parts: [{"part_number": int, "etag": str}] as reported by the client.
+        """
+        self.s3_client.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": [
+                {"PartNumber": p["part_number"], "ETag": p["etag"]}
+                for p in sorted(parts, key=lambda p: p["part_number"])
+            ]}
+        )
+
+    def abort_multipart_upload(self, key: str, upload_id: str) -> None:
+        try:
+            self.s3_client.abort_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id)
+        except ClientError as e:
+            # Already completed or aborted: nothing left to clean up
+            if e.response.get("Error", {}).get("Code") != "NoSuchUpload":
+                raise
+
+    def delete_file(self, key: str) -> None:
+        if not self.bucket:
+            return
+        try:
+            self.s3_client.delete_object(Bucket=self.bucket, Key=key)
+        except Exception as e:
+            print(f"S3 Delete Error: {e}")
+            raise e
+
 s3_service = S3Service()
@@ -0,0 +1,187 @@
+"""
+Vector index maintenance jobs.
+
+- reconcile: diff DB documents against each org namespace and purge orphan vectors
+- reembed: backfill every document into PINECONE_INDEX_NAME_NEXT with EMBEDDING_MODEL_NEXT
+- retag: rewrite the filter metadata (sections, doc_type, upload_ts, ...) on existing
+  vectors without re-embedding, e.g. for documents indexed before section scopes
+
+Embedding model switch-over without downtime:
+1. Set PINECONE_INDEX_NAME_NEXT / EMBEDDING_MODEL_NEXT and deploy. New uploads are dual-written.
+2. Run `python -m app.services.vector_maintenance reembed` to backfill existing documents.
+3. Point PINECONE_INDEX_NAME / EMBEDDING_MODEL at the new values, clear the *_NEXT
+   settings and deploy again (rolling restart). Searches move to the new index.
+"""
+import asyncio
+import sys
+import uuid
+from typing import Optional, Set
+
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core.config import settings
+from app.db.session import async_session_factory
+from app.models import Document, Organization
+from app.services.document_parser import extract_text
+from app.services.ingestion_service import document_metadata
+from app.services.s3_service import s3_service
+from app.services.vector_service import vector_service
+
+
+def _doc_id_from_vector_id(vector_id: str) -> str:
+    # Vector ids are "<doc_id>" or "<doc_id>#<chunk>"
+    return vector_id.split("#", 1)[0]
+
+
+async def _reload(session: AsyncSession, doc_id: uuid.UUID) -> Optional[Document]:
+    # Fresh from the DB, not the session's identity map
+    result = await session.exec(
+        select(Document).where(Document.id == doc_id).execution_options(populate_existing=True)
+    )
+    return result.first()
+
+
+async def reconcile_org(session: AsyncSession, org_id: uuid.UUID) -> int:
+    """
+    Delete vectors in the org namespace that no longer have a Document row.
+    Returns the number of vectors purged.
+
+    Vectors are listed before the rows are read: documents are committed
+    before they are indexed, so any vector listed here whose row is missing
+    afterwards really is an orphan, and an upload landing meanwhile is safe.
+    """
+    listed = []
+    for index in (vector_service.index, vector_service.next_index):
+        if not index:
+            continue
+        vector_ids = await asyncio.to_thread(
+            lambda: list(vector_service.list_ids(str(org_id), index=index))
+        )
+        listed.append((index, vector_ids))
+
+    result = await session.exec(select(Document.id).where(Document.org_id == org_id))
+    known: Set[str] = {str(doc_id) for doc_id in result.all()}
+
+    purged = 0
+    for index, vector_ids in listed:
+        orphans = [vid for vid in vector_ids if _doc_id_from_vector_id(vid) not in known]
+        if orphans:
+            purged += await asyncio.to_thread(
+                vector_service.delete_ids, orphans, str(org_id), index
+            )
+    return purged
+
+
+async def reconcile_all() -> int:
+    async with async_session_factory() as session:
+        result = await session.exec(select(Organization.id))
+        org_ids = result.all()
+        purged = 0
+        for org_id in org_ids:
+            try:
+                purged += await reconcile_org(session, org_id)
+            except Exception as e:
+                print(f"Vector reconcile failed for org {org_id}: {e}")
+    return purged
+
+
+async def reembed_org(session: AsyncSession, org_id: uuid.UUID) -> int:
+    """
+    Re-embed every document of an org into the migration target index.
+    Returns the number of documents written.
+    """
+    if not vector_service.next_index:
+        return 0
+
+    result = await session.exec(select(Document).where(Document.org_id == org_id))
+    count = 0
+    for doc in result.all():
+        key = s3_service.key_from_url(doc.s3_url)
+        if not key:
+            print(f"Skipping {doc.id}: no S3 object to re-embed from")
+            continue
+        try:
+            content = await asyncio.to_thread(s3_service.download_file, key)
+            text_content = extract_text(doc.filename, content)
+            await asyncio.to_thread(
+                vector_service.backfill_document,
+                str(doc.id),
+                text_content,
+                document_metadata(doc),
+                str(org_id),
+            )
+            # The document may have been deleted or re-tagged while we were
+            # writing it, in which case the endpoint already ran against the
+            # next index and our write undid that
+            current = await _reload(session, doc.id)
+            if current is None:
+                await asyncio.to_thread(vector_service.delete_document, str(doc.id), str(org_id))
+                continue
+            if document_metadata(current) != document_metadata(doc):
+                await asyncio.to_thread(
+                    vector_service.update_metadata, str(doc.id), document_metadata(current), str(org_id)
+                )
+            count += 1
+        except Exception as e:
+            print(f"Re-embed failed for document {doc.id}: {e}")
+    return count
+
+
+async def reembed_all() -> int:
+    async with async_session_factory() as session:
+        result = await session.exec(select(Organization.id))
+        count = 0
+        for org_id in result.all():
+            count += await reembed_org(session, org_id)
+    return count
+
+
+async def retag_all() -> int:
+    """
+    Sync every document's current metadata onto its vectors.
+    Returns the number of vectors updated.
+    """
+    async with async_session_factory() as session:
+        result = await session.exec(select(Document.id).where(Document.status == "ready"))
+        count = 0
+        for doc_id in result.all():
+            # Re-read right before writing so a concurrent re-tag or delete isn't overwritten
+            doc = await _reload(session, doc_id)
+            if doc is None:
+                continue
+            try:
+                count += await asyncio.to_thread(
+                    vector_service.update_metadata, str(doc.id), document_metadata(doc), str(doc.org_id)
+                )
+            except Exception as e:
+                print(f"Re-tag failed for document {doc.id}: {e}")
+    return count
+
+
+async def run_reconciler_periodically():
+    """
+    Background loop started from the app lifespan when
+    VECTOR_RECONCILE_INTERVAL_SECONDS > 0.
+    """
+    while True:
+        await asyncio.sleep(settings.VECTOR_RECONCILE_INTERVAL_SECONDS)
+        try:
+            purged = await reconcile_all()
+            if purged:
+                print(f"Vector reconciler purged {purged} orphan vectors")
+        except Exception as e:
+            print(f"Vector reconciler error: {e}")
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    if command == "reconcile":
+        print(f"Purged {asyncio.run(reconcile_all())} orphan vectors")
+    elif command == "reembed":
+        print(f"Re-embedded {asyncio.run(reembed_all())} documents")
+    elif command == "retag":
+        print(f"Re-tagged {asyncio.run(retag_all())} vectors")
+    else:
+        print("Usage: python -m app.services.vector_maintenance [reconcile|reembed|retag]")
+        sys.exit(1)
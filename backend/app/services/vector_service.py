@@ -1,12 +1,137 @@
+import re
+import time
 from pinecone import Pinecone
 from app.core.config import settings
-from typing import List, Dict
+from app.services.local_vector_index import LocalVectorIndex
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+# Pinecone accepts at most 1000 ids per delete call
+DELETE_BATCH_SIZE = 1000
+# Gemini batch embedding accepts at most 100 texts per request
+EMBED_BATCH_SIZE = 100
+UPSERT_BATCH_SIZE = 100
+
+
+class VectorIndexError(Exception):
+    pass
+
+
+def chunk_text(text: str, size: int | None = None, overlap: int | None = None) -> List[str]:
+    """
+    Split text into overlapping character windows, preferring to cut on whitespace.
+    """
+    size = size or settings.CHUNK_SIZE_CHARS
+    overlap = settings.CHUNK_OVERLAP_CHARS if overlap is None else overlap
+    overlap = min(overlap, size // 2)
+    text = text.strip()
+    if len(text) <= size:
+        return [text] if text else []
+
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + size, len(text))
+        if end < len(text):
+            cut = text.rfind(" ", start + size // 2, end)
+            if cut > 0:
+                end = cut
+        chunks.append(text[start:end].strip())
+        if end >= len(text):
+            break
+        start = end - overlap
+    return [c for c in chunks if c]
+
+
+def build_filter(scope: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    Turn a Section.retrieval_scope into a Pinecone metadata filter.
+    Scope keys (all optional, combined with AND):
+    - tags: section tags a document must carry; untagged ("all") documents
+      still match unless include_untagged is false
+    - doc_types: file extensions, e.g. ["pdf", "csv"]
+    - filenames: exact filenames
+    - since_days: only documents uploaded in the last N days
+    No scope means no filter (the whole org namespace).
+    """
+    if not scope:
+        return None
+
+    clauses = []
+    if scope.get("tags"):
+        tags = list(scope["tags"])
+        if scope.get("include_untagged", True):
+            tags.append("all")
+        clauses.append({"sections": {"$in": tags}})
+    if scope.get("doc_types"):
+        clauses.append({"doc_type": {"$in": [t.lower().lstrip(".") for t in scope["doc_types"]]}})
+    if scope.get("filenames"):
+        clauses.append({"filename": {"$in": list(scope["filenames"])}})
+    if scope.get("since_days"):
+        clauses.append({"upload_ts": {"$gte": int(time.time()) - int(scope["since_days"]) * 86400}})
+
+    if not clauses:
+        return None
+    if len(clauses) == 1:
+        return clauses[0]
+    return {"$and": clauses}
+
+
+def lexical_rerank(query: str, matches: List[Any], weight: float) -> List[Any]:
+    """
+    Hybrid re-ranking: blend each match's vector score with the fraction of
+    query terms found in its text. weight=0 keeps the vector order.
+    """
+    terms = {t for t in re.findall(r"\w+", query.lower()) if len(t) > 2}
+    if not terms or weight <= 0:
+        return list(matches)
+
+    def blended(match) -> float:
+        text = ((match.metadata or {}).get("text_snippet") or "").lower()
+        words = set(re.findall(r"\w+", text))
+        overlap = len(terms & words) / len(terms)
+        return (1 - weight) * (match.score or 0.0) + weight * overlap
+
+    return sorted(matches, key=blended, reverse=True)
+
 
 class VectorService:
-    def __init__(self):
-        if settings.PINECONE_API_KEY:
+    def __init__(
+        self,
+        index=None,
+        next_index=None,
+        embedder: Optional[Callable[[List[str]], List[List[float]]]] = None,
+        chunk_size: int | None = None,
+        chunk_overlap: int | None = None,
+        rerank_candidates: int | None = None,
+        lexical_weight: float | None = None,
+    ):
+        """
+        Everything defaults to settings. Pass an index (and next_index) to use
+        instead of the configured backend, and an embedder (texts -> vectors)
+        to replace the Gemini embedding calls, e.g. for offline evaluation.
+        """
+        self.embedding_model = settings.EMBEDDING_MODEL
+        self.embedder = embedder
+        self.chunk_size = chunk_size or settings.CHUNK_SIZE_CHARS
+        self.chunk_overlap = settings.CHUNK_OVERLAP_CHARS if chunk_overlap is None else chunk_overlap
+        self.rerank_candidates = settings.RETRIEVAL_RERANK_CANDIDATES if rerank_candidates is None else rerank_candidates
+        self.lexical_weight = settings.RETRIEVAL_LEXICAL_WEIGHT if lexical_weight is None else lexical_weight
+        self.next_index = next_index
+        self.next_embedding_model = (settings.EMBEDDING_MODEL_NEXT or settings.EMBEDDING_MODEL) if next_index else None
+        if index is not None:
+            self.index = index
+        elif settings.VECTOR_BACKEND == "memory":
+            self.index = LocalVectorIndex()
+            if settings.PINECONE_INDEX_NAME_NEXT:
+                self.next_index = LocalVectorIndex()
+                self.next_embedding_model = settings.EMBEDDING_MODEL_NEXT or settings.EMBEDDING_MODEL
+        elif settings.PINECONE_API_KEY:
             self.pc = Pinecone(api_key=settings.PINECONE_API_KEY)
             self.index = self.pc.Index(settings.PINECONE_INDEX_NAME)
+            # Migration target for a new embedding model (dual-write while backfilling)
+            if settings.PINECONE_INDEX_NAME_NEXT:
+                self.next_index = self.pc.Index(settings.PINECONE_INDEX_NAME_NEXT)
+                self.next_embedding_model = settings.EMBEDDING_MODEL_NEXT or settings.EMBEDDING_MODEL
         else:
             self.index = None
 
@@ -15,82 +140,196 @@ class VectorService:
         Add a document to the Pinecone index.
         CRITICAL: Use 'namespace' derived from org_id for isolation.
         """
+        self.add_documents([{"doc_id": doc_id, "text": text, "metadata": metadata}], org_id)
+
+    def add_documents(self, documents: List[Dict], org_id: str):
+        """
+        Batch variant of add_document for bulk ingestion.
+        Each item is {"doc_id", "text", "metadata"}; embeddings and upserts are
+        sent in batches instead of one request per document.
+        """
         if not self.index:
             print("Pinecone not initialized.")
             return
 
-        # Simple embedding mock (since we switched from Chroma which had built-in extraction)
-        # In PROD: You MUST generate embeddings using OpenAI/Gemini Embedding API first.
-        # For this scaffold, we will assume a placeholder embedding function or 
-        # use Gemini to get embeddings if available.
-        
-        # Let's try to get embedding from Gemini since we have the key
-        embedding = self._get_embedding(text)
-        if not embedding:
+        self._upsert(self.index, self.embedding_model, documents, org_id)
+        if self.next_index:
+            self._upsert(self.next_index, self.next_embedding_model, documents, org_id)
+
+    def backfill_document(self, doc_id: str, text: str, metadata: Dict, org_id: str):
+        """
+        Write a document into the migration target index only (re-embed job).
+        """
+        if not self.next_index:
+            return
+        self._upsert(self.next_index, self.next_embedding_model,
+                     [{"doc_id": doc_id, "text": text, "metadata": metadata}], org_id)
+
+    def _upsert(self, index, model: str, documents: List[Dict], org_id: str):
+        # Every chunk carries its document's metadata so searches can filter on it;
+        # the chunk text itself goes in text_snippet for the prompt
+        chunks = []
+        for d in documents:
+            for n, chunk in enumerate(chunk_text(d["text"], self.chunk_size, self.chunk_overlap)):
+                chunks.append({
+                    "id": f"{d['doc_id']}#{n}",
+                    "text": chunk,
+                    "metadata": {**d["metadata"], "doc_id": d["doc_id"], "chunk": n, "text_snippet": chunk},
+                })
+        if not chunks:
             return
 
         # Namespace is crucial for multi-tenancy isolation
-        namespace = f"org_{org_id}" 
-
-        self.index.upsert(
-            vectors=[
-                {
-                    "id": doc_id,
-                    "values": embedding,
-                    "metadata": metadata
-                }
-            ],
-            namespace=namespace
-        )
+        namespace = f"org_{org_id}"
+
+        embeddings = self._get_embeddings([c["text"] for c in chunks], model=model)
+        vectors = [
+            {"id": c["id"], "values": embedding, "metadata": c["metadata"]}
+            for c, embedding in zip(chunks, embeddings)
+        ]
+        for start in range(0, len(vectors), UPSERT_BATCH_SIZE):
+            index.upsert(vectors=vectors[start:start + UPSERT_BATCH_SIZE], namespace=namespace)
 
-    def search(self, query: str, org_id: str, n_results: int = 3) -> List[str]:
+    def update_metadata(self, doc_id: str, metadata: Dict, org_id: str) -> int:
         """
-        Search for relevant documents within the Organization's namespace to prevent leaks.
+        Re-tag every vector of a document in place (no re-embedding).
+        Returns the number of vectors updated in the active index. Raises
+        VectorIndexError if an index can't list the document's chunk ids.
+        """
+        updated = 0
+        namespace = f"org_{org_id}"
+        for index in (self.index, self.next_index):
+            if not index:
+                continue
+            try:
+                ids = [vid for vid in self.list_ids(org_id, prefix=doc_id, index=index)
+                       if vid.split("#", 1)[0] == doc_id]
+            except Exception as e:
+                # Listing is only supported on serverless indexes, and updates
+                # go by id, so there is no way to reach the chunks
+                print(f"ERROR: cannot re-tag vectors of document {doc_id}, Pinecone list failed: {e}")
+                raise VectorIndexError(f"Index does not support listing vector ids: {e}") from e
+            for vector_id in ids:
+                index.update(id=vector_id, set_metadata={**metadata, "doc_id": doc_id}, namespace=namespace)
+            if index is self.index:
+                updated = len(ids)
+        return updated
+
+    def embed_query(self, query: str) -> List[float]:
+        return self._get_embedding(query)
+
+    def search_matches(self, query: str, org_id: str, n_results: int = 3,
+                       filter: Optional[Dict] = None, embedding: Optional[List[float]] = None,
+                       rerank_candidates: Optional[int] = None) -> List[Dict]:
+        """
+        Top matching chunks (metadata dicts) in the org namespace, optionally
+        restricted by a metadata filter (see build_filter). Pass a precomputed
+        query embedding to search several scopes with a single embedding call.
+        With rerank_candidates (default self.rerank_candidates) > n_results, that
+        many candidates are fetched and re-ranked with lexical_rerank before
+        cutting to n_results.
         """
         if not self.index:
             return []
 
-        embedding = self._get_embedding(query)
+        embedding = embedding or self.embed_query(query)
         if not embedding:
             return []
-            
+
         namespace = f"org_{org_id}"
 
+        query_args = {}
+        if filter:
+            query_args["filter"] = filter
+        if rerank_candidates is None:
+            rerank_candidates = self.rerank_candidates
+        rerank = rerank_candidates > n_results
         results = self.index.query(
             vector=embedding,
-            top_k=n_results,
+            top_k=rerank_candidates if rerank else n_results,
             include_metadata=True,
-            namespace=namespace
+            namespace=namespace,
+            **query_args
         )
-        
+        if not results or not results.matches:
+            return []
+        matches = results.matches
+        if rerank:
+            matches = lexical_rerank(query, matches, self.lexical_weight)[:n_results]
+        return [match.metadata or {} for match in matches]
+
+    def search(self, query: str, org_id: str, n_results: int = 3,
+               filter: Optional[Dict] = None, embedding: Optional[List[float]] = None) -> List[str]:
+        """
+        Search for relevant documents within the Organization's namespace to prevent leaks.
+        """
         docs = []
-        if results and results.matches:
-            for match in results.matches:
-                # We stored the text inside metadata? Probably better to store text in metadata
-                # for simple RAG. In huge scale, store text in DB/S3 and fetch by ID.
-                # For this MVP, let's assume valid metadata 'text' field or just file reference.
-                # Since earlier we passed full text, let's assume we store snippets in metadata.
-                # NOTE: Pinecone metadata limit is 40KB. Large text needs chunking.
-                # For MVP: we just return "found in document X" or if we saved text in metadata.
-                
-                # If we didn't save text in metadata in add_document, we can't return it here.
-                # Let's fix add_document logic implicitly to save snippet.
-                if 'text_snippet' in match.metadata:
-                    docs.append(match.metadata['text_snippet'])
-                else:
-                    docs.append(f"Content from {match.metadata.get('filename', 'unknown')}")
-        
+        for metadata in self.search_matches(query, org_id, n_results, filter=filter, embedding=embedding):
+            if 'text_snippet' in metadata:
+                docs.append(metadata['text_snippet'])
+            else:
+                docs.append(f"Content from {metadata.get('filename', 'unknown')}")
         return docs
 
-    def _get_embedding(self, text: str) -> List[float]:
+    def list_ids(self, org_id: str, prefix: str | None = None, index=None) -> Iterator[str]:
+        """
+        Iterate over all vector ids in the org namespace (optionally by id prefix).
+        """
+        index = index or self.index
+        if not index:
+            return
+        namespace = f"org_{org_id}"
+        token = None
+        while True:
+            page = index.list_paginated(prefix=prefix, pagination_token=token, namespace=namespace)
+            for vector in page.vectors or []:
+                yield vector.id
+            if page.pagination is None or not page.pagination.next:
+                break
+            token = page.pagination.next
+
+    def delete_ids(self, ids: List[str], org_id: str, index=None) -> int:
+        """
+        Bulk delete vectors from the org namespace in API-sized batches.
+        """
+        index = index or self.index
+        if not index or not ids:
+            return 0
+        namespace = f"org_{org_id}"
+        for start in range(0, len(ids), DELETE_BATCH_SIZE):
+            index.delete(ids=ids[start:start + DELETE_BATCH_SIZE], namespace=namespace)
+        return len(ids)
+
+    def delete_document(self, doc_id: str, org_id: str):
+        """
+        Remove every vector belonging to a document from all live indexes.
+        Vector ids are the document id, or "<doc_id>#<n>" for chunks.
+        """
+        for index in (self.index, self.next_index):
+            if not index:
+                continue
+            try:
+                ids = {doc_id}
+                ids.update(self.list_ids(org_id, prefix=doc_id, index=index))
+            except Exception as e:
+                # Listing is only supported on serverless indexes; pod-based ones
+                # can delete by metadata instead, and every chunk carries doc_id
+                print(f"Pinecone list failed, deleting by doc_id filter: {e}")
+                index.delete(filter={"doc_id": doc_id}, namespace=f"org_{org_id}")
+                continue
+            self.delete_ids(sorted(ids), org_id, index=index)
+
+    def _get_embedding(self, text: str, model: str | None = None) -> List[float]:
         """
         Helper to generate embeddings using Gemini.
         """
+        if self.embedder:
+            return self.embedder([text])[0]
         import google.generativeai as genai
         if settings.GEMINI_API_KEY:
              # Just use the 'embedding-001' model
              result = genai.embed_content(
-                 model="models/text-embedding-004",
+                 model=model or self.embedding_model,
                  content=text,
                  task_type="retrieval_document",
                  title="Embedding"
@@ -98,4 +337,25 @@ class VectorService:
              return result['embedding']
         return [0.0] * 768 # Fallback mock
 
+    def _get_embeddings(self, texts: List[str], model: str | None = None) -> List[List[float]]:
+        """
+        Batch embedding helper, EMBED_BATCH_SIZE texts per Gemini request.
+        """
+        if self.embedder:
+            return self.embedder(texts)
+        import google.generativeai as genai
+        if not settings.GEMINI_API_KEY:
+            return [[0.0] * 768 for _ in texts] # Fallback mock
+
+        embeddings: List[List[float]] = []
+        for start in range(0, len(texts), EMBED_BATCH_SIZE):
+            result = genai.embed_content(
+                model=model or self.embedding_model,
+                content=texts[start:start + EMBED_BATCH_SIZE],
+                task_type="retrieval_document",
+                title="Embedding"
+            )
+            embeddings.extend(result['embedding'])
+        return embeddings
+
 vector_service = VectorService()
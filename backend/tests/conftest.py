@@ -0,0 +1,71 @@
+"""
+Shared fixtures: the app on a throwaway SQLite database, with S3 mocked by moto.
+Settings are read at import time, so the environment is set before app imports.
+Test dependencies: pip install -r requirements-dev.txt
+"""
+import os
+import tempfile
+import uuid
+
+_db_dir = tempfile.mkdtemp(prefix="axel-tests-")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{_db_dir}/test.db"
+os.environ["AWS_BUCKET_NAME"] = "axel-test"
+os.environ["AWS_ACCESS_KEY_ID"] = "testing"
+os.environ["AWS_SECRET_ACCESS_KEY"] = "testing"
+for key in ("GEMINI_API_KEY", "PINECONE_API_KEY", "S3_ENDPOINT_URL", "CACHE_BUS_BACKEND", "MESSAGE_WRITE_BEHIND"):
+    os.environ.pop(key, None)
+
+import boto3
+import pytest
+from fastapi.testclient import TestClient
+from moto import mock_aws
+
+from app.core.config import settings
+from app.main import app
+from app.services.s3_service import s3_service
+
+API = settings.API_V1_STR
+
+
+@pytest.fixture(scope="session")
+def s3():
+    with mock_aws():
+        client = boto3.client("s3", region_name=settings.AWS_REGION)
+        client.create_bucket(Bucket=settings.AWS_BUCKET_NAME)
+        # The service built its client at import, before moto was active
+        original = s3_service.s3_client
+        s3_service.s3_client = client
+        yield client
+        s3_service.s3_client = original
+
+
+@pytest.fixture(scope="session")
+def client(s3):
+    with TestClient(app) as c:
+        yield c
+
+
+@pytest.fixture
+def auth(client):
+    """
+    A fresh user with an onboarded org. Returns the Authorization headers.
+    """
+    email = f"{uuid.uuid4().hex[:12]}@example.com"
+    r = client.post(f"{API}/auth/register", json={"email": email, "password": "secret"})
+    headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+    r = client.post(
+        f"{API}/onboarding/setup",
+        data={"org_name": "Acme", "industry": "Tech"},
+        files={"file": ("intro.txt", f"About {email}".encode(), "text/plain")},
+        headers=headers,
+    )
+    assert r.status_code == 200, r.text
+    return headers
+
+
+@pytest.fixture
+def run(client):
+    """
+    Run a coroutine function on the app's event loop, where the engine's connections live.
+    """
+    return lambda fn, *args: client.portal.call(fn, *args)
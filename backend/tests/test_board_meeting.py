@@ -0,0 +1,48 @@
+import json
+
+from app.api.api_v1.endpoints import chat
+from app.core.config import settings
+from app.services.llm_service import LLMError
+
+API = settings.API_V1_STR
+
+
+def _credits(client, auth):
+    return client.get(f"{API}/auth/me", headers=auth).json()["org"]["credits_used"]
+
+
+def _board(client, auth, **body):
+    r = client.post(f"{API}/chat/board", json={"message": "Plan?", **body}, headers=auth)
+    assert r.status_code == 200, r.text
+    return [json.loads(line) for line in r.text.splitlines()]
+
+
+def test_failed_agents_are_reported_and_not_charged(client, auth, monkeypatch):
+    sections = client.get(f"{API}/chat/sections", headers=auth).json()
+    generate = chat.llm_service.generate
+    calls = []
+
+    async def flaky(*args, **kwargs):
+        # The first agent to ask fails
+        calls.append(1)
+        if len(calls) == 1:
+            raise LLMError("quota exceeded")
+        return await generate(*args, **kwargs)
+    monkeypatch.setattr(chat.llm_service, "generate", flaky)
+
+    before = _credits(client, auth)
+    events = _board(client, auth, synthesize=True)
+    errors = [e for e in events if e["type"] == "error"]
+    agents = [e for e in events if e["type"] == "agent"]
+    assert len(errors) == 1 and errors[0]["section_id"] in {s["id"] for s in sections}
+    assert len(agents) == len(sections) - 1
+    assert all("Error contacting Gemini" not in e["response"] for e in agents)
+    # One credit per delivered answer, plus the synthesis
+    assert _credits(client, auth) == before + len(agents) + 1
+
+
+def test_board_meeting_cannot_overdraw_credits(client, auth, monkeypatch):
+    sections = client.get(f"{API}/chat/sections", headers=auth).json()
+    monkeypatch.setattr(chat.message_journal, "pending_credits", lambda org_id: 100 - len(sections) + 1)
+    r = client.post(f"{API}/chat/board", json={"message": "Plan?"}, headers=auth)
+    assert r.status_code == 403
@@ -0,0 +1,95 @@
+import io
+import tarfile
+import uuid
+import zipfile
+
+from app.api.api_v1.endpoints import documents
+from app.core.config import settings
+
+API = settings.API_V1_STR
+
+
+def _zip(entries):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as z:
+        for name, data in entries.items():
+            z.writestr(name, data)
+    return buffer.getvalue()
+
+
+def _bulk(client, auth, files):
+    r = client.post(f"{API}/documents/upload/bulk", files=[("files", f) for f in files], headers=auth)
+    assert r.status_code == 200, r.text
+    return {d["filename"]: d for d in r.json()}
+
+
+def _keys(s3, prefix=""):
+    return [o["Key"] for o in s3.list_objects_v2(Bucket=settings.AWS_BUCKET_NAME).get("Contents", [])
+            if o["Key"].startswith(prefix)]
+
+
+def test_broken_archive_is_reported_per_file(client, auth, s3):
+    good = _zip({"good.txt": uuid.uuid4().hex})
+    results = _bulk(client, auth, [
+        ("broken.zip", b"not a zip at all", "application/zip"),
+        ("good.zip", good, "application/zip"),
+        ("plain.txt", uuid.uuid4().hex.encode(), "text/plain"),
+    ])
+    assert results["broken.zip"]["status"] == "error"
+    assert results["good.txt"]["status"] == "uploaded"
+    assert results["plain.txt"]["status"] == "uploaded"
+
+
+def test_truncated_tar_keeps_entries_read_before_the_damage(client, auth, s3):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w") as t:
+        for name in ("first.txt", "second.txt"):
+            data = uuid.uuid4().hex.encode() * 100
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            t.addfile(info, io.BytesIO(data))
+    data = buffer.getvalue()
+    results = _bulk(client, auth, [("docs.tar", data[:len(data) // 2 + 700], "application/x-tar")])
+    assert results["first.txt"]["status"] == "uploaded"
+    assert results["docs.tar"]["status"] == "error"
+
+
+def test_failed_commit_removes_written_objects(client, auth, s3, monkeypatch):
+    async def fail(session, org_id):
+        raise RuntimeError("database went away")
+    monkeypatch.setattr(documents, "touch_org", fail)
+
+    names = [f"{uuid.uuid4().hex}.txt" for _ in range(3)]
+    before = set(_keys(s3))
+    try:
+        client.post(f"{API}/documents/upload/bulk",
+                    files=[("files", (name, uuid.uuid4().hex.encode(), "text/plain")) for name in names],
+                    headers=auth)
+    except RuntimeError:
+        pass
+    assert set(_keys(s3)) == before
+
+
+def test_repeats_in_a_batch_follow_their_first_copy(client, auth, s3, monkeypatch):
+    extract_text = documents.extract_text
+
+    def fail_broken(filename, content):
+        if filename.startswith("broken"):
+            raise ValueError("unreadable")
+        return extract_text(filename, content)
+    monkeypatch.setattr(documents, "extract_text", fail_broken)
+
+    text, broken = uuid.uuid4().hex.encode(), uuid.uuid4().hex.encode()
+    results = _bulk(client, auth, [
+        ("first.txt", text, "text/plain"),
+        ("again.txt", text, "text/plain"),
+        ("broken.txt", broken, "text/plain"),
+        ("copy.txt", broken, "text/plain"),
+    ])
+    assert results["first.txt"]["status"] == "uploaded"
+    assert results["again.txt"]["status"] == "duplicate"
+    assert results["again.txt"]["document_id"] == results["first.txt"]["document_id"]
+    assert results["broken.txt"]["status"] == "error"
+    # Never points at a document that wasn't created
+    assert results["copy.txt"]["status"] == "error"
+    assert results["copy.txt"]["document_id"] is None
@@ -0,0 +1,22 @@
+from app.api import deps
+from app.db.session import async_session_factory
+from app.services.cache_bus import LocalCache, cache_bus
+
+
+def test_resync_flushes_every_local_cache():
+    cache = LocalCache("resync-test:", ttl_seconds=60)
+    cache.set("a", 1)
+    cache_bus._resync()
+    assert cache.get("a") is None
+
+
+def test_cached_user_is_a_fresh_instance_per_request(client, auth, run):
+    token = auth["Authorization"].split()[1]
+
+    async def resolve():
+        async with async_session_factory() as session:
+            return await deps.user_from_token(session, token)
+
+    first, second = run(resolve), run(resolve)
+    assert first is not second
+    assert first.id == second.id and first.email == second.email
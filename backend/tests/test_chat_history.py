@@ -0,0 +1,45 @@
+import uuid
+
+from app.core.config import settings
+
+API = settings.API_V1_STR
+
+
+def _conversation(client, auth):
+    section_id = client.get(f"{API}/chat/sections", headers=auth).json()[0]["id"]
+    return client.post(f"{API}/chat/start", params={"section_id": section_id}, headers=auth).json()
+
+
+def test_history_of_another_users_conversation_is_not_found(client, auth):
+    conversation_id = _conversation(client, auth)
+    client.post(f"{API}/chat/", json={"conversation_id": conversation_id, "message": "secret"}, headers=auth)
+
+    email = f"{uuid.uuid4().hex[:12]}@example.com"
+    r = client.post(f"{API}/auth/register", json={"email": email, "password": "secret"})
+    stranger = {"Authorization": f"Bearer {r.json()['access_token']}"}
+
+    assert client.get(f"{API}/chat/{conversation_id}/history", headers=stranger).status_code == 404
+    assert client.get(f"{API}/chat/{conversation_id}/history", headers=auth).status_code == 200
+
+
+def test_history_limit_keeps_the_newest_messages(client, auth):
+    conversation_id = _conversation(client, auth)
+    for text in ("one", "two"):
+        client.post(f"{API}/chat/", json={"conversation_id": conversation_id, "message": text}, headers=auth)
+
+    r = client.get(f"{API}/chat/{conversation_id}/history", params={"limit": 2}, headers=auth)
+    assert [m["role"] for m in r.json()] == ["user", "assistant"]
+    assert r.json()[0]["content"] == "two"
+
+
+def test_history_pages_back_with_before(client, auth):
+    conversation_id = _conversation(client, auth)
+    for text in ("one", "two", "three"):
+        client.post(f"{API}/chat/", json={"conversation_id": conversation_id, "message": text}, headers=auth)
+
+    url = f"{API}/chat/{conversation_id}/history"
+    page = client.get(url, params={"limit": 4}, headers=auth)
+    assert page.headers["X-Has-More"] == "true"
+    older = client.get(url, params={"limit": 4, "before": page.json()[0]["timestamp"]}, headers=auth)
+    assert older.headers["X-Has-More"] == "false"
+    assert [m["content"] for m in older.json() + page.json() if m["role"] == "user"] == ["one", "two", "three"]
@@ -0,0 +1,31 @@
+import asyncio
+import json
+import uuid
+
+from app.api.api_v1.endpoints.chat_ws import ChatSession
+
+
+class FakeWebSocket:
+    def __init__(self, frames):
+        self.frames = frames
+
+    async def receive_text(self):
+        if not self.frames:
+            await asyncio.sleep(3600)
+        return json.dumps(self.frames.pop(0))
+
+
+def test_cancel_is_read_while_the_client_is_not_reading():
+    async def scenario():
+        session = ChatSession(FakeWebSocket([{"type": "ping"}, {"type": "bogus"}, {"type": "cancel"}]),
+                              uuid.uuid4(), uuid.uuid4())
+        # Outbox full: the client stopped reading mid-answer
+        while not session.outbox.full():
+            session.outbox.put_nowait({"type": "token", "text": "..."})
+        session.generation = asyncio.create_task(asyncio.sleep(3600))
+        receiver = asyncio.create_task(session._receive_loop())
+        await asyncio.sleep(0.05)
+        receiver.cancel()
+        assert session.generation.cancelled()
+
+    asyncio.run(scenario())
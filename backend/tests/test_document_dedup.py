@@ -0,0 +1,42 @@
+import uuid
+
+from sqlalchemy.exc import IntegrityError
+
+from app.api.api_v1.endpoints import documents
+from app.core.config import settings
+
+API = settings.API_V1_STR
+
+
+def _upload(client, auth, name, data, **form):
+    r = client.post(f"{API}/documents/upload", files={"file": (name, data, "text/plain")}, data=form, headers=auth)
+    assert r.status_code == 200, r.text
+    return r.json()
+
+
+def _keys(s3):
+    return {o["Key"] for o in s3.list_objects_v2(Bucket=settings.AWS_BUCKET_NAME).get("Contents", [])}
+
+
+def test_duplicate_upload_reports_ignored_sections(client, auth, s3):
+    data = uuid.uuid4().hex.encode()
+    first = _upload(client, auth, "plan.txt", data)
+    again = _upload(client, auth, "plan-copy.txt", data, sections="Sales")
+    assert again["document_id"] == first["document_id"]
+    assert again["deduplicated"] is True
+    assert again["sections_ignored"] == ["Sales"]
+
+
+def test_replace_losing_a_dedup_race_changes_nothing(client, auth, s3, monkeypatch):
+    original = _upload(client, auth, "notes.txt", uuid.uuid4().hex.encode())
+    keys = _keys(s3)
+
+    async def conflict(session, org_id):
+        raise IntegrityError("UPDATE organization", {}, Exception("duplicate content_sha256"))
+    monkeypatch.setattr(documents, "touch_org", conflict)
+
+    r = client.put(f"{API}/documents/{original['document_id']}",
+                   files={"file": ("notes.txt", uuid.uuid4().hex.encode(), "text/plain")}, headers=auth)
+    assert r.status_code == 409
+    # The new object is gone and the current one was never overwritten
+    assert _keys(s3) == keys
@@ -0,0 +1,23 @@
+from app.core.config import settings
+
+API = settings.API_V1_STR
+
+
+def _get(client, auth, path, etag=None):
+    headers = {**auth, "If-None-Match": etag} if etag else auth
+    return client.get(f"{API}{path}", headers=headers)
+
+
+def test_chat_turn_only_invalidates_the_credit_display(client, auth):
+    etags = {path: _get(client, auth, path).headers["ETag"] for path in ("/documents/", "/chat/sections", "/auth/me")}
+
+    section_id = client.get(f"{API}/chat/sections", headers=auth).json()[0]["id"]
+    conversation_id = client.post(f"{API}/chat/start", params={"section_id": section_id}, headers=auth).json()
+    r = client.post(f"{API}/chat/", json={"conversation_id": conversation_id, "message": "hi"}, headers=auth)
+    assert r.status_code == 200
+
+    assert _get(client, auth, "/documents/", etags["/documents/"]).status_code == 304
+    assert _get(client, auth, "/chat/sections", etags["/chat/sections"]).status_code == 304
+    me = _get(client, auth, "/auth/me", etags["/auth/me"])
+    assert me.status_code == 200
+    assert me.json()["org"]["credits_used"] == 1
@@ -0,0 +1,61 @@
+import uuid
+
+import pytest
+
+from app.core.config import settings
+from app.db.session import async_session_factory
+from app.models import Message
+from app.services.message_journal import MessageJournal, _Turn
+
+
+def _turn(content):
+    conversation_id = uuid.uuid4()
+    return [
+        Message(conversation_id=conversation_id, role="user", content="question"),
+        Message(conversation_id=conversation_id, role="assistant", content=content),
+    ]
+
+
+def test_poison_turn_moves_to_dead_letter(client, run, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "MESSAGE_JOURNAL_MAX_ATTEMPTS", 2)
+    journal = MessageJournal(str(tmp_path / "journal.wal"))
+    good, bad = _turn("answer"), _turn(None)
+
+    async def scenario():
+        await journal.start()
+        try:
+            await journal.append_turn(good, None)
+            await journal.append_turn(bad, None)
+            # Stop the background loop so the test drives every flush
+            journal._task.cancel()
+            with pytest.raises(Exception):
+                await journal.flush()
+            await journal.flush()
+            assert not journal._pending
+            async with async_session_factory() as session:
+                assert await session.get(Message, good[1].id)
+                assert not await session.get(Message, bad[1].id)
+        finally:
+            journal._task = None
+            journal._file.close()
+            journal._instance_lock.close()
+
+    run(scenario)
+    lines = (tmp_path / "journal.wal.deadletter").read_text().splitlines()
+    assert [_Turn.from_json(line).messages[1].id for line in lines] == [bad[1].id]
+
+
+def test_second_journal_on_the_same_path_is_refused(client, run, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "MESSAGE_JOURNAL_LOCK_TIMEOUT_SECONDS", 0)
+    path = str(tmp_path / "journal.wal")
+    first, second = MessageJournal(path), MessageJournal(path)
+
+    async def scenario():
+        await first.start()
+        try:
+            with pytest.raises(RuntimeError, match="single worker"):
+                await second.start()
+        finally:
+            await first.stop()
+
+    run(scenario)
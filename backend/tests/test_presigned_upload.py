@@ -0,0 +1,156 @@
+import hashlib
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import update
+
+from app.core.config import settings
+from app.db.session import async_session_factory
+from app.models import Document
+from app.services.ingestion_service import process_uploaded_documents, sweep_stale_uploads
+
+API = settings.API_V1_STR
+
+
+def _documents(client, auth):
+    return {d["id"]: d for d in client.get(f"{API}/documents/", headers=auth).json()}
+
+
+def _presign(client, auth, filename, size, **extra):
+    r = client.post(f"{API}/documents/presign", json={"filename": filename, "size": size, **extra}, headers=auth)
+    assert r.status_code == 200, r.text
+    return r.json()
+
+
+def _set_document(run, doc_id, **values):
+    async def apply():
+        async with async_session_factory() as session:
+            await session.execute(update(Document).where(Document.id == uuid.UUID(doc_id)).values(**values))
+            await session.commit()
+    run(apply)
+
+
+def test_single_put_upload_is_ingested_by_the_worker(client, auth, s3, run):
+    data = b"Quarterly revenue grew 12%."
+    started = _presign(client, auth, "q3.txt", len(data), content_type="text/plain")
+    doc_id = started["document_id"]
+    assert _documents(client, auth)[doc_id]["status"] == "pending"
+
+    s3.put_object(Bucket=settings.AWS_BUCKET_NAME, Key=started["key"], Body=data)
+    r = client.post(f"{API}/documents/{doc_id}/complete", json={}, headers=auth)
+    assert r.status_code == 200
+    # Ingestion happens in the worker, not the request
+    assert _documents(client, auth)[doc_id]["status"] == "uploaded"
+
+    assert run(process_uploaded_documents) >= 1
+    assert _documents(client, auth)[doc_id]["status"] == "ready"
+
+
+def test_complete_only_succeeds_once(client, auth, s3):
+    data = b"only once"
+    started = _presign(client, auth, "once.txt", len(data))
+    s3.put_object(Bucket=settings.AWS_BUCKET_NAME, Key=started["key"], Body=data)
+
+    first = client.post(f"{API}/documents/{started['document_id']}/complete", json={}, headers=auth)
+    second = client.post(f"{API}/documents/{started['document_id']}/complete", json={}, headers=auth)
+    assert first.status_code == 200
+    assert second.status_code == 409
+
+
+def test_multipart_upload(client, auth, s3, run, monkeypatch):
+    monkeypatch.setattr(settings, "MULTIPART_THRESHOLD_BYTES", 1)
+    monkeypatch.setattr(settings, "MULTIPART_PART_SIZE_BYTES", 5 * 1024 * 1024)
+    data = b"a" * (5 * 1024 * 1024) + b"tail"
+    started = _presign(client, auth, "big.txt", len(data))
+    upload = started["upload"]
+    assert len(upload["parts"]) == 2
+
+    parts = []
+    for part in upload["parts"]:
+        offset = (part["part_number"] - 1) * upload["part_size"]
+        etag = s3.upload_part(
+            Bucket=settings.AWS_BUCKET_NAME, Key=started["key"], UploadId=upload["upload_id"],
+            PartNumber=part["part_number"], Body=data[offset:offset + upload["part_size"]],
+        )["ETag"]
+        parts.append({"part_number": part["part_number"], "etag": etag})
+
+    # A bad part list leaves the upload pending so the client can retry
+    r = client.post(f"{API}/documents/{started['document_id']}/complete",
+                    json={"upload_id": upload["upload_id"], "parts": parts[:1] + [{"part_number": 2, "etag": "bad"}]},
+                    headers=auth)
+    assert r.status_code == 400
+    assert _documents(client, auth)[started["document_id"]]["status"] == "pending"
+
+    r = client.post(f"{API}/documents/{started['document_id']}/complete",
+                    json={"upload_id": upload["upload_id"], "parts": parts}, headers=auth)
+    assert r.status_code == 200
+    run(process_uploaded_documents)
+    assert _documents(client, auth)[started["document_id"]]["status"] == "ready"
+
+
+def test_duplicate_content_is_dropped(client, auth, s3, run):
+    data = b"same bytes twice"
+    first = _presign(client, auth, "one.txt", len(data))
+    s3.put_object(Bucket=settings.AWS_BUCKET_NAME, Key=first["key"], Body=data)
+    client.post(f"{API}/documents/{first['document_id']}/complete", json={}, headers=auth)
+    run(process_uploaded_documents)
+
+    # Known hash: no upload at all
+    again = _presign(client, auth, "two.txt", len(data), sha256=hashlib.sha256(data).hexdigest())
+    assert again == {"document_id": first["document_id"], "deduplicated": True}
+
+    # Unannounced duplicate: the pending row and its object go away during ingestion
+    second = _presign(client, auth, "three.txt", len(data))
+    s3.put_object(Bucket=settings.AWS_BUCKET_NAME, Key=second["key"], Body=data)
+    client.post(f"{API}/documents/{second['document_id']}/complete", json={}, headers=auth)
+    run(process_uploaded_documents)
+    docs = _documents(client, auth)
+    assert first["document_id"] in docs
+    assert second["document_id"] not in docs
+    assert "Contents" not in s3.list_objects_v2(Bucket=settings.AWS_BUCKET_NAME, Prefix=second["key"])
+
+
+def test_sweep_removes_abandoned_uploads_and_releases_stale_claims(client, auth, s3, run, monkeypatch):
+    monkeypatch.setattr(settings, "MULTIPART_THRESHOLD_BYTES", 1)
+    abandoned = _presign(client, auth, "abandoned.txt", 10)
+    upload_id = abandoned["upload"]["upload_id"]
+    _set_document(run, abandoned["document_id"], upload_date=datetime.utcnow() - timedelta(days=2))
+
+    monkeypatch.setattr(settings, "MULTIPART_THRESHOLD_BYTES", 64 * 1024 * 1024)
+    data = b"worker died"
+    stuck = _presign(client, auth, "stuck.txt", len(data))
+    s3.put_object(Bucket=settings.AWS_BUCKET_NAME, Key=stuck["key"], Body=data)
+    client.post(f"{API}/documents/{stuck['document_id']}/complete", json={}, headers=auth)
+    _set_document(run, stuck["document_id"], status="ingesting", claimed_at=datetime.utcnow() - timedelta(hours=1))
+
+    expired, released = run(sweep_stale_uploads)
+    assert expired >= 1 and released >= 1
+
+    docs = _documents(client, auth)
+    assert abandoned["document_id"] not in docs
+    uploads = s3.list_multipart_uploads(Bucket=settings.AWS_BUCKET_NAME).get("Uploads", [])
+    assert upload_id not in [u["UploadId"] for u in uploads]
+    assert docs[stuck["document_id"]]["status"] == "uploaded"
+
+    run(process_uploaded_documents)
+    assert _documents(client, auth)[stuck["document_id"]]["status"] == "ready"
+
+
+def test_multipart_upload_needs_its_parts(client, auth, s3, monkeypatch):
+    monkeypatch.setattr(settings, "MULTIPART_THRESHOLD_BYTES", 1)
+    started = _presign(client, auth, "parts.txt", 10)
+    r = client.post(f"{API}/documents/{started['document_id']}/complete", json={}, headers=auth)
+    assert r.status_code == 400
+    assert _documents(client, auth)[started["document_id"]]["status"] == "pending"
+
+
+def test_sweep_aborts_multipart_uploads_of_failed_documents(client, auth, s3, run, monkeypatch):
+    monkeypatch.setattr(settings, "MULTIPART_THRESHOLD_BYTES", 1)
+    started = _presign(client, auth, "failed.txt", 10)
+    upload_id = started["upload"]["upload_id"]
+    _set_document(run, started["document_id"], status="failed")
+
+    run(sweep_stale_uploads)
+    uploads = s3.list_multipart_uploads(Bucket=settings.AWS_BUCKET_NAME).get("Uploads", [])
+    assert upload_id not in [u["UploadId"] for u in uploads]
+    assert _documents(client, auth)[started["document_id"]]["status"] == "failed"
@@ -0,0 +1,47 @@
+from app.services.prompt_builder import PromptBuilder, count_tokens, dedupe_chunks, truncate_to_tokens
+
+WORDS = " ".join(f"word{i}" for i in range(400))
+
+
+def test_dedupe_drops_duplicates_and_overlaps():
+    chunk = " ".join(f"alpha{i}" for i in range(30))
+    overlapping = chunk + " omega"
+    other = " ".join(f"beta{i}" for i in range(30))
+    assert dedupe_chunks([chunk, "", "  ", chunk, overlapping, other]) == [chunk, other]
+
+
+def test_dedupe_keeps_the_superset_in_the_first_slot():
+    part = " ".join(f"alpha{i}" for i in range(20))
+    whole = part + " " + " ".join(f"alpha{i}" for i in range(20, 40))
+    other = " ".join(f"beta{i}" for i in range(30))
+    assert dedupe_chunks([part, other, whole]) == [whole, other]
+
+
+def test_truncation_stays_within_the_budget():
+    for budget in (1, 2, 5, 50):
+        cut = truncate_to_tokens(WORDS, budget)
+        assert count_tokens(cut) <= budget
+    assert truncate_to_tokens(WORDS, 50).endswith(" ...")
+    assert truncate_to_tokens("short", 50) == "short"
+
+
+def test_build_caps_every_section():
+    builder = PromptBuilder(max_tokens=300, system_max_tokens=50, user_max_tokens=40, history_max_tokens=60)
+    history = [("user", WORDS), ("assistant", WORDS), ("user", WORDS)]
+    chunks = [" ".join(f"c{n}w{i}" for i in range(200)) for n in range(5)]
+    prompt = builder.build(WORDS, WORDS, chunks, history)
+
+    assert prompt.system_tokens <= 50
+    assert prompt.user_tokens <= 40
+    assert prompt.history_tokens <= 60
+    assert prompt.total_tokens <= 300
+    # Context gets exactly what is left, the last chunk cut to fit
+    assert prompt.context_tokens <= 300 - prompt.system_tokens - prompt.user_tokens - prompt.history_tokens
+    assert prompt.context_chunks[-1].endswith(" ...")
+
+
+def test_history_keeps_the_newest_messages():
+    builder = PromptBuilder(history_max_tokens=10)
+    prompt = builder.build("", "question", [], [("user", "old " * 50), ("assistant", "newest answer")])
+    assert "Assistant: newest answer" in prompt.contents
+    assert prompt.history_tokens <= 10
@@ -0,0 +1,184 @@
+"""
+Every endpoint with a @query_budget runs within it, measured on SQLite with
+a cold user cache (the worst case for authentication).
+"""
+import hashlib
+import io
+import uuid
+import zipfile
+from contextlib import contextmanager
+
+from app.api.api_v1.endpoints import chat
+from app.api.deps import user_cache
+from app.core.config import settings
+from app.db.query_counter import count_queries
+from app.db.session import async_session_factory
+from app.main import app
+from app.models import Conversation, Section
+from app.services.conversation_archive import archive_conversation, segment_cache
+from sqlmodel import select
+
+API = settings.API_V1_STR
+
+
+def budget_of(method: str, path: str) -> int:
+    for route in app.routes:
+        if getattr(route, "path", None) == API + path and method in getattr(route, "methods", ()):
+            return route.endpoint.__query_budget__
+    raise LookupError(f"{method} {path} has no route")
+
+
+@contextmanager
+def within_budget(method: str, path: str):
+    user_cache.clear()
+    with count_queries(max_queries=budget_of(method, path)) as counter:
+        yield counter
+
+
+def _sections(client, auth):
+    return client.get(f"{API}/chat/sections", headers=auth).json()
+
+
+def _upload(client, auth, name="doc.txt", content=None):
+    content = content or uuid.uuid4().hex.encode()
+    r = client.post(f"{API}/documents/upload", files={"file": (name, content, "text/plain")}, headers=auth)
+    return r.json()["document_id"]
+
+
+def _conversation(client, auth):
+    section_id = _sections(client, auth)[0]["id"]
+    return client.post(f"{API}/chat/start", params={"section_id": section_id}, headers=auth).json()
+
+
+def test_auth(client):
+    email = f"{uuid.uuid4().hex[:12]}@example.com"
+    with within_budget("POST", "/auth/register"):
+        r = client.post(f"{API}/auth/register", json={"email": email, "password": "secret"})
+    assert r.status_code == 200
+    headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+
+    with within_budget("POST", "/auth/login"):
+        r = client.post(f"{API}/auth/login", data={"username": email, "password": "secret"})
+    assert r.status_code == 200
+
+    with within_budget("POST", "/onboarding/setup"):
+        r = client.post(
+            f"{API}/onboarding/setup",
+            data={"org_name": "Acme", "industry": "Tech"},
+            files={"file": ("intro.txt", b"Welcome", "text/plain")},
+            headers=headers,
+        )
+    assert r.status_code == 200
+
+    with within_budget("GET", "/auth/me"):
+        assert client.get(f"{API}/auth/me", headers=headers).status_code == 200
+
+
+def test_documents(client, auth, s3):
+    _upload(client, auth)
+    with within_budget("GET", "/documents/"):
+        assert client.get(f"{API}/documents/", headers=auth).status_code == 200
+
+    with within_budget("POST", "/documents/upload"):
+        r = client.post(f"{API}/documents/upload", files={"file": ("new.txt", b"brand new", "text/plain")}, headers=auth)
+    doc_id = r.json()["document_id"]
+    with within_budget("POST", "/documents/upload"):
+        r = client.post(f"{API}/documents/upload", files={"file": ("again.txt", b"brand new", "text/plain")}, headers=auth)
+    assert r.json()["deduplicated"]
+
+    with within_budget("PUT", "/documents/{doc_id}"):
+        assert client.put(f"{API}/documents/{doc_id}", files={"file": ("v2.txt", b"version 2", "text/plain")},
+                          headers=auth).status_code == 200
+
+    with within_budget("PUT", "/documents/{doc_id}/sections"):
+        assert client.put(f"{API}/documents/{doc_id}/sections", json={"sections": ["Finance"]},
+                          headers=auth).status_code == 200
+
+    with within_budget("DELETE", "/documents/{doc_id}"):
+        assert client.delete(f"{API}/documents/{doc_id}", headers=auth).status_code == 200
+
+
+def test_bulk_upload(client, auth, s3):
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as z:
+        for n in range(5):
+            z.writestr(f"file{n}.txt", f"bulk {n} {uuid.uuid4()}")
+        z.writestr("copy.txt", "bulk 0 repeated")
+        z.writestr("copy2.txt", "bulk 0 repeated")
+    with within_budget("POST", "/documents/upload/bulk"):
+        r = client.post(f"{API}/documents/upload/bulk",
+                        files=[("files", ("docs.zip", archive.getvalue(), "application/zip"))], headers=auth)
+    assert [d["status"] for d in r.json()].count("uploaded") == 6
+
+
+def test_presigned_upload(client, auth, s3):
+    data = b"direct to s3"
+    with within_budget("POST", "/documents/presign"):
+        r = client.post(f"{API}/documents/presign", json={"filename": "d.txt", "size": len(data)}, headers=auth)
+    started = r.json()
+    s3.put_object(Bucket=settings.AWS_BUCKET_NAME, Key=started["key"], Body=data)
+    with within_budget("POST", "/documents/{doc_id}/complete"):
+        r = client.post(f"{API}/documents/{started['document_id']}/complete", json={}, headers=auth)
+    assert r.status_code == 200
+
+    with within_budget("POST", "/documents/presign"):
+        r = client.post(f"{API}/documents/presign",
+                        json={"filename": "e.txt", "size": 5, "sha256": hashlib.sha256(b"fresh").hexdigest()},
+                        headers=auth)
+    assert "upload" in r.json()
+
+
+def test_sections(client, auth):
+    with within_budget("GET", "/chat/sections"):
+        sections = _sections(client, auth)
+    with within_budget("PUT", "/chat/sections/{section_id}/scope"):
+        r = client.put(f"{API}/chat/sections/{sections[0]['id']}/scope", json={"tags": ["Finance"]}, headers=auth)
+    assert r.status_code == 200
+
+
+def test_chat(client, auth):
+    section_id = _sections(client, auth)[0]["id"]
+    with within_budget("POST", "/chat/start"):
+        conversation_id = client.post(f"{API}/chat/start", params={"section_id": section_id}, headers=auth).json()
+    with within_budget("POST", "/chat/"):
+        r = client.post(f"{API}/chat/", json={"conversation_id": conversation_id, "message": "hi"}, headers=auth)
+    assert r.status_code == 200
+
+
+def test_board_meeting(client, auth, monkeypatch):
+    # The budget covers the setup; each answer is saved while streaming, in a
+    # session of its own, outside it
+    setup = []
+    persist_turn = chat._persist_turn
+
+    def first_save(*args, **kwargs):
+        if not setup:
+            setup.append(counter.count)
+        return persist_turn(*args, **kwargs)
+    monkeypatch.setattr(chat, "_persist_turn", first_save)
+
+    user_cache.clear()
+    with count_queries() as counter:
+        r = client.post(f"{API}/chat/board", json={"message": "Plan?"}, headers=auth)
+    assert r.status_code == 200
+    assert setup[0] <= budget_of("POST", "/chat/board")
+
+
+def test_history_with_archived_segments(client, auth, s3, run):
+    conversation_id = _conversation(client, auth)
+    client.post(f"{API}/chat/", json={"conversation_id": conversation_id, "message": "old"}, headers=auth)
+
+    async def archive():
+        async with async_session_factory() as session:
+            section = (await session.exec(
+                select(Section).join(Conversation, Conversation.section_id == Section.id)
+                .where(Conversation.id == uuid.UUID(conversation_id))
+            )).one()
+            await archive_conversation(session, uuid.UUID(conversation_id), section.org_id)
+    run(archive)
+    client.post(f"{API}/chat/", json={"conversation_id": conversation_id, "message": "new"}, headers=auth)
+
+    segment_cache.clear()
+    with within_budget("GET", "/chat/{conversation_id}/history"):
+        r = client.get(f"{API}/chat/{conversation_id}/history", headers=auth)
+    assert [m["content"] for m in r.json() if m["role"] == "user"] == ["old", "new"]
@@ -0,0 +1,62 @@
+from app.services.local_vector_index import metadata_matches
+from app.services.retrieval_eval import EvalResult, build_index, evaluate, mark_pareto, sweep
+from app.services.vector_service import build_filter
+
+DATASET = {
+    "documents": [
+        {"id": "pricing", "filename": "pricing.md", "sections": ["Sales"],
+         "text": "The Pro plan costs 49 dollars per seat per month, billed annually."},
+        {"id": "onboarding", "filename": "onboarding.pdf", "sections": ["People"],
+         "text": "New hires get a laptop and meet their buddy during the first week."},
+    ],
+    "questions": [
+        {"question": "How much does the Pro plan cost per seat?", "relevant": ["pricing"]},
+        {"question": "What do new hires get in their first week?", "relevant": ["onboarding"],
+         "scope": {"tags": ["People"]}},
+    ],
+}
+
+
+def result(recall, mrr, tokens, latency=1.0):
+    return EvalResult(top_k=1, chunk_size=500, rerank=0, lexical_weight=0.0, recall=recall, mrr=mrr,
+                      context_tokens=tokens, latency_ms=latency, p95_latency_ms=latency)
+
+
+def test_mark_pareto():
+    best = result(1.0, 1.0, 100, latency=50.0)
+    cheaper = result(0.5, 0.5, 10, latency=50.0)
+    dominated = result(0.5, 0.5, 100, latency=1.0)
+    mark_pareto([best, cheaper, dominated])
+    assert [best.pareto, cheaper.pareto, dominated.pareto] == [True, True, False]
+
+    # Faster than both, so it survives once latency counts
+    mark_pareto([best, cheaper, dominated], latency=True)
+    assert [best.pareto, cheaper.pareto, dominated.pareto] == [True, True, True]
+
+
+def test_evaluate_scores_labelled_questions():
+    service, labels = build_index(DATASET, chunk_size=500)
+    scored = evaluate(service, labels, DATASET["questions"], top_k=1, chunk_size=500, rerank=0)
+    assert scored.recall == 1.0
+    assert scored.mrr == 1.0
+    assert scored.context_tokens > 0
+
+
+def test_sweep_varies_lexical_weight():
+    results = sweep(DATASET, top_ks=[1], chunk_sizes=[500], reranks=[5], lexical_weights=[0.0, 0.6])
+    assert [r.lexical_weight for r in results] == [0.0, 0.6]
+    assert any(r.pareto for r in results)
+
+
+def test_build_filter_matches_scoped_metadata():
+    assert build_filter(None) is None
+    scope = build_filter({"tags": ["People"], "doc_types": [".PDF"]})
+    assert scope == {"$and": [{"sections": {"$in": ["People", "all"]}}, {"doc_type": {"$in": ["pdf"]}}]}
+
+    assert metadata_matches({"sections": ["People"], "doc_type": "pdf"}, scope)
+    assert metadata_matches({"sections": ["all"], "doc_type": "pdf"}, scope)
+    assert not metadata_matches({"sections": ["Sales"], "doc_type": "pdf"}, scope)
+    assert not metadata_matches({"sections": ["People"], "doc_type": "csv"}, scope)
+
+    tagged_only = build_filter({"tags": ["People"], "include_untagged": False})
+    assert not metadata_matches({"sections": ["all"]}, tagged_only)
@@ -0,0 +1,30 @@
+import pytest
+
+from app.services.local_vector_index import LocalVectorIndex
+from app.services.vector_service import VectorIndexError, VectorService
+
+
+class PodIndex(LocalVectorIndex):
+    # Pod-based Pinecone indexes can't list ids
+    def list_paginated(self, *args, **kwargs):
+        raise RuntimeError("list is not supported by pod-based indexes")
+
+
+def _service(index):
+    return VectorService(index=index, embedder=lambda texts: [[1.0, 0.0] for _ in texts], chunk_size=20)
+
+
+def test_delete_without_listing_removes_every_chunk():
+    service = _service(PodIndex())
+    service.add_document("doc-a", "word " * 50, {"sections": ["all"]}, "org")
+    service.add_document("doc-b", "other words", {"sections": ["all"]}, "org")
+
+    service.delete_document("doc-a", "org")
+    assert {m["doc_id"] for m in service.search_matches("word", "org", n_results=100)} == {"doc-b"}
+
+
+def test_retag_without_listing_fails_loudly():
+    service = _service(PodIndex())
+    service.add_document("doc-a", "word " * 50, {"sections": ["all"]}, "org")
+    with pytest.raises(VectorIndexError):
+        service.update_metadata("doc-a", {"sections": ["Sales"]}, "org")
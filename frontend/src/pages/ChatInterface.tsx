@@ -22,6 +22,13 @@ interface Message {
     timestamp: string;
 }
 
+const toMessages = (data: any[]): Message[] => data.map((m: any) => ({
+    id: m.id,
+    role: m.role,
+    content: m.content,
+    timestamp: m.timestamp
+}));
+
 export default function ChatInterface() {
     const { agentId } = useParams();
     const { sections, refreshCredits } = useOutletContext<{
@@ -79,6 +86,31 @@ export default function ChatInterface() {
 
     const [loading, setLoading] = useState(false);
     const [conversationId, setConversationId] = useState<string | null>(null);
+    // History comes in pages (newest first); older ones load on scroll-back
+    const [hasMore, setHasMore] = useState(false);
+    const [loadingOlder, setLoadingOlder] = useState(false);
+    const skipAutoScroll = useRef(false);
+    // Scroll events fire faster than state updates; this keeps it to one request
+    const olderInFlight = useRef(false);
+
+    const loadOlder = async () => {
+        if (!conversationId || olderInFlight.current) return;
+        const oldest = messages.find((m) => m.timestamp);
+        if (!oldest) return;
+        olderInFlight.current = true;
+        setLoadingOlder(true);
+        try {
+            const res = await api.get(`/chat/${conversationId}/history`, { params: { before: oldest.timestamp } });
+            skipAutoScroll.current = true;
+            setMessages(prev => [...toMessages(res.data), ...prev]);
+            setHasMore(res.headers['x-has-more'] === 'true');
+        } catch (err) {
+            console.error("Failed to load earlier messages", err);
+        } finally {
+            olderInFlight.current = false;
+            setLoadingOlder(false);
+        }
+    };
 
     // Initialize Conversation on Agent Switch
     useEffect(() => {
@@ -87,6 +119,7 @@ export default function ChatInterface() {
         const initChat = async () => {
             setMessages([]); // Clear previous chat
             setConversationId(null);
+            setHasMore(false);
             setLoading(true);
 
             try {
@@ -97,12 +130,8 @@ export default function ChatInterface() {
 
                 // 2. Fetch History
                 const historyRes = await api.get(`/chat/${convId}/history`);
-                const history = historyRes.data.map((m: any) => ({
-                    id: m.id,
-                    role: m.role,
-                    content: m.content,
-                    timestamp: m.timestamp
-                }));
+                const history = toMessages(historyRes.data);
+                setHasMore(historyRes.headers['x-has-more'] === 'true');
 
                 if (history.length > 0) {
                     setMessages(history);
@@ -123,6 +152,11 @@ export default function ChatInterface() {
 
     // Auto Scroll
     useEffect(() => {
+        if (skipAutoScroll.current) {
+            // Older messages were prepended: stay where the user scrolled to
+            skipAutoScroll.current = false;
+            return;
+        }
         if (scrollRef.current) {
             scrollRef.current.scrollIntoView({ behavior: 'smooth' });
         }
@@ -167,7 +201,19 @@ export default function ChatInterface() {
             <SEO title="Agent Chat" description="Interact with your AI agents." />
 
             {/* Messages Area - Scrollable */}
-            <div className="flex-1 overflow-y-auto p-4 md:p-8 space-y-6 pb-4 scroll-smooth">
+            <div
+                className="flex-1 overflow-y-auto p-4 md:p-8 space-y-6 pb-4 scroll-smooth"
+                onScroll={(e) => {
+                    if (hasMore && e.currentTarget.scrollTop < 50) loadOlder();
+                }}
+            >
+                {hasMore && (
+                    <div className="flex justify-center">
+                        <Button variant="ghost" size="sm" onClick={loadOlder} disabled={loadingOlder} className="text-slate-400 hover:text-white">
+                            {loadingOlder ? 'Loading…' : 'Load earlier messages'}
+                        </Button>
+                    </div>
+                )}
                 {messages.map((msg) => (
                     <div
                         key={msg.id}